@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Offline bulk generation I/O for the Hyv generation worker.
+
+Input is JSON lines, read as a stream, one item per line:
+
+    {"id": "faq-001", "prompt": "...", "config": {"max_tokens": 200}}
+
+`id` defaults to the line number and `config` may also be a JSON string,
+as in canister jobs. Output is JSON lines, or Parquet part files when the
+output path ends in `.parquet` (needs pyarrow).
+
+Results are written in flushes. Each flush is made durable first, then
+recorded in a checkpoint file together with the ids it holds and where the
+output ended. On restart, output past the last checkpoint is discarded, so
+an interrupted run resumes without duplicates or torn records.
+"""
+
+import os
+import json
+import glob
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def read_batch_items(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream normalized items ({id, prompt, config}) from a JSONL file"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"❌ Skipping line {line_no}: {e}")
+                continue
+            config = record.get("config") or {}
+            if isinstance(config, str):
+                config = json.loads(config)
+            yield {
+                "id": str(record.get("id", line_no)),
+                "prompt": record.get("prompt", ""),
+                "config": config,
+            }
+
+
+class BatchCheckpoint:
+    """Append-only, fsync'd record of flushed output"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        # Where the durable output ends: byte offset (JSONL) or part files (Parquet)
+        self.output_bytes = 0
+        self.parts: List[str] = []
+        # Whether this run resumes an earlier one
+        self.resumed = os.path.exists(path)
+        self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping truncated checkpoint record")
+                    continue
+                self.done.update(record["ids"])
+                if "output_bytes" in record:
+                    self.output_bytes = record["output_bytes"]
+                if "part" in record:
+                    self.parts.append(record["part"])
+
+    def record(self, ids: List[str], **fields):
+        self._file.write(json.dumps({"ids": ids, **fields}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.update(ids)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlOutput:
+    """Appends result records to a JSON-lines file"""
+
+    def __init__(self, path: str, checkpoint: BatchCheckpoint):
+        self.path = path
+        self.checkpoint = checkpoint
+        if checkpoint.resumed:
+            # Drop anything written after the last checkpoint (possibly torn)
+            with open(self.path, "a+b") as f:
+                f.truncate(checkpoint.output_bytes)
+        self._file = open(self.path, "ab")
+
+    def write(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.checkpoint.record([r["id"] for r in records], output_bytes=self._file.tell())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """Writes each flush as one part file in a `<name>.parquet` directory"""
+
+    def __init__(self, path: str, checkpoint: BatchCheckpoint, compression: str = "zstd"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("❌ Parquet output needs pyarrow: pip install pyarrow")
+        self._pa, self._pq = pa, pq
+        self.path = path
+        self.checkpoint = checkpoint
+        self.compression = compression
+        os.makedirs(self.path, exist_ok=True)
+
+        # Parts without a checkpoint record may be incomplete
+        for part in glob.glob(os.path.join(self.path, "part-*.parquet")):
+            if os.path.basename(part) not in checkpoint.parts:
+                os.remove(part)
+        self._next_part = len(checkpoint.parts)
+
+    def write(self, records: List[Dict[str, Any]]):
+        table = self._pa.Table.from_pylist([
+            {**r, "config": json.dumps(r["config"], sort_keys=True)} for r in records
+        ])
+        name = f"part-{self._next_part:05d}.parquet"
+        tmp_path = os.path.join(self.path, name + ".tmp")
+        self._pq.write_table(table, tmp_path, compression=self.compression)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, name))
+        self._next_part += 1
+        self.checkpoint.record([r["id"] for r in records], part=name)
+
+    def close(self):
+        pass
+
+
+def _has_content(path: str) -> bool:
+    if os.path.isdir(path):
+        return bool(os.listdir(path))
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+
+def open_batch_output(path: str, checkpoint_path: Optional[str] = None):
+    """Output writer for `path` plus its checkpoint (default `<path>.ckpt`)"""
+    checkpoint_path = checkpoint_path or path + ".ckpt"
+    # Resuming discards output past the checkpoint, so output that no
+    # checkpoint vouches for is not ours to touch
+    if not os.path.exists(checkpoint_path) and _has_content(path):
+        raise SystemExit(f"❌ {path} already exists and has no checkpoint ({checkpoint_path}); "
+                         f"choose a new output path or move it away")
+    checkpoint = BatchCheckpoint(checkpoint_path)
+    if path.endswith(".parquet"):
+        return ParquetOutput(path, checkpoint), checkpoint
+    return JsonlOutput(path, checkpoint), checkpoint
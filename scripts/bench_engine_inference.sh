@@ -0,0 +1,24 @@
+#!/bin/bash
+set -e
+
+# Local benchmark for on-canister DistilGPT-2 inference.
+# Prints model load cost, prompt prefill cost and instructions per generated
+# token for a few generation lengths. Each run must fit in one message
+# (40B instructions), which bounds how many tokens a timer tick can produce.
+# Requires a running local replica (dfx start --background) and the model
+# and tokenizer uploaded with upload_distilgpt2_model.py.
+
+cd "$(dirname "$0")/.."
+
+PROMPT=${PROMPT:-"Synthetic data generation on the Internet Computer"}
+
+echo "📦 Deploying AI engine..."
+dfx deploy hyv_ai_engine
+
+echo "🧠 Loading model..."
+dfx canister call hyv_ai_engine setup_models
+
+for tokens in 1 8 32; do
+    echo "⏱️  Generating $tokens tokens..."
+    dfx canister call hyv_ai_engine benchmark_text_generation "(\"$PROMPT\", $tokens : nat32)"
+done
@@ -0,0 +1,30 @@
+#!/bin/bash
+set -e
+
+# Local load test for the hyv_backend job queue.
+# Grows job history past 100k jobs and prints the instruction cost of each
+# queue operation; per-call cost should stay flat as history grows.
+# Requires a running local replica (dfx start --background).
+# The bench canister has its own dfx project in src/hyv_backend/bench, so a
+# plain `dfx deploy` of the app never ships it.
+
+cd "$(dirname "$0")/../src/hyv_backend/bench"
+
+LIVE=${LIVE:-100}
+BATCH=${BATCH:-20000}
+
+echo "📦 Deploying job queue bench canister..."
+dfx deploy hyv_job_queue_bench
+
+for target in 1000 10000 50000 100000 200000; do
+    current=$(dfx canister call hyv_job_queue_bench size | grep -o '[0-9_]\+' | head -1 | tr -d _)
+    while [ "$current" -lt "$target" ]; do
+        batch=$((target - current))
+        if [ "$batch" -gt "$BATCH" ]; then
+            batch=$BATCH
+        fi
+        dfx canister call hyv_job_queue_bench seed "($batch)" > /dev/null
+        current=$((current + batch))
+    done
+    dfx canister call hyv_job_queue_bench measure "($LIVE)"
+done
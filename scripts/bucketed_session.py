@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Shape-bucketed ONNX Runtime sessions for the Hyv generation worker.
+
+Sequences are right-padded to the smallest bucket that fits them, so short
+prompts only pay for short-sequence compute while long prompts still fit.
+Each (bucket, batch) pair keeps preallocated input/output buffers bound
+through IOBinding, so steady-state decoding does not allocate per step.
+The buffers are kept in an LRU cache bounded by BUFFER_CACHE_MB, since
+full logits at batch 8 and bucket 256 alone take about 400 MB.
+
+The model path can be a single ONNX file (dynamic or static sequence axis)
+or a bucket manifest written by `convert_models_fixed.py --buckets`.
+Exports with a `last_token_index` input (`--last-token`) apply the LM head
+only at each sequence's last real position and return (batch, vocab)
+logits, so the full (batch, bucket, vocab) tensor is never computed.
+"""
+
+import os
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_BUCKETS = (16, 32, 64, 128, 256)
+MAX_CONTEXT = 1024  # GPT-2 position embedding limit
+BUFFER_CACHE_MB = 512  # I/O buffers kept across calls, least recently used evicted first
+
+# Position id input name produced by older torchscript exports
+LEGACY_POSITION_INPUT = "onnx::Gather_1"
+
+
+class _BucketBuffers:
+    """Preallocated I/O buffers and IOBinding for one (bucket, batch) shape"""
+
+    def __init__(self, session: ort.InferenceSession, input_names: Dict[str, str],
+                 bucket: int, batch: int, vocab_size: int, pad_token_id: int):
+        self.bucket = bucket
+        self.batch = batch
+        self.pad_token_id = pad_token_id
+
+        self.input_ids = np.full((batch, bucket), pad_token_id, dtype=np.int64)
+        self.attention_mask = np.zeros((batch, bucket), dtype=np.int64)
+        self.position_ids = np.tile(np.arange(bucket, dtype=np.int64), (batch, 1))
+        self.last_token_index = np.zeros(batch, dtype=np.int64)
+        self.last_token_only = "last_token_index" in input_names
+        logits_shape = (batch, vocab_size) if self.last_token_only else (batch, bucket, vocab_size)
+        self.logits = np.empty(logits_shape, dtype=np.float32)
+
+        # OrtValues created from numpy share memory with the arrays, so
+        # refilling the arrays in place is enough between runs
+        self.binding = session.io_binding()
+        self.binding.bind_ortvalue_input(
+            input_names["input_ids"], ort.OrtValue.ortvalue_from_numpy(self.input_ids))
+        if "attention_mask" in input_names:
+            self.binding.bind_ortvalue_input(
+                input_names["attention_mask"], ort.OrtValue.ortvalue_from_numpy(self.attention_mask))
+        if "position_ids" in input_names:
+            self.binding.bind_ortvalue_input(
+                input_names["position_ids"], ort.OrtValue.ortvalue_from_numpy(self.position_ids))
+        if self.last_token_only:
+            self.binding.bind_ortvalue_input(
+                input_names["last_token_index"], ort.OrtValue.ortvalue_from_numpy(self.last_token_index))
+
+        output_name = session.get_outputs()[0].name
+        output_shape = _concrete_output_shape(session, batch, bucket, vocab_size)
+        self.binding.bind_ortvalue_output(
+            output_name, ort.OrtValue.ortvalue_from_numpy(self.logits.reshape(output_shape)))
+
+    @property
+    def nbytes(self) -> int:
+        return (self.logits.nbytes + self.input_ids.nbytes + self.attention_mask.nbytes
+                + self.position_ids.nbytes + self.last_token_index.nbytes)
+
+    def fill(self, sequences: Sequence[Sequence[int]]):
+        """Copy token sequences into the input buffers, right-padded"""
+        self.input_ids.fill(self.pad_token_id)
+        self.attention_mask.fill(0)
+        for row, tokens in enumerate(sequences):
+            length = len(tokens)
+            self.input_ids[row, :length] = tokens
+            self.attention_mask[row, :length] = 1
+            self.last_token_index[row] = length - 1
+
+
+def _concrete_output_shape(session: ort.InferenceSession, batch: int, bucket: int,
+                           vocab_size: int) -> Tuple[int, ...]:
+    """Resolve the logits output shape for a given batch and bucket"""
+    dims = session.get_outputs()[0].shape
+    if len(dims) == 2:
+        # Last-token export: one row of logits per sequence
+        return (batch, vocab_size)
+    if len(dims) == 3:
+        return (batch, bucket, vocab_size)
+    # Older static exports emit e.g. (1, 1, 10, 50257); all dims are fixed
+    if all(isinstance(d, int) for d in dims):
+        return tuple(dims)
+    raise ValueError(f"Unsupported logits output shape: {dims}")
+
+
+class BucketedSession:
+    """Routes batches of token sequences to the smallest fitting bucket"""
+
+    def __init__(self, model_path: str, buckets: Sequence[int] = SEQUENCE_BUCKETS,
+                 pad_token_id: int = 50256, max_context: int = MAX_CONTEXT,
+                 session_options: Optional[ort.SessionOptions] = None,
+                 buffer_cache_mb: int = BUFFER_CACHE_MB):
+        self.pad_token_id = pad_token_id
+        self.max_context = max_context
+        self.session_options = session_options or ort.SessionOptions()
+        self.buffer_cache_bytes = buffer_cache_mb * 1024 * 1024
+
+        # bucket length -> session serving it
+        self._sessions: Dict[int, ort.InferenceSession] = {}
+        # (bucket, batch) -> buffers, least recently used first
+        self._buffers: "OrderedDict[Tuple[int, int], _BucketBuffers]" = OrderedDict()
+        self._buffer_bytes = 0
+        self.dynamic = False
+
+        if model_path.endswith(".json"):
+            self._load_manifest(model_path)
+        else:
+            self._load_single(model_path, buckets)
+
+        self.buckets = sorted(self._sessions)
+        any_session = self._sessions[self.buckets[0]]
+        self.input_names = self._resolve_input_names(any_session)
+        self.last_token_only = "last_token_index" in self.input_names
+        self.vocab_size = any_session.get_outputs()[0].shape[-1]
+        if not isinstance(self.vocab_size, int):
+            raise ValueError("Model logits must have a fixed vocabulary dimension")
+
+        logger.info(f"Sequence buckets: {self.buckets} (dynamic={self.dynamic})")
+
+    def _create_session(self, path: str) -> ort.InferenceSession:
+        return ort.InferenceSession(path, self.session_options)
+
+    def _load_single(self, model_path: str, buckets: Sequence[int]):
+        session = self._create_session(model_path)
+        seq_dim = session.get_inputs()[0].shape[1]
+        if isinstance(seq_dim, int):
+            # Static export: the graph only accepts its own sequence length
+            self._sessions[seq_dim] = session
+            self.max_context = seq_dim
+        else:
+            self.dynamic = True
+            for bucket in buckets:
+                self._sessions[bucket] = session
+
+    def _load_manifest(self, manifest_path: str):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        base_dir = os.path.dirname(manifest_path)
+        for bucket, filename in manifest["buckets"].items():
+            self._sessions[int(bucket)] = self._create_session(os.path.join(base_dir, filename))
+        self.max_context = max(self._sessions)
+
+    @staticmethod
+    def _resolve_input_names(session: ort.InferenceSession) -> Dict[str, str]:
+        """Map logical input names to the names used by this export"""
+        names = {i.name for i in session.get_inputs()}
+        resolved = {"input_ids": "input_ids"}
+        if "attention_mask" in names:
+            resolved["attention_mask"] = "attention_mask"
+        if "position_ids" in names:
+            resolved["position_ids"] = "position_ids"
+        elif LEGACY_POSITION_INPUT in names:
+            resolved["position_ids"] = LEGACY_POSITION_INPUT
+        if "last_token_index" in names:
+            resolved["last_token_index"] = "last_token_index"
+        return resolved
+
+    @property
+    def max_sequence_length(self) -> int:
+        return self.max_context if self.dynamic else self.buckets[-1]
+
+    def bucket_for(self, length: int) -> int:
+        """Smallest bucket that fits a sequence of the given length"""
+        for bucket in self.buckets:
+            if length <= bucket:
+                return bucket
+        if self.dynamic and length <= self.max_context:
+            # Past the largest bucket, round up in steps of the largest bucket
+            step = self.buckets[-1]
+            return min(-(-length // step) * step, self.max_context)
+        raise ValueError(
+            f"Sequence of {length} tokens exceeds the maximum of {self.max_sequence_length}")
+
+    def _session_for(self, bucket: int) -> ort.InferenceSession:
+        if bucket in self._sessions:
+            return self._sessions[bucket]
+        # Dynamic graphs serve every bucket from one session
+        return self._sessions[self.buckets[-1]]
+
+    def _buffers_for(self, bucket: int, batch: int) -> _BucketBuffers:
+        key = (bucket, batch)
+        if key in self._buffers:
+            self._buffers.move_to_end(key)
+            return self._buffers[key]
+
+        buffers = _BucketBuffers(
+            self._session_for(bucket), self.input_names, bucket, batch,
+            self.vocab_size, self.pad_token_id)
+        # The new shape is always kept, even when it alone exceeds the budget
+        while self._buffers and self._buffer_bytes + buffers.nbytes > self.buffer_cache_bytes:
+            _, evicted = self._buffers.popitem(last=False)
+            self._buffer_bytes -= evicted.nbytes
+        self._buffers[key] = buffers
+        self._buffer_bytes += buffers.nbytes
+        return buffers
+
+    def _run(self, sequences: Sequence[Sequence[int]]) -> np.ndarray:
+        if not sequences:
+            raise ValueError("forward() needs at least one sequence")
+        bucket = self.bucket_for(max(len(s) for s in sequences))
+        buffers = self._buffers_for(bucket, len(sequences))
+        buffers.fill(sequences)
+        self._session_for(bucket).run_with_iobinding(buffers.binding)
+        return buffers.logits
+
+    def forward(self, sequences: Sequence[Sequence[int]]) -> np.ndarray:
+        """Run the model and return logits of shape (batch, bucket, vocab).
+
+        The returned array is a view into a reused buffer and is only valid
+        until the next call with the same bucket and batch size.
+        """
+        if self.last_token_only:
+            raise ValueError("This export only computes last-token logits; "
+                             "use a full-logits export for per-position scores")
+        return self._run(sequences)
+
+    def next_token_logits(self, sequences: Sequence[Sequence[int]]) -> np.ndarray:
+        """Logits at the last real position of each sequence, shape (batch, vocab)"""
+        if self.last_token_only:
+            return self._run(sequences).copy()
+        logits = self._run(sequences)
+        last_positions = np.array([len(s) - 1 for s in sequences])
+        return logits[np.arange(len(sequences)), last_positions].copy()
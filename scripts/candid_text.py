@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Parser for the Candid text that `dfx canister call` prints.
+
+Replies like `(vec { record { id = 3 : nat; owner = principal "aaaaa-aa";
+datasetId = null } })` become Python values: records are dicts, vecs are
+lists, `opt x` is x (or None), variants are `{tag: value}` dicts, numbers
+are ints or floats, and text, principals and blobs are strings/bytes.
+"""
+
+import re
+from typing import Any, List
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<number>[+-]?[0-9][0-9_]*(?:\.[0-9_]+)?(?:[eE][+-]?[0-9]+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<punct>[{}();=:,])
+    )""", re.VERBOSE)
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", '"': '"', "'": "'", "\\": "\\"}
+
+
+def _unescape(literal: str) -> bytes:
+    """Bytes of a Candid string literal (without the quotes)"""
+    out = bytearray()
+    i = 0
+    while i < len(literal):
+        c = literal[i]
+        if c != "\\":
+            out += c.encode("utf-8")
+            i += 1
+            continue
+        nxt = literal[i + 1]
+        if nxt in _ESCAPES:
+            out += _ESCAPES[nxt].encode("utf-8")
+            i += 2
+        elif nxt == "u":
+            end = literal.index("}", i)
+            out += chr(int(literal[i + 3:end], 16)).encode("utf-8")
+            i = end + 1
+        else:
+            out.append(int(literal[i + 1:i + 3], 16))
+            i += 3
+    return bytes(out)
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens: List[tuple] = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = _TOKEN.match(text, pos)
+            if not match or match.end() == pos:
+                raise ValueError(f"Unexpected Candid text at {pos}: {text[pos:pos + 20]!r}")
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind)))
+            pos = match.end()
+        self.i = 0
+
+    def peek(self, offset: int = 0) -> tuple:
+        i = self.i + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def take(self, expected: str = None) -> str:
+        kind, value = self.peek()
+        if kind is None or (expected is not None and value != expected):
+            raise ValueError(f"Expected {expected or 'a token'}, got {value!r}")
+        self.i += 1
+        return value
+
+    def values(self) -> List[Any]:
+        """Top-level `(v1, v2, ...)`"""
+        self.take("(")
+        items = []
+        while self.peek()[1] != ")":
+            items.append(self.value())
+            if self.peek()[1] == ",":
+                self.take(",")
+        self.take(")")
+        return items
+
+    def value(self) -> Any:
+        kind, token = self.peek()
+        if token == "(":
+            self.take("(")
+            inner = self.value()
+            self.take(")")
+            return inner
+        self.take()
+        if kind == "number":
+            value = float(token.replace("_", "")) if any(c in token for c in ".eE") else int(token.replace("_", ""))
+            self._skip_annotation()
+            return value
+        if kind == "string":
+            return _unescape(token[1:-1]).decode("utf-8", errors="replace")
+        if token in ("true", "false"):
+            return token == "true"
+        if token == "null":
+            return None
+        if token == "opt":
+            return self.value()
+        if token == "principal":
+            return self.value()
+        if token == "blob":
+            return _unescape(self.take()[1:-1])
+        if token == "vec":
+            return self._sequence(lambda: self.value())
+        if token == "record":
+            return dict(self._sequence(self._field))
+        if token == "variant":
+            return dict(self._sequence(self._field))
+        raise ValueError(f"Unsupported Candid value {token!r}")
+
+    def _skip_annotation(self):
+        if self.peek()[1] == ":":
+            self.take(":")
+            self.take()
+
+    def _sequence(self, item) -> List[Any]:
+        self.take("{")
+        items = []
+        while self.peek()[1] != "}":
+            items.append(item())
+            if self.peek()[1] == ";":
+                self.take(";")
+        self.take("}")
+        return items
+
+    def _field(self) -> tuple:
+        name = self.take()
+        if self.peek()[1] != "=":
+            return name, None  # variant tag without a value
+        self.take("=")
+        return name, self.value()
+
+
+def parse_reply(text: str) -> List[Any]:
+    """Values of a dfx reply such as `(42 : nat)` or `(vec { ... })`"""
+    parser = _Parser(text)
+    values = parser.values()
+    if parser.peek()[0] is not None:
+        raise ValueError("Trailing text after Candid reply")
+    return values
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Grammar-constrained decoding for structured (JSON / CSV) generation jobs.
+
+A job config with a `json_schema` or `csv_columns` spec is compiled into a
+character-level automaton, which is lifted to the GPT-2 vocabulary: for
+every automaton state, one int32 row over the vocabulary holds, per token,
+how many tokens are still needed to finish the output after emitting that
+token (or UNREACHABLE if the token breaks the grammar). Rows are built
+on first use with a walk over a trie of the vocabulary and cached with the
+compiled grammar, so later steps and later jobs reuse them.
+
+Masking a batch is then one vectorized comparison of the stacked rows with
+each sequence's remaining token budget, which also guarantees the output is
+complete before `max_tokens` runs out.
+
+    {"data_type": "json", "max_tokens": 120,
+     "json_schema": {"type": "object", "properties": {
+         "name": {"type": "string"}, "age": {"type": "integer"},
+         "plan": {"enum": ["free", "pro"]}, "tags": {"type": "array", "items": {"type": "string"}}}}}
+
+    {"data_type": "csv", "max_tokens": 200,
+     "csv_columns": [{"name": "city", "type": "string"}, {"name": "population", "type": "integer"}]}
+
+JSON output is one object per line, CSV output a header plus rows; both may
+stop after any complete object or row.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+UNREACHABLE = np.iinfo(np.int32).max
+MAX_CACHED_GRAMMARS = 32
+
+
+# ---- Character-level automaton ----
+
+def _is_digit(c: str) -> bool:
+    return "0" <= c <= "9"
+
+
+def _is_nonzero_digit(c: str) -> bool:
+    return "1" <= c <= "9"
+
+
+def _is_json_string_char(c: str) -> bool:
+    # No escapes: quotes, backslashes and control characters are left out
+    return c != '"' and c != "\\" and c >= " "
+
+
+def _is_csv_field_char(c: str) -> bool:
+    return c not in ',"\n\r' and c >= " "
+
+
+class _Node:
+    __slots__ = ("edges", "classes", "final")
+
+    def __init__(self):
+        self.edges: Dict[str, int] = {}
+        # (accepts, target, an accepted character)
+        self.classes: List[Tuple[Callable[[str], bool], int, str]] = []
+        self.final = False
+
+
+class CharAutomaton:
+    """Deterministic automaton over characters.
+
+    Grammars are assembled from fragments (entry node, exit nodes); joining
+    fragments merges the next entry's transitions into each exit, which is
+    deterministic as long as separators differ from the characters the
+    preceding fragment can continue with.
+    """
+
+    def __init__(self):
+        self.nodes: List[_Node] = []
+        self.start = 0
+        self._distances: Optional[List[int]] = None
+
+    def new(self) -> int:
+        self.nodes.append(_Node())
+        return len(self.nodes) - 1
+
+    def step(self, node: int, char: str) -> Optional[int]:
+        n = self.nodes[node]
+        target = n.edges.get(char)
+        if target is not None:
+            return target
+        for accepts, target, _ in n.classes:
+            if accepts(char):
+                return target
+        return None
+
+    def is_final(self, node: int) -> bool:
+        return self.nodes[node].final
+
+    def is_terminal(self, node: int) -> bool:
+        """Final with nothing left to add"""
+        n = self.nodes[node]
+        return n.final and not n.edges and not n.classes
+
+    def merge(self, node: int, entry: int):
+        """Let `node` continue the way `entry` starts"""
+        into, source = self.nodes[node], self.nodes[entry]
+        for char, target in source.edges.items():
+            if into.edges.get(char, target) != target:
+                raise ValueError(f"Ambiguous grammar at {char!r}")
+            into.edges[char] = target
+        into.classes.extend(source.classes)
+
+    def join(self, exits: Sequence[int], entry: int):
+        for node in exits:
+            self.merge(node, entry)
+
+    # -- Fragments: each returns (entry, exits) --
+
+    def literal(self, text: str) -> Tuple[int, List[int]]:
+        entry = node = self.new()
+        for char in text:
+            nxt = self.new()
+            self.nodes[node].edges[char] = nxt
+            node = nxt
+        return entry, [node]
+
+    def choice(self, texts: Sequence[str]) -> Tuple[int, List[int]]:
+        entry = self.new()
+        exits = []
+        for text in texts:
+            node = entry
+            for char in text:
+                nxt = self.nodes[node].edges.get(char)
+                if nxt is None:
+                    nxt = self.new()
+                    self.nodes[node].edges[char] = nxt
+                node = nxt
+            exits.append(node)
+        return entry, exits
+
+    def json_string(self) -> Tuple[int, List[int]]:
+        entry, body, end = self.new(), self.new(), self.new()
+        self.nodes[entry].edges['"'] = body
+        self.nodes[body].edges['"'] = end
+        self.nodes[body].classes.append((_is_json_string_char, body, "a"))
+        return entry, [end]
+
+    def integer(self) -> Tuple[int, List[int]]:
+        # JSON allows no leading zeros: a lone "0" ends the integer
+        entry, sign, zero, digits = self.new(), self.new(), self.new(), self.new()
+        self.nodes[entry].edges["-"] = sign
+        for node in (entry, sign):
+            self.nodes[node].edges["0"] = zero
+            self.nodes[node].classes.append((_is_nonzero_digit, digits, "1"))
+        self.nodes[digits].classes.append((_is_digit, digits, "0"))
+        return entry, [zero, digits]
+
+    def number(self) -> Tuple[int, List[int]]:
+        entry, exits = self.integer()
+        dot, fraction = self.new(), self.new()
+        for node in exits:
+            self.nodes[node].edges["."] = dot
+        for node in (dot, fraction):
+            self.nodes[node].classes.append((_is_digit, fraction, "0"))
+        return entry, exits + [fraction]
+
+    def csv_field(self) -> Tuple[int, List[int]]:
+        entry, body = self.new(), self.new()
+        for node in (entry, body):
+            self.nodes[node].classes.append((_is_csv_field_char, body, "a"))
+        return entry, [body]
+
+    def sequence(self, fragments: Sequence[Tuple[int, List[int]]]) -> Tuple[int, List[int]]:
+        entry, exits = fragments[0]
+        for next_entry, next_exits in fragments[1:]:
+            self.join(exits, next_entry)
+            exits = next_exits
+        return entry, exits
+
+    def repeat(self, make: Callable[[], Tuple[int, List[int]]], separator: str) -> Tuple[int, List[int]]:
+        """One or more `make()` fragments joined by `separator`"""
+        entry, exits = make()
+        sep_entry, sep_exits = self.literal(separator)
+        self.join(exits, sep_entry)
+        self.join(sep_exits, entry)
+        return entry, exits
+
+    # -- Completion distances --
+
+    def distances(self) -> List[int]:
+        """Fewest characters from each node to a final node"""
+        if self._distances is None:
+            reverse: List[List[int]] = [[] for _ in self.nodes]
+            for i, node in enumerate(self.nodes):
+                for target in list(node.edges.values()) + [t for _, t, _ in node.classes]:
+                    reverse[target].append(i)
+            dist = [UNREACHABLE] * len(self.nodes)
+            frontier = [i for i, node in enumerate(self.nodes) if node.final]
+            for i in frontier:
+                dist[i] = 0
+            while frontier:
+                nxt = []
+                for target in frontier:
+                    for source in reverse[target]:
+                        if dist[source] == UNREACHABLE:
+                            dist[source] = dist[target] + 1
+                            nxt.append(source)
+                frontier = nxt
+            self._distances = dist
+        return self._distances
+
+    def shortest_completion(self, node: int) -> Optional[str]:
+        """A shortest string that takes `node` to a final node"""
+        dist = self.distances()
+        if dist[node] == UNREACHABLE:
+            return None
+        chars = []
+        while dist[node] > 0:
+            n = self.nodes[node]
+            moves = list(n.edges.items()) + [(example, t) for _, t, example in n.classes]
+            char, node = next((c, t) for c, t in moves if dist[t] == dist[node] - 1)
+            chars.append(char)
+        return "".join(chars)
+
+
+def _json_value(automaton: CharAutomaton, schema: Dict[str, Any]) -> Tuple[int, List[int]]:
+    if "enum" in schema:
+        return automaton.choice([json.dumps(v) for v in schema["enum"]])
+    kind = schema.get("type", "string")
+    if kind == "string":
+        return automaton.json_string()
+    if kind == "integer":
+        return automaton.integer()
+    if kind == "number":
+        return automaton.number()
+    if kind == "boolean":
+        return automaton.choice(["true", "false"])
+    if kind == "object":
+        return _json_object(automaton, schema)
+    if kind == "array":
+        return _json_array(automaton, schema.get("items", {"type": "string"}))
+    raise ValueError(f"Unsupported JSON schema type: {kind!r}")
+
+
+def _json_object(automaton: CharAutomaton, schema: Dict[str, Any]) -> Tuple[int, List[int]]:
+    """All properties, in schema order, formatted like json.dumps"""
+    properties = schema.get("properties", {})
+    if not properties:
+        return automaton.literal("{}")
+    fragments = []
+    for i, (name, prop) in enumerate(properties.items()):
+        prefix = "{" if i == 0 else ", "
+        fragments.append(automaton.literal(f"{prefix}{json.dumps(name)}: "))
+        fragments.append(_json_value(automaton, prop))
+    fragments.append(automaton.literal("}"))
+    return automaton.sequence(fragments)
+
+
+def _json_array(automaton: CharAutomaton, items: Dict[str, Any]) -> Tuple[int, List[int]]:
+    entry, open_exits = automaton.literal("[")
+    close, close_exits = automaton.literal("]")
+    item_entry, item_exits = automaton.repeat(lambda: _json_value(automaton, items), ", ")
+    automaton.join(open_exits, item_entry)
+    automaton.join(open_exits, close)
+    automaton.join(item_exits, close)
+    return entry, close_exits
+
+
+def _csv_value(automaton: CharAutomaton, column: Dict[str, Any]) -> Tuple[int, List[int]]:
+    if "values" in column:
+        return automaton.choice([str(v) for v in column["values"]])
+    kind = column.get("type", "string")
+    if kind == "integer":
+        return automaton.integer()
+    if kind == "number":
+        return automaton.number()
+    if kind == "boolean":
+        return automaton.choice(["true", "false"])
+    if kind == "string":
+        return automaton.csv_field()
+    raise ValueError(f"Unsupported CSV column type: {kind!r}")
+
+
+def compile_grammar(config: Dict[str, Any]) -> Optional[CharAutomaton]:
+    """Character automaton for a job's `json_schema` / `csv_columns`, if any"""
+    automaton = CharAutomaton()
+    if config.get("json_schema"):
+        schema = config["json_schema"]
+        if schema.get("type", "object") != "object":
+            raise ValueError("json_schema must describe an object")
+        entry, exits = automaton.repeat(lambda: _json_object(automaton, schema), "\n")
+    elif config.get("csv_columns"):
+        columns = config["csv_columns"]
+        header = ",".join(c["name"] for c in columns) + "\n"
+
+        def row():
+            fragments = []
+            for i, column in enumerate(columns):
+                if i > 0:
+                    fragments.append(automaton.literal(","))
+                fragments.append(_csv_value(automaton, column))
+            fragments.append(automaton.literal("\n"))
+            return automaton.sequence(fragments)
+
+        header_entry, header_exits = automaton.literal(header)
+        row_entry, row_exits = row()
+        automaton.join(header_exits, row_entry)
+        automaton.join(row_exits, row_entry)
+        entry, exits = header_entry, row_exits
+    else:
+        return None
+
+    for node in exits:
+        automaton.nodes[node].final = True
+    automaton.start = entry
+    return automaton
+
+
+def is_constrained_config(config: Dict[str, Any]) -> bool:
+    return bool(config.get("json_schema") or config.get("csv_columns"))
+
+
+# ---- Token level ----
+
+class TokenVocabulary:
+    """Decoded vocabulary as a character trie, shared by all grammars"""
+
+    def __init__(self, token_bytes: Sequence[bytes], eos_token_id: int):
+        self.size = len(token_bytes)
+        self.eos_token_id = eos_token_id
+        # Trie node: (children by character, ids of tokens ending here)
+        self.root: Tuple[Dict[str, tuple], List[int]] = ({}, [])
+        for token_id, raw in enumerate(token_bytes):
+            if not raw:
+                continue
+            try:
+                text = raw.decode("utf-8")
+            except UnicodeDecodeError:
+                # Partial characters never take part in constrained output
+                continue
+            node = self.root
+            for char in text:
+                node = node[0].setdefault(char, ({}, []))
+            node[1].append(token_id)
+
+    def count_tokens(self, text: str) -> int:
+        """Tokens in a greedy longest-match split of `text` (an upper bound
+        on its shortest tokenization); every ASCII character is a token"""
+        count, i = 0, 0
+        while i < len(text):
+            node, end = self.root, i + 1
+            for j in range(i, len(text)):
+                node = node[0].get(text[j])
+                if node is None:
+                    break
+                if node[1]:
+                    end = j + 1
+            count += 1
+            i = end
+        return count
+
+
+class TokenAutomaton:
+    """A compiled grammar lifted to token level, with per-state rows cached"""
+
+    def __init__(self, chars: CharAutomaton, vocabulary: TokenVocabulary):
+        self.chars = chars
+        self.vocabulary = vocabulary
+        self._rows: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+        # Tokens needed to finish from each state: the greedy split of a
+        # shortest completion, which is a valid token path
+        self.distances = np.full(len(chars.nodes), UNREACHABLE, dtype=np.int32)
+        for node in range(len(chars.nodes)):
+            completion = chars.shortest_completion(node)
+            if completion is not None:
+                self.distances[node] = vocabulary.count_tokens(completion)
+
+    @property
+    def start(self) -> int:
+        return self.chars.start
+
+    def min_tokens(self) -> int:
+        return int(self.distances[self.chars.start])
+
+    def row(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(characters left to finish after each token, state after each token)"""
+        cached = self._rows.get(node)
+        if cached is not None:
+            return cached
+
+        next_node = np.full(self.vocabulary.size, -1, dtype=np.int32)
+        stack = [(self.vocabulary.root, node)]
+        while stack:
+            (children, _), state = stack.pop()
+            for char, child in children.items():
+                target = self.chars.step(state, char)
+                if target is None:
+                    continue
+                if child[1]:
+                    next_node[child[1]] = target
+                if child[0]:
+                    stack.append((child, target))
+
+        completion = np.where(next_node >= 0, self.distances[next_node], UNREACHABLE).astype(np.int32)
+        if self.chars.is_final(node):
+            completion[self.vocabulary.eos_token_id] = 0
+            next_node[self.vocabulary.eos_token_id] = node
+
+        self._rows[node] = (completion, next_node)
+        return completion, next_node
+
+
+class GrammarState:
+    """Where one sequence is in its grammar"""
+
+    def __init__(self, automaton: TokenAutomaton):
+        self.automaton = automaton
+        self.node = automaton.start
+
+    def advance(self, token_id: int):
+        self.node = int(self.automaton.row(self.node)[1][token_id])
+
+    @property
+    def finished(self) -> bool:
+        return self.automaton.chars.is_terminal(self.node)
+
+
+def constrain_logits(logits: np.ndarray, states: Sequence[Optional[GrammarState]],
+                     remaining: Sequence[int]) -> np.ndarray:
+    """Mask a (batch, vocab) logits array to grammar-valid, finishable tokens.
+
+    Rows without a grammar state are left as they are. A token is allowed
+    when the output can still be completed in the tokens left after it.
+    """
+    vocab = logits.shape[-1]
+    rows = []
+    for state in states:
+        if state is None:
+            rows.append(np.zeros(vocab, dtype=np.int32))
+            continue
+        completion = state.automaton.row(state.node)[0]
+        if len(completion) < vocab:
+            completion = np.pad(completion, (0, vocab - len(completion)), constant_values=UNREACHABLE)
+        rows.append(completion[:vocab])
+    budgets = np.asarray(remaining, dtype=np.int64)[:, None] - 1
+    return np.where(np.stack(rows) <= budgets, logits, -np.inf)
+
+
+class GrammarCompiler:
+    """Compiles and caches token automata per grammar spec"""
+
+    def __init__(self, vocabulary: TokenVocabulary, max_cached: int = MAX_CACHED_GRAMMARS):
+        self.vocabulary = vocabulary
+        self.max_cached = max_cached
+        self._automata: "OrderedDict[str, TokenAutomaton]" = OrderedDict()
+
+    def state_for(self, config: Dict[str, Any], max_tokens: int) -> Optional[GrammarState]:
+        """Fresh grammar state for a job config, or None if it is unconstrained"""
+        if not is_constrained_config(config):
+            return None
+        key = json.dumps({"json_schema": config.get("json_schema"),
+                          "csv_columns": config.get("csv_columns")}, sort_keys=True)
+        automaton = self._automata.get(key)
+        if automaton is None:
+            automaton = TokenAutomaton(compile_grammar(config), self.vocabulary)
+            self._automata[key] = automaton
+            if len(self._automata) > self.max_cached:
+                self._automata.popitem(last=False)
+        else:
+            self._automata.move_to_end(key)
+
+        if automaton.min_tokens() > max_tokens:
+            raise ValueError(f"max_tokens={max_tokens} is too small for the requested structure "
+                             f"(needs at least {automaton.min_tokens()})")
+        return GrammarState(automaton)
@@ -9,6 +9,7 @@ import transformers
 from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, T5ForConditionalGeneration
 import os
 import sys
+import json
 import numpy as np
 from pathlib import Path
 
@@ -18,34 +19,144 @@ def setup_directories():
     os.makedirs("models/test", exist_ok=True)
     print("📁 Created model directories")
 
+# Sequence-length buckets for the static-shape DistilGPT-2 variants. The
+# worker pads each batch to the smallest bucket that fits it.
+SEQUENCE_BUCKETS = (16, 32, 64, 128, 256)
+BUCKET_MANIFEST = "models/distilgpt2_buckets.json"
+WITH_PAST_PATH = "models/distilgpt2_with_past.onnx"
+LAST_TOKEN_PATH = "models/distilgpt2_last_token.onnx"
+LAST_TOKEN_MANIFEST = "models/distilgpt2_last_token_buckets.json"
+
+class CausalLMExportWrapper(torch.nn.Module):
+    """Expose input_ids/attention_mask/position_ids as named graph inputs"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids):
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=False,
+            return_dict=False
+        )
+        return outputs[0]
+
+class LastTokenExportWrapper(torch.nn.Module):
+    """Apply the LM head only at last_token_index, returning (batch, vocab) logits"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids, last_token_index):
+        hidden = self.model.transformer(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=False,
+            return_dict=False
+        )[0]
+        # Gather one hidden state per row before the vocab projection
+        index = last_token_index.view(-1, 1, 1).expand(-1, 1, hidden.shape[-1])
+        last_hidden = hidden.gather(1, index).squeeze(1)
+        return self.model.lm_head(last_hidden)
+
+class CausalLMWithPastExportWrapper(torch.nn.Module):
+    """Take past keys/values as flat inputs and return logits plus presents"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        past_key_values = tuple((past[i], past[i + 1]) for i in range(0, len(past), 2))
+        try:
+            from transformers import DynamicCache
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        except ImportError:
+            pass
+        logits, present = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=False
+        )[:2]
+        if hasattr(present, "to_legacy_cache"):
+            present = present.to_legacy_cache()
+        return (logits,) + tuple(t for layer in present for t in layer)
+
+def load_distilgpt2_for_export(last_token=False):
+    """Load DistilGPT-2 wrapped for ONNX export"""
+    model = AutoModelForCausalLM.from_pretrained("distilgpt2")
+    model.eval()
+    model.config.use_cache = False
+    if last_token:
+        return LastTokenExportWrapper(model).eval()
+    return CausalLMExportWrapper(model).eval()
+
+def export_causal_lm(wrapper, output_path, sequence_length, dynamic=True):
+    """Export a wrapped causal LM with (batch, sequence) shaped inputs.
+
+    The batch axis is always dynamic; `dynamic=False` only fixes the
+    sequence axis at `sequence_length` (the bucketed variants).
+
+    A LastTokenExportWrapper gets an extra `last_token_index` input of
+    shape (batch,) and a (batch, vocab) logits output.
+    """
+    last_token = isinstance(wrapper, LastTokenExportWrapper)
+    dummy_input_ids = torch.randint(0, 50257, (1, sequence_length))
+    dummy_attention_mask = torch.ones((1, sequence_length), dtype=torch.long)
+    dummy_position_ids = torch.arange(sequence_length, dtype=torch.long).unsqueeze(0)
+    dummy_inputs = (dummy_input_ids, dummy_attention_mask, dummy_position_ids)
+    input_names = ["input_ids", "attention_mask", "position_ids"]
+    if last_token:
+        dummy_inputs += (torch.full((1,), sequence_length - 1, dtype=torch.long),)
+        input_names.append("last_token_index")
+
+    sequence_axis = {1: "sequence"} if dynamic else {}
+    dynamic_axes = {
+        "input_ids": {0: "batch_size", **sequence_axis},
+        "attention_mask": {0: "batch_size", **sequence_axis},
+        "position_ids": {0: "batch_size", **sequence_axis},
+        "logits": {0: "batch_size"} if last_token else {0: "batch_size", **sequence_axis}
+    }
+    if last_token:
+        dynamic_axes["last_token_index"] = {0: "batch_size"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            dummy_inputs,
+            output_path,
+            export_params=True,
+            opset_version=14,
+            do_constant_folding=True,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes
+        )
+
 def convert_distilgpt2():
     """Convert DistilGPT-2 for text generation - Fixed version"""
     print("\n🔄 Converting DistilGPT-2...")
     print("=" * 50)
     
     try:
-        # Load with simplified configuration
-        model = AutoModelForCausalLM.from_pretrained(
-            "distilgpt2",
-            torchscript=True,
-            return_dict=False  # Add this
-        )
-        model.eval()
+        wrapper = load_distilgpt2_for_export()
         
-        # Use a longer dummy input to avoid masking issues
-        dummy_input = torch.randint(0, 50257, (1, 10))  # Longer sequence
-        
-        # Export with simpler parameters
+        # Export with dynamic batch and sequence axes so prompts are not
+        # truncated to the dummy input length
         output_path = "models/distilgpt2.onnx"
-        torch.onnx.export(
-            model,
-            dummy_input,
-            output_path,
-            export_params=True,
-            opset_version=14,  # Try newer opset
-            input_names=["input_ids"],
-            output_names=["logits"]
-        )
+        export_causal_lm(wrapper, output_path, sequence_length=10, dynamic=True)
+        
+        # Save tokenizer alongside the model for the worker
+        tokenizer = AutoTokenizer.from_pretrained("distilgpt2")
+        tokenizer.save_pretrained("models/distilgpt2_tokenizer")
         
         # Check file size and return success
         size_mb = os.path.getsize(output_path) / (1024 * 1024)
@@ -59,6 +170,126 @@ def convert_distilgpt2():
         print(f"❌ Error: {e}")
         return None, 0
 
+def convert_distilgpt2_last_token(output_path=LAST_TOKEN_PATH):
+    """Export DistilGPT-2 computing logits only at each row's last token.
+
+    Generation only samples from the final position, so the full
+    (batch, sequence, vocab) logits are wasted work and memory. This
+    variant gathers the hidden states at `last_token_index` before the LM
+    head, and BucketedSession fills that input from the sequence lengths.
+    """
+    print("\n🔄 Converting DistilGPT-2 (last-token logits)...")
+    print("=" * 50)
+    
+    try:
+        wrapper = load_distilgpt2_for_export(last_token=True)
+        export_causal_lm(wrapper, output_path, sequence_length=10, dynamic=True)
+        
+        size_mb = os.path.getsize(output_path) / (1024 * 1024)
+        print(f"✅ DistilGPT-2 last-token variant converted successfully!")
+        print(f"📁 File: {output_path}")
+        print(f"📊 Size: {size_mb:.1f} MB")
+        
+        return output_path, size_mb
+        
+    except Exception as e:
+        print(f"❌ Error converting last-token variant: {e}")
+        return None, 0
+
+def convert_distilgpt2_with_past(output_path=WITH_PAST_PATH):
+    """Export DistilGPT-2 with past_key_values inputs and present outputs.
+
+    The worker's paged KV cache (--paged-kv) feeds each step one new token
+    plus the cached keys/values instead of the whole sequence.
+    """
+    print("\n🔄 Converting DistilGPT-2 with KV cache inputs...")
+    print("=" * 50)
+    
+    try:
+        model = AutoModelForCausalLM.from_pretrained("distilgpt2")
+        model.eval()
+        config = model.config
+        wrapper = CausalLMWithPastExportWrapper(model).eval()
+        
+        num_heads = config.n_head
+        head_dim = config.n_embd // config.n_head
+        past_length, new_length = 4, 2
+        dummy_input_ids = torch.randint(0, 50257, (1, new_length))
+        dummy_attention_mask = torch.ones((1, past_length + new_length), dtype=torch.long)
+        dummy_position_ids = torch.arange(past_length, past_length + new_length, dtype=torch.long).unsqueeze(0)
+        dummy_past = []
+        past_names, present_names = [], []
+        for layer in range(config.n_layer):
+            for kind in ("key", "value"):
+                dummy_past.append(torch.zeros((1, num_heads, past_length, head_dim)))
+                past_names.append(f"past_key_values.{layer}.{kind}")
+                present_names.append(f"present.{layer}.{kind}")
+        
+        dynamic_axes = {
+            "input_ids": {0: "batch_size", 1: "sequence"},
+            "attention_mask": {0: "batch_size", 1: "total_sequence"},
+            "position_ids": {0: "batch_size", 1: "sequence"},
+            "logits": {0: "batch_size", 1: "sequence"}
+        }
+        for name in past_names:
+            dynamic_axes[name] = {0: "batch_size", 2: "past_sequence"}
+        for name in present_names:
+            dynamic_axes[name] = {0: "batch_size", 2: "total_sequence"}
+        
+        with torch.no_grad():
+            torch.onnx.export(
+                wrapper,
+                (dummy_input_ids, dummy_attention_mask, dummy_position_ids, *dummy_past),
+                output_path,
+                export_params=True,
+                opset_version=14,
+                do_constant_folding=True,
+                input_names=["input_ids", "attention_mask", "position_ids"] + past_names,
+                output_names=["logits"] + present_names,
+                dynamic_axes=dynamic_axes
+            )
+        
+        size_mb = os.path.getsize(output_path) / (1024 * 1024)
+        print(f"✅ DistilGPT-2 with past converted successfully!")
+        print(f"📁 File: {output_path}")
+        print(f"📊 Size: {size_mb:.1f} MB")
+        
+        return output_path, size_mb
+        
+    except Exception as e:
+        print(f"❌ Error converting with-past variant: {e}")
+        return None, 0
+
+def convert_distilgpt2_buckets(buckets=SEQUENCE_BUCKETS, last_token=False):
+    """Export static-shape DistilGPT-2 variants, one per sequence bucket"""
+    print("\n🔄 Converting DistilGPT-2 bucketed variants...")
+    print("=" * 50)
+    
+    try:
+        wrapper = load_distilgpt2_for_export(last_token=last_token)
+        manifest_path = LAST_TOKEN_MANIFEST if last_token else BUCKET_MANIFEST
+        suffix = "_last_token" if last_token else ""
+        manifest = {"model": "distilgpt2", "buckets": {}}
+        total_mb = 0
+        
+        for bucket in buckets:
+            output_path = f"models/distilgpt2{suffix}_s{bucket}.onnx"
+            export_causal_lm(wrapper, output_path, sequence_length=bucket, dynamic=False)
+            size_mb = os.path.getsize(output_path) / (1024 * 1024)
+            total_mb += size_mb
+            manifest["buckets"][str(bucket)] = os.path.basename(output_path)
+            print(f"✅ Bucket {bucket}: {output_path} ({size_mb:.1f} MB)")
+        
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"📁 Manifest: {manifest_path}")
+        
+        return manifest_path, total_mb
+        
+    except Exception as e:
+        print(f"❌ Error converting bucketed variants: {e}")
+        return None, 0
+
 def convert_codet5():
     """Convert CodeT5-small for code generation - Fixed for T5 architecture"""
     print("\n🔄 Converting CodeT5-small...")
@@ -244,10 +475,16 @@ def test_onnx_model(model_path, tokenizer_path, test_prompt, model_type="gpt"):
         
         # Run inference based on model type
         if model_type == "gpt":
-            outputs = session.run(
-                None,
-                {"input_ids": inputs["input_ids"]}
-            )
+            input_ids = inputs["input_ids"]
+            feeds = {"input_ids": input_ids}
+            input_names = {i.name for i in session.get_inputs()}
+            if "attention_mask" in input_names:
+                feeds["attention_mask"] = inputs["attention_mask"]
+            if "position_ids" in input_names:
+                feeds["position_ids"] = np.arange(input_ids.shape[1], dtype=np.int64).reshape(1, -1)
+            if "last_token_index" in input_names:
+                feeds["last_token_index"] = np.array([input_ids.shape[1] - 1], dtype=np.int64)
+            outputs = session.run(None, feeds)
         else:  # T5
             decoder_input_ids = np.zeros((1, 1), dtype=np.int64)
             outputs = session.run(
@@ -262,7 +499,8 @@ def test_onnx_model(model_path, tokenizer_path, test_prompt, model_type="gpt"):
         logits = outputs[0]
         print(f"✅ ONNX inference successful!")
         print(f"📊 Output shape: {logits.shape}")
-        print(f"🎯 Sample logits: {logits[0, -1, :5]}")
+        last_logits = logits[0] if logits.ndim == 2 else logits[0, -1]
+        print(f"🎯 Sample logits: {last_logits[:5]}")
         
         return True
         
@@ -297,6 +535,34 @@ def main():
             "gpt"
         )
     
+    # Optional static-shape variants for bucketed inference
+    if "--buckets" in sys.argv:
+        manifest_path, buckets_size = convert_distilgpt2_buckets()
+        if manifest_path:
+            total_size += buckets_size
+    
+    # Optional variant that only computes next-token logits
+    if "--last-token" in sys.argv:
+        last_path, last_size = convert_distilgpt2_last_token()
+        if last_path:
+            total_size += last_size
+            test_onnx_model(
+                last_path,
+                "models/distilgpt2_tokenizer",
+                "Generate synthetic customer data:",
+                "gpt"
+            )
+        if "--buckets" in sys.argv:
+            manifest_path, buckets_size = convert_distilgpt2_buckets(last_token=True)
+            if manifest_path:
+                total_size += buckets_size
+    
+    # Optional KV-cache variant for the worker's --paged-kv mode
+    if "--with-past" in sys.argv:
+        past_path, past_size = convert_distilgpt2_with_past()
+        if past_path:
+            total_size += past_size
+    
     # Try CodeT5 first, then fallback to GPT-2
     codet5_path, codet5_size = convert_codet5()
     if codet5_path:
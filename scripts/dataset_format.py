@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Columnar storage for generated tabular datasets.
+
+Tabular job output (CSV or JSON lines from the tabular engine) is stored on
+the backend as Parquet with zstd-compressed column chunks instead of text,
+which is several times smaller for synthetic tables. Free text stays UTF-8.
+
+The backend serves dataset bytes by range (HTTP Range at /datasets/<id>),
+so a reader never needs the whole file: it reads the Parquet footer, then
+only the column chunks of the columns and row groups it asks for. These
+responses are not certified, so use the raw domain
+(<backend>.raw.icp0.io); the gateway at <backend>.icp0.io rejects them.
+
+    python scripts/dataset_format.py https://<backend>.raw.icp0.io/datasets/12 \\
+        --columns age,income --row-groups 0 --output sample.csv
+
+Needs pyarrow.
+"""
+
+import io
+import sys
+import hashlib
+import argparse
+import logging
+import urllib.request
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+ROW_GROUP_ROWS = 65536
+COMPRESSION = "zstd"
+RANGE_BLOCK_SIZE = 1 << 20  # bytes per ranged read
+PARSE_BLOCK_SIZE = 16 << 20  # text bytes parsed per block when encoding
+
+
+def _pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.csv
+        import pyarrow.json
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def content_sha256(data: bytes) -> str:
+    """Hex SHA-256, as the backend records it in `fileHash`"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_dataset(content: str, table_format: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    """Bytes to store for a dataset and their content type (None: UTF-8 text).
+
+    `table_format` is "csv" or "json" (JSON lines) for tabular engine
+    output, which becomes Parquet; anything else is stored as text.
+    """
+    data = content.encode("utf-8")
+    if table_format not in ("csv", "json"):
+        return data, None
+
+    pa = _pyarrow()
+    if pa is None:
+        logger.warning("⚠️  pyarrow not installed, storing tabular dataset as text")
+        return data, None
+
+    try:
+        encoded, rows = _parquet_stream(pa, data, table_format)
+    except pa.ArrowInvalid:
+        # Types were inferred from the first block and a later one disagrees
+        if table_format == "json":
+            table = pa.json.read_json(io.BytesIO(data))
+        else:
+            table = pa.csv.read_csv(io.BytesIO(data), parse_options=pa.csv.ParseOptions(newlines_in_values=True))
+        buffer = io.BytesIO()
+        pa.parquet.write_table(table, buffer, compression=COMPRESSION, row_group_size=ROW_GROUP_ROWS)
+        encoded, rows = buffer.getvalue(), table.num_rows
+    logger.info(f"🗜️  {rows:,} rows: {len(data):,} bytes as {table_format}, "
+                f"{len(encoded):,} as Parquet ({len(data) / max(len(encoded), 1):.1f}x)")
+    return encoded, PARQUET_CONTENT_TYPE
+
+
+def _parquet_stream(pa, data: bytes, table_format: str) -> Tuple[bytes, int]:
+    """Parquet bytes and row count, parsing and writing a block at a time, so
+    the rows are never held as a second full copy of the table"""
+    source = io.BytesIO(data)
+    if table_format == "json":
+        open_json = getattr(pa.json, "open_json", None)  # pyarrow >= 19
+        if open_json is None:
+            batches = pa.json.read_json(source).to_batches(ROW_GROUP_ROWS)
+            schema = batches[0].schema if batches else pa.schema([])
+        else:
+            batches = open_json(source, read_options=pa.json.ReadOptions(block_size=PARSE_BLOCK_SIZE))
+            schema = batches.schema
+    else:
+        batches = pa.csv.open_csv(source, read_options=pa.csv.ReadOptions(block_size=PARSE_BLOCK_SIZE),
+                                  parse_options=pa.csv.ParseOptions(newlines_in_values=True))
+        schema = batches.schema
+
+    buffer = io.BytesIO()
+    rows = 0
+    with pa.parquet.ParquetWriter(buffer, schema, compression=COMPRESSION) as writer:
+        for batch in batches:
+            writer.write_batch(batch, row_group_size=ROW_GROUP_ROWS)
+            rows += batch.num_rows
+    return buffer.getvalue(), rows
+
+
+class HttpRangeFile(io.RawIOBase):
+    """Read-only, seekable file over HTTP Range requests.
+
+    Reads are served from the last fetched block, so pyarrow's small footer
+    reads cost one request; column chunks are fetched as they are read.
+    """
+
+    def __init__(self, url: str, block_size: int = RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.position = 0
+        self.bytes_fetched = 0
+        self._block_start = 0
+        self._block = b""
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request) as response:
+            self.size = int(response.headers["Content-Length"])
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, min(offset, self.size))
+        return self.position
+
+    def _fetch(self, start: int, length: int) -> bytes:
+        stop = min(self.size, start + length) - 1
+        request = urllib.request.Request(self.url, headers={"Range": f"bytes={start}-{stop}"})
+        with urllib.request.urlopen(request) as response:
+            data = response.read()
+        self.bytes_fetched += len(data)
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b""
+
+        offset = self.position - self._block_start
+        if 0 <= offset and offset + size <= len(self._block):
+            data = self._block[offset:offset + size]
+        elif size >= self.block_size:
+            data = self._fetch(self.position, size)
+        else:
+            self._block_start = self.position
+            self._block = self._fetch(self.position, self.block_size)
+            data = self._block[:size]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def read_projection(source, columns: Optional[List[str]] = None,
+                    row_groups: Optional[List[int]] = None):
+    """Arrow table with only `columns` of only `row_groups` (default: all).
+
+    `source` is a path, a URL of a backend dataset download, or a file-like
+    object; only the footer and the selected column chunks are read.
+    """
+    pa = _pyarrow()
+    if pa is None:
+        raise RuntimeError("Reading columnar datasets needs pyarrow: pip install pyarrow")
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        source = HttpRangeFile(source)
+
+    parquet = pa.parquet.ParquetFile(source)
+    if row_groups is None:
+        return parquet.read(columns=columns)
+    return parquet.read_row_groups(row_groups, columns=columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch a column/row-group projection of a Parquet dataset")
+    parser.add_argument("source", help="dataset URL (https://<backend>.raw.icp0.io/datasets/<id>) or local .parquet file")
+    parser.add_argument("--columns", help="comma-separated column names (default: all)")
+    parser.add_argument("--row-groups", help="comma-separated row group indexes (default: all)")
+    parser.add_argument("--output", help="write the projection as CSV (default: print the schema and row groups)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    columns = args.columns.split(",") if args.columns else None
+    row_groups = [int(g) for g in args.row_groups.split(",")] if args.row_groups else None
+
+    source = args.source
+    if source.startswith(("http://", "https://")):
+        source = HttpRangeFile(source)
+
+    if not args.output:
+        # Footer only
+        metadata = _pyarrow().parquet.ParquetFile(source).metadata
+        print(metadata.schema.to_arrow_schema(), file=sys.stdout)
+        for group in range(metadata.num_row_groups):
+            print(f"row group {group}: {metadata.row_group(group).num_rows:,} rows", file=sys.stdout)
+        return
+
+    table = read_projection(source, columns, row_groups)
+    if isinstance(source, HttpRangeFile):
+        logger.info(f"📥 Fetched {source.bytes_fetched:,} of {source.size:,} bytes")
+    logger.info(f"✅ {table.num_rows:,} rows x {table.num_columns} columns")
+    _pyarrow().csv.write_csv(table, args.output)
+    logger.info(f"💾 Written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
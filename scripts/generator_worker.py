@@ -5,18 +5,42 @@ Hyv Off-Chain AI Generation Worker
 This worker polls the Hyv backend canister for pending generation jobs,
 runs inference using local ONNX models, and stores the results back
 to the canister for marketplace distribution.
+
+With --batch it instead generates a JSONL file of prompts offline, for bulk
+backfills (see batch_generation.py).
 """
 
+import os
+import re
 import time
 import json
+import argparse
 import subprocess
+import tempfile
 import logging
+import multiprocessing
 import sys
-from typing import Dict, List, Optional, Any
+from collections import deque
+from typing import Callable, Dict, List, Optional, Any, Tuple
 import onnxruntime as ort
 import numpy as np
 from transformers import AutoTokenizer
 
+from bucketed_session import BucketedSession
+from tokenization import TokenizationService
+from shared_weights import SharedWeights
+from result_cache import ResultCache, cache_key, is_deterministic
+from job_journal import JobJournal, content_hash
+from batch_generation import read_batch_items, open_batch_output
+from tabular_engine import generate_tabular, is_tabular_config, tabular_format
+from dataset_format import encode_dataset, content_sha256
+from speculative_decoding import SpeculativeDecoder
+from constrained_decoding import GrammarCompiler, TokenVocabulary, constrain_logits, is_constrained_config
+from job_scheduler import CostModel, JobScheduler, PRIORITY_CLASSES
+from candid_text import parse_reply
+from job_output import JobOutputStream, STREAM_INTERVAL
+from paged_kv_cache import PagedSession, KV_DTYPES, STEP_MB
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,32 +49,235 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuration
+# MODEL_PATH may also point at a bucket manifest (distilgpt2_buckets.json) or
+# a last-token export (distilgpt2_last_token.onnx), which returns only the
+# (batch, vocab) logits the decode loop samples from
 MODEL_PATH = "/home/kingtom/Desktop/examples/rust/face-recognition/hyv/models/distilgpt2.onnx"
+# --speculative: the larger GPT-2 export verifies, DistilGPT-2 drafts
+TARGET_MODEL_PATH = "/home/kingtom/Desktop/examples/rust/face-recognition/hyv/models/gpt2-code.onnx"
+# --paged-kv: with-past export (convert_models_fixed.py --with-past) decoding on a paged KV cache
+PAST_MODEL_PATH = "/home/kingtom/Desktop/examples/rust/face-recognition/hyv/models/distilgpt2_with_past.onnx"
 TOKENIZER_PATH = "/home/kingtom/Desktop/examples/rust/face-recognition/hyv/models/distilgpt2_tokenizer"
 CANISTER_ID = "hyv_backend"  # Use canister name instead of full ID
 POLL_INTERVAL = 10  # seconds
+RESULT_CACHE_PATH = "worker_cache.sqlite"
+RESULT_CACHE_MAX_MB = 512
+JOURNAL_PATH = "worker_journal.jsonl"
+BATCH_SIZE = 8  # sequences decoded together per forward pass (--batch mode, num_samples streams)
+MAX_SAMPLES = 1000  # upper bound on a job's num_samples
+BATCH_FLUSH_EVERY = 64  # results per durable output flush in --batch mode
+KV_CACHE_MB = 512  # paged KV pool per inference process (split across --workers)
+UPLOAD_CHUNK_BYTES = 1_000_000  # per appendDatasetUpload call; one ingress message holds about 2 MiB
+
+# Set in forked inference children; they reuse the parent's worker object
+_CHILD_WORKER = None
+
+
+def _init_inference_child(worker, shared_weights: SharedWeights,
+                          draft_weights: Optional[SharedWeights] = None, output_queue=None):
+    """Pool initializer: bind the parent's mapped weights into a child session"""
+    global _CHILD_WORKER
+    worker.session = BucketedSession(
+        shared_weights.graph_path,
+        pad_token_id=worker.tokenizer.pad_token_id,
+        session_options=shared_weights.session_options()
+    )
+    if draft_weights is not None:
+        draft_session = BucketedSession(
+            draft_weights.graph_path,
+            pad_token_id=worker.tokenizer.pad_token_id,
+            session_options=draft_weights.session_options()
+        )
+        worker.speculative = SpeculativeDecoder(worker.session, draft_session, worker.tokenizer.eos_token_id)
+    # Forked children would otherwise share the parent's RNG state
+    worker.rng = np.random.default_rng()
+    if worker.paged_model_path:
+        # Each child owns its share of the KV budget
+        worker.paged = PagedSession(worker.paged_model_path, worker.kv_cache_mb // worker.workers,
+                                    kv_dtype=worker.kv_dtype)
+    worker._pool = None
+    # Partial output goes back to the parent, the only process calling dfx
+    worker._child_output = output_queue
+    _CHILD_WORKER = worker
+
+
+def _child_generate(job_id: int, prompt: str, config: Dict[str, Any]) -> Tuple[str, float]:
+    started = time.perf_counter()
+    content = _CHILD_WORKER.generate_streamed(job_id, prompt, config)
+    return content, time.perf_counter() - started
+
+
+def _child_generate_batch(prompts: List[str], configs: List[Dict[str, Any]]) -> List[str]:
+    return _CHILD_WORKER.generate_batch(prompts, configs)
+
+
+def _num_samples(config: Dict[str, Any]) -> int:
+    """Samples a job asks for; tabular jobs size themselves with `rows`"""
+    if is_tabular_config(config):
+        return 1
+    num_samples = max(int(config.get("num_samples", 1)), 1)
+    if num_samples > MAX_SAMPLES:
+        logger.warning(f"num_samples {num_samples} capped at {MAX_SAMPLES}")
+    return min(num_samples, MAX_SAMPLES)
+
+
+def output_format(config: Dict[str, Any]) -> Optional[str]:
+    """Table format of a job's dataset ("json" lines or "csv"), None for plain text"""
+    if _num_samples(config) > 1:
+        return "csv" if config.get("csv_columns") else "json"
+    return tabular_format(config)
+
+
+def _assemble_samples(samples: List[str], config: Dict[str, Any]) -> str:
+    """Join a multi-sample job's outputs into one dataset"""
+    if config.get("csv_columns"):
+        # Every sample starts with the header; keep the first one
+        lines = samples[0].strip().splitlines()[:1]
+        for sample in samples:
+            lines.extend(line for line in sample.strip().splitlines()[1:] if line)
+        return "\n".join(lines) + "\n"
+    if config.get("json_schema"):
+        return "".join(line + "\n" for sample in samples for line in sample.splitlines() if line.strip())
+    return "".join(json.dumps({"sample": i, "text": text}) + "\n" for i, text in enumerate(samples))
+
+
+def _parse_nat(output: str) -> int:
+    """Value of a `(123 : nat)` reply; raises when the reply is not a nat"""
+    if "(" in output and ": nat)" in output:
+        return int(output.split("(")[1].split(":")[0].strip().replace("_", ""))
+    raise ValueError(f"Could not parse nat from: {output}")
+
+
+def _candid_blob(data: bytes) -> str:
+    """Candid blob literal for `data`"""
+    return 'blob "' + "".join(f"\\{b:02x}" for b in data) + '"'
+
+
+def _candid_text(value: str) -> str:
+    """Candid text literal for `value`"""
+    escaped = []
+    for c in value:
+        if c in '"\\':
+            escaped.append("\\" + c)
+        elif c == "\n":
+            escaped.append("\\n")
+        elif ord(c) < 0x20:
+            escaped.append(f"\\u{{{ord(c):x}}}")
+        else:
+            escaped.append(c)
+    return '"' + "".join(escaped) + '"'
+
 
 class HyvGenerationWorker:
-    def __init__(self, model_path: str, tokenizer_path: str, canister_id: str):
-        """Initialize the worker with model and canister details"""
+    def __init__(self, model_path: str, tokenizer_path: str, canister_id: str, workers: int = 1,
+                 cache_path: Optional[str] = RESULT_CACHE_PATH,
+                 cache_max_mb: int = RESULT_CACHE_MAX_MB,
+                 journal_path: str = JOURNAL_PATH, draft_model_path: Optional[str] = None,
+                 stream_interval: float = STREAM_INTERVAL, paged_model_path: Optional[str] = None,
+                 kv_cache_mb: int = KV_CACHE_MB, kv_dtype: str = "fp32",
+                 owner_policy: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Initialize the worker with model and canister details.
+
+        With a draft model, free-text generation is speculative: the draft
+        proposes tokens and `model_path` verifies them. Partial output is
+        pushed to the canister every `stream_interval` seconds (0: never).
+        With a with-past model, batched decoding (batches, samples,
+        structured jobs) runs on a paged KV cache of `kv_cache_mb`.
+        `owner_policy` maps owner principals to a fair-share `weight` and
+        the most urgent `max_priority` class their jobs may use.
+        """
         self.canister_id = canister_id
+        self.workers = workers
+        self.stream_interval = stream_interval
+        self._pool = None
+        self._output_queue = None
+        self._child_output = None
+        self.speculative: Optional[SpeculativeDecoder] = None
+        self.paged: Optional[PagedSession] = None
+        self.paged_model_path = paged_model_path
+        self.kv_cache_mb = kv_cache_mb
+        self.kv_dtype = kv_dtype
+
+        # Stage transitions survive crashes so finished inference is never redone
+        self.journal = JobJournal(journal_path, canister_id)
+
+        # Deterministic results are reused across identical jobs
+        model_stat = os.stat(model_path)
+        self.model_id = f"{os.path.basename(model_path)}:{model_stat.st_size}:{int(model_stat.st_mtime)}"
+        if draft_model_path:
+            # Same distribution, but seeded samples differ from plain decoding
+            self.model_id += f"+draft:{os.path.basename(draft_model_path)}"
+        if paged_model_path:
+            # Reduced-precision KV storage changes sampled output slightly
+            self.model_id += f"+kv:{kv_dtype}"
+        self.result_cache = None
+        if cache_path:
+            self.result_cache = ResultCache(cache_path, max_bytes=cache_max_mb * 1024 * 1024)
 
         # Load tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenization = TokenizationService(self.tokenizer)
+        # Orders pending jobs by priority class, owner fairness, cost and deadline
+        owner_policy = owner_policy or {}
+        self.scheduler = JobScheduler(
+            CostModel(self.model_id, lambda p: len(self.tokenization.encode(p))),
+            owner_weights={o: float(p["weight"]) for o, p in owner_policy.items() if "weight" in p},
+            owner_classes={o: p["max_priority"] for o, p in owner_policy.items() if "max_priority" in p})
+        # Built on the first json_schema / csv_columns job
+        self._grammars: Optional[GrammarCompiler] = None
 
-        # Load ONNX model
-        logger.info("Loading DistilGPT-2 model...")
-        self.session = ort.InferenceSession(model_path)
+        self.rng = np.random.default_rng()
 
-        # Print model inputs for debugging
-        logger.info("Model inputs:")
-        for input in self.session.get_inputs():
-            logger.info(f"  {input.name}: {input.shape} {input.type}")
+        if workers > 1:
+            # Parent keeps canister I/O; children run inference on shared weights
+            self.session = None
+            self._start_inference_pool(model_path, workers, draft_model_path)
+        else:
+            # Load ONNX model behind shape-bucketed sessions
+            logger.info(f"Loading {os.path.basename(model_path)}...")
+            self.session = BucketedSession(model_path, pad_token_id=self.tokenizer.pad_token_id)
+
+            # Print model inputs for debugging
+            logger.info(f"Model inputs: {self.session.input_names}")
+
+            if draft_model_path:
+                logger.info(f"Loading draft model {os.path.basename(draft_model_path)}...")
+                draft_session = BucketedSession(draft_model_path, pad_token_id=self.tokenizer.pad_token_id)
+                self.speculative = SpeculativeDecoder(self.session, draft_session, self.tokenizer.eos_token_id)
+
+            if paged_model_path:
+                logger.info(f"Loading {os.path.basename(paged_model_path)} for paged KV decoding...")
+                self.paged = PagedSession(paged_model_path, kv_cache_mb, kv_dtype=kv_dtype)
 
         logger.info("✅ Model loaded successfully")
 
+    def _start_inference_pool(self, model_path: str, workers: int, draft_model_path: Optional[str] = None):
+        """Map the weights once and fork inference children that share them"""
+        if model_path.endswith(".json"):
+            raise ValueError("Multi-process mode needs a single dynamic-axis ONNX model")
+
+        logger.info(f"Loading shared {os.path.basename(model_path)} weights for {workers} inference processes...")
+        self.shared_weights = SharedWeights(model_path)
+        self.shared_weights.prefault()
+        self.draft_weights = None
+        if draft_model_path:
+            self.draft_weights = SharedWeights(draft_model_path)
+            self.draft_weights.prefault()
+
+        # Forked children must not spin up their own tokenizer thread pools
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        context = multiprocessing.get_context("fork")
+        # Children queue (job id, text) partial output, then (job id, None)
+        if self.stream_interval > 0:
+            self._output_queue = context.Queue()
+        self._pool = context.Pool(
+            processes=workers,
+            initializer=_init_inference_child,
+            initargs=(self, self.shared_weights, self.draft_weights, self._output_queue)
+        )
+
     def _load_model(self):
         """Load the ONNX model and tokenizer"""
         try:
@@ -92,45 +319,119 @@ class HyvGenerationWorker:
             raise
 
     def list_pending_jobs(self) -> List[Dict[str, Any]]:
-        """Get list of pending jobs from canister"""
+        """Get list of pending jobs from canister.
+
+        Each job is a dict with id, owner (principal text), prompt, config
+        (JSON text) and createdAt (nanoseconds).
+        """
         try:
             output = self._run_dfx_command("listPendingJobs")
             logger.debug(f"listPendingJobs output: {output}")
-
-            # For now, return empty list since parsing Candid is complex
-            # In a real implementation, you'd parse the Candid output properly
-            # For testing, we'll simulate having jobs
-            return []
+            jobs = parse_reply(output)[0]
+            return [{key: job[key] for key in ("id", "owner", "prompt", "config", "createdAt")}
+                    for job in jobs]
 
         except Exception as e:
             logger.error(f"Failed to list pending jobs: {e}")
             return []
 
-    def upload_dataset(self, title: str, description: str, content: str) -> int:
-        """Upload generated dataset to canister"""
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """A job as the canister has it (status as {"<Variant>": None}), or None"""
+        return parse_reply(self._run_dfx_command(f"getJob '({job_id})'"))[0]
+
+    def upload_dataset(self, title: str, description: str, content: str,
+                       job_id: Optional[int] = None, table_format: Optional[str] = None) -> int:
+        """Upload generated dataset to canister.
+
+        With a job id the upload is keyed to that job, so a retry after a
+        crash returns the dataset created by the first attempt. Tabular
+        content (`table_format` "csv" or "json") is uploaded as Parquet.
+        """
+        data, content_type = encode_dataset(content, table_format)
+        if content_type is not None:
+            return self._upload_dataset_blob(title, description, data, content_type, job_id)
+
         try:
             # Escape strings for shell
             title_escaped = title.replace('"', '\\"').replace('$', '\\$')
             desc_escaped = description.replace('"', '\\"').replace('$', '\\$')
             content_escaped = content.replace('"', '\\"').replace('$', '\\$')
 
-            command = f'uploadDataset "(\\"{title_escaped}\\", \\"{desc_escaped}\\", vec {{\\"synthetic\\"; \\"ai-generated\\"}}, \\"hash_placeholder\\", \\"{content_escaped}\\")"'
+            args = f'\\"{title_escaped}\\", \\"{desc_escaped}\\", vec {{\\"synthetic\\"; \\"ai-generated\\"}}, \\"hash_placeholder\\", \\"{content_escaped}\\"'
+            if job_id is not None:
+                command = f'uploadDatasetForJob "({job_id}, {args})"'
+            else:
+                command = f'uploadDataset "({args})"'
             output = self._run_dfx_command(command)
 
-            # Extract dataset ID from output (simple parsing)
             # Output format: "(123 : nat)"
-            if "(" in output and ": nat)" in output:
-                dataset_id = int(output.split("(")[1].split(":")[0].strip())
-                logger.info(f"✅ Dataset uploaded with ID: {dataset_id}")
-                return dataset_id
-            else:
-                logger.warning(f"Could not parse dataset ID from: {output}")
-                return 0
+            dataset_id = _parse_nat(output)
+            logger.info(f"✅ Dataset uploaded with ID: {dataset_id}")
+            return dataset_id
 
         except Exception as e:
             logger.error(f"Failed to upload dataset: {e}")
             raise
 
+    def _call_with_argument_file(self, method: str, args: str) -> str:
+        """Call `method` with Candid `args` too long for a command line"""
+        with tempfile.NamedTemporaryFile("w", suffix=".did", delete=False, encoding="utf-8") as f:
+            f.write(args)
+        try:
+            return self._run_dfx_command(f"{method} --argument-file {f.name}")
+        finally:
+            os.remove(f.name)
+
+    def _upload_dataset_blob(self, title: str, description: str, data: bytes,
+                             content_type: str, job_id: Optional[int]) -> int:
+        """Upload binary dataset content.
+
+        Content that fits in one message goes through uploadDatasetBlob;
+        anything larger is staged in UPLOAD_CHUNK_BYTES chunks and committed.
+        Both are keyed to the job, so a retried upload returns the dataset
+        created by the first attempt.
+        """
+        job = f"opt {job_id}" if job_id is not None else "null"
+        metadata = (f'{job}, {_candid_text(title)}, {_candid_text(description)}, '
+                    f'vec {{"synthetic"; "ai-generated"; "tabular"}}, {_candid_text(content_type)}')
+
+        if len(data) <= UPLOAD_CHUNK_BYTES:
+            output = self._call_with_argument_file("uploadDatasetBlob", f'({metadata}, {_candid_blob(data)})')
+            dataset_id = _parse_nat(output)
+        else:
+            dataset_id = self._upload_dataset_chunked(metadata, data)
+
+        logger.info(f"✅ Dataset uploaded with ID: {dataset_id} "
+                    f"({len(data):,} bytes, sha256 {content_sha256(data)[:16]}...)")
+        return dataset_id
+
+    def _upload_dataset_chunked(self, metadata: str, data: bytes) -> int:
+        output = self._call_with_argument_file("beginDatasetUpload", f"({metadata})")
+        existing = re.search(r"datasetId = opt \(?([\d_]+)", output)
+        if existing:
+            return int(existing.group(1).replace("_", ""))
+        match = re.search(r"uploadId = ([\d_]+)", output)
+        if not match:
+            raise ValueError(f"Could not parse upload id from: {output}")
+        upload_id = int(match.group(1).replace("_", ""))
+
+        seq = 0
+        chunks = range(0, len(data), UPLOAD_CHUNK_BYTES)
+        while seq < len(chunks):
+            start = chunks[seq]
+            chunk = data[start:start + UPLOAD_CHUNK_BYTES]
+            # The reply is the next chunk the canister expects
+            seq = _parse_nat(self._call_with_argument_file(
+                "appendDatasetUpload", f"({upload_id}, {seq}, {_candid_blob(chunk)})"))
+        return _parse_nat(self._run_dfx_command(f"commitDatasetUpload '({upload_id}, {len(data)})'"))
+
+    def append_job_output(self, job_id: int, seq: int, text: str) -> Tuple[int, bool]:
+        """Push chunk `seq` of a job's partial output; returns the next seq
+        expected and whether the canister has stopped storing the job's output"""
+        output = self._call_with_argument_file("appendJobOutput", f"({job_id}, {seq}, {_candid_text(text)})")
+        ack = parse_reply(output)[0]
+        return int(ack["nextSeq"]), bool(ack["truncated"])
+
     def mark_job_complete(self, job_id: int, dataset_id: int) -> bool:
         """Mark job as completed"""
         try:
@@ -142,180 +443,738 @@ class HyvGenerationWorker:
             logger.error(f"Failed to mark job complete: {e}")
             raise
 
-    def generate_text(self, prompt: str, max_tokens: int = 50) -> str:
-        """Generate text using the ONNX model"""
+    def _sample_token(self, logits: np.ndarray, temperature: float,
+                      rng: Optional[np.random.Generator] = None) -> int:
+        """Sample a token id from a single row of logits"""
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        scaled = logits.astype(np.float64) / temperature
+        scaled -= scaled.max()
+        probs = np.exp(scaled)
+        probs /= probs.sum()
+        return int((rng or self.rng).choice(len(probs), p=probs))
+
+    def generate_text(self, prompt: str, max_tokens: int = 50, temperature: float = 0.7,
+                      seed: Optional[int] = None, data_type: str = "text",
+                      on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Generate text using the ONNX model (speculatively with a draft model).
+
+        `on_text` receives the decoded text as it is generated.
+        """
         try:
             logger.info(f"Generating text for prompt: {prompt}")
 
-            # Tokenize input with fixed length padding
-            inputs = self.tokenizer(
-                prompt,
-                return_tensors="np",
-                padding="max_length",  # Pad to max_length
-                truncation=True,
-                max_length=10  # Fixed size for ONNX model
-            )
-            input_ids = inputs["input_ids"]
-            attention_mask = inputs["attention_mask"]
-
-            # Create position IDs (required for DistilGPT-2)
-            # Position IDs should be 0 to seq_length-1, but masked for padding
-            seq_length = input_ids.shape[1]
-            position_ids = np.arange(seq_length, dtype=np.int64).reshape(1, -1)
-
-            logger.info(f"Input shape: {input_ids.shape}, Position IDs shape: {position_ids.shape}")
-            logger.info(f"Input IDs: {input_ids}")
-            logger.info(f"Attention Mask: {attention_mask}")
-
-            # Run inference with all required inputs
-            outputs = self.session.run(["logits"], {
-                "input_ids": input_ids,
-                "onnx::Gather_1": position_ids
-            })
+            # A seeded job gets its own generator so its output is reproducible
+            rng = np.random.default_rng(seed) if seed is not None else self.rng
 
-            # Get logits - handle 4D output from ONNX model
-            logits = outputs[0]  # Shape: (1, 1, 10, 50257)
-            logits = logits.squeeze(0).squeeze(0)  # Shape: (10, 50257)
+            # Tokenize without padding; the session pads to the smallest
+            # sequence bucket that fits
+            tokens = self.tokenization.encode(prompt)
+            max_length = self.session.max_sequence_length
+            if len(tokens) >= max_length:
+                logger.warning(f"Prompt has {len(tokens)} tokens, keeping the last {max_length - 1}")
+                tokens = tokens[-(max_length - 1):]
 
-            # Get the last non-padded token's logits for generation
-            # Find the last non-pad token (pad token is 50256)
-            attention_mask_flat = attention_mask[0]  # Shape: (10,)
-            last_token_idx = np.where(attention_mask_flat == 1)[0][-1]  # Last non-pad position
+            logger.info(f"Prompt tokens: {len(tokens)}, bucket: {self.session.bucket_for(len(tokens))}")
 
-            next_token_logits = logits[last_token_idx, :]  # Shape: (50257,)
+            detokenizer = self.tokenization.detokenizer()
 
-            # Apply temperature and get probabilities
-            temperature = 0.7
-            next_token_logits = next_token_logits / temperature
-            probs = np.exp(next_token_logits) / np.sum(np.exp(next_token_logits))
+            def push(token_id: int):
+                piece = detokenizer.push(token_id)
+                if on_text is not None:
+                    on_text(piece)
 
-            # Sample next token
-            next_token_id = np.random.choice(len(probs), p=probs)
+            generated_count = 0
+            if self.speculative is not None:
+                # Acceptance differs by data type, so k adapts per type
+                generated_count = len(self.speculative.generate(
+                    tokens, max_tokens, temperature, rng, profile=data_type, on_token=push))
+            else:
+                for _ in range(max_tokens):
+                    # Slide the context window once the largest bucket is full
+                    context = tokens[-max_length:]
+                    next_token_logits = self.session.next_token_logits([context])[0]
+                    next_token_id = self._sample_token(next_token_logits, temperature, rng)
+                    if next_token_id == self.tokenizer.eos_token_id:
+                        break
+                    tokens.append(next_token_id)
+                    push(next_token_id)
+                    generated_count += 1
 
-            # Decode the generated token
-            generated_text = self.tokenizer.decode([next_token_id], skip_special_tokens=True)
+            piece = detokenizer.flush()
+            if on_text is not None:
+                on_text(piece)
+            generated_text = detokenizer.text
 
-            logger.info(f"Generated text: '{generated_text}'")
+            logger.info(f"Generated {generated_count} tokens: '{generated_text[:100]}'")
             return generated_text
 
         except Exception as e:
             logger.error(f"Text generation failed: {e}")
             raise
 
-    def process_job(self, job: Dict[str, Any]) -> bool:
-        """Process a single job"""
+    def _grammar_state(self, config: Dict[str, Any], max_tokens: int):
+        """Constrained-decoding state for a structured job, or None"""
+        if not is_constrained_config(config):
+            return None
+        if self._grammars is None:
+            if self.tokenization.token_bytes is None:
+                raise ValueError("Constrained decoding needs a byte-level BPE tokenizer")
+            self._grammars = GrammarCompiler(
+                TokenVocabulary(self.tokenization.token_bytes, self.tokenizer.eos_token_id))
+        return self._grammars.state_for(config, max_tokens)
+
+    def _decode_state(self, tokens: List[int], config: Dict[str, Any], seed: Optional[int],
+                      on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Per-sequence decoding state for generate_batch/generate_samples"""
+        max_tokens = config.get("max_tokens", 100)
+        return {
+            "tokens": tokens,
+            "remaining": max_tokens,
+            "grammar": self._grammar_state(config, max_tokens),
+            "temperature": config.get("temperature", 0.7),
+            "rng": np.random.default_rng(seed) if seed is not None else self.rng,
+            "detokenizer": self.tokenization.detokenizer(),
+            "on_text": on_text,
+        }
+
+    def _sample_step(self, active: List[Dict[str, Any]], logits: np.ndarray) -> List[Dict[str, Any]]:
+        """Sample one token for each active state; returns the states still running"""
+        grammars = [state["grammar"] for state in active]
+        if any(grammar is not None for grammar in grammars):
+            logits = constrain_logits(logits, grammars, [state["remaining"] for state in active])
+        still_active = []
+        for state, row in zip(active, logits):
+            token_id = self._sample_token(row, state["temperature"], state["rng"])
+            if token_id == self.tokenizer.eos_token_id:
+                continue
+            state["tokens"].append(token_id)
+            piece = state["detokenizer"].push(token_id)
+            if state["on_text"] is not None:
+                state["on_text"](piece)
+            state["remaining"] -= 1
+            if state["grammar"] is not None:
+                state["grammar"].advance(token_id)
+                if state["grammar"].finished:
+                    continue
+            if state["remaining"] > 0:
+                still_active.append(state)
+        return still_active
+
+    def _finish_states(self, states: List[Dict[str, Any]]) -> List[str]:
+        results = []
+        for state in states:
+            piece = state["detokenizer"].flush()
+            if state["on_text"] is not None:
+                state["on_text"](piece)
+            results.append(state["detokenizer"].text)
+        return results
+
+    def _decode(self, states: List[Dict[str, Any]], first_logits: Optional[np.ndarray] = None):
+        """Decode states in lockstep, one batched forward pass per step.
+
+        `first_logits`, if given, replaces the first forward pass: a single
+        row shared by every state, for sequences that all start from the
+        same prompt.
+        """
+        if self.paged is not None:
+            return self._decode_paged(states)
+        max_length = self.session.max_sequence_length
+        active = [state for state in states if state["remaining"] > 0]
+        while active:
+            if first_logits is not None:
+                logits = np.broadcast_to(first_logits, (len(active), first_logits.shape[-1]))
+                first_logits = None
+            else:
+                logits = self.session.next_token_logits([state["tokens"][-max_length:] for state in active])
+            active = self._sample_step(active, logits)
+        return self._finish_states(states)
+
+    def _decode_paged(self, states: List[Dict[str, Any]], parent: Optional[int] = None,
+                      parent_logits: Optional[np.ndarray] = None) -> List[str]:
+        """_decode on the paged KV cache: one prefill per sequence, then one
+        token per sequence per step.
+
+        Sequences are admitted while the cache has pages for their prompt
+        plus max_tokens; the rest wait for running ones to finish. With a
+        `parent`, sequences fork its cached prompt instead of prefilling.
+        Prompts too long for the context keep their trailing window, as in
+        _decode; max_tokens is cut only if it alone exceeds the context.
+        """
+        paged = self.paged
+        waiting = deque(state for state in states if state["remaining"] > 0)
+        for state in waiting:
+            if parent is None:
+                state["tokens"] = self._paged_window(state["tokens"], state["remaining"])
+            state["remaining"] = min(state["remaining"], paged.max_context - len(state["tokens"]))
+            grammar = state["grammar"]
+            if grammar is not None and grammar.automaton.min_tokens() > state["remaining"]:
+                raise ValueError(f"Only {state['remaining']} tokens fit in the {paged.max_context}-token "
+                                 f"context, the requested structure needs at least "
+                                 f"{grammar.automaton.min_tokens()}")
+        active: List[Dict[str, Any]] = []
         try:
-            job_id = job.get("id")
-            prompt = job.get("prompt", "")
-            config_str = job.get("config", "{}")
+            while waiting or active:
+                while waiting:
+                    state = waiting[0]
+                    needed = len(state["tokens"]) + state["remaining"]
+                    if not paged.can_admit(needed, parent):
+                        if active:
+                            break
+                        raise MemoryError(f"KV cache cannot hold a {needed}-token sequence; "
+                                          f"raise --kv-cache-mb")
+                    waiting.popleft()
+                    if parent is not None:
+                        state["seq"] = paged.fork(parent, needed)
+                        state["logits"] = parent_logits
+                    else:
+                        state["seq"], state["logits"] = paged.prefill(state["tokens"], needed)
+                    active.append(state)
 
-            logger.info(f"🔄 Processing job {job_id}: {prompt[:50]}...")
+                still_active = self._sample_step(active, np.stack([state["logits"] for state in active]))
+                running = {id(state) for state in still_active}
+                for state in active:
+                    if id(state) not in running:
+                        paged.free(state.pop("seq"))
+                if still_active:
+                    rows = paged.step([state["seq"] for state in still_active],
+                                      [state["tokens"][-1] for state in still_active])
+                    for state, row in zip(still_active, rows):
+                        state["logits"] = row
+                active = still_active
+        finally:
+            for state in states:
+                if "seq" in state:
+                    paged.free(state.pop("seq"))
+        logger.debug(f"KV cache after decode: {paged.cache.stats()}")
+        return self._finish_states(states)
 
-            # Parse config
-            config = json.loads(config_str)
-            max_tokens = config.get("max_tokens", 100)
-            data_type = config.get("data_type", "text")
+    def _paged_window(self, tokens: List[int], max_tokens: int) -> List[int]:
+        """Trailing window of a prompt that leaves room for `max_tokens` in the paged context"""
+        return tokens[-max(self.paged.max_context - max_tokens, 1):]
+
+    def generate_batch(self, prompts: List[str], configs: List[Dict[str, Any]],
+                       on_text: Optional[List[Optional[Callable[[str], None]]]] = None) -> List[str]:
+        """Generate several prompts in lockstep, one batched forward pass per step.
+
+        Sequences are right-padded and read at their last real position, so
+        each result matches what generate_text would produce on its own.
+        Finished sequences drop out of the batch. Configs with a
+        `json_schema` or `csv_columns` spec are decoded under that grammar.
+        `on_text[i]`, if set, receives sequence i's text as it is decoded.
+        """
+        max_length = self.session.max_sequence_length
+        callbacks = on_text or [None] * len(prompts)
+        states = []
+        for tokens, config, callback in zip(self.tokenization.encode_batch(prompts), configs, callbacks):
+            if len(tokens) >= max_length:
+                tokens = tokens[-(max_length - 1):]
+            states.append(self._decode_state(tokens, config, config.get("seed"), callback))
+        return self._decode(states)
+
+    def generate_samples(self, prompt: str, config: Dict[str, Any], num_samples: int) -> List[str]:
+        """`num_samples` independent samples of one prompt.
+
+        The prompt is encoded and run through the model once; every stream
+        samples its first token from those shared logits and then decodes
+        on its own, with seed `seed + i` and its own stop criteria.
+        """
+        max_length = self.session.max_sequence_length
+        tokens = self.tokenization.encode(prompt)
+        if len(tokens) >= max_length:
+            tokens = tokens[-(max_length - 1):]
+        seed = config.get("seed")
+
+        if self.paged is not None:
+            # Streams fork the cached prompt and share its pages copy-on-write
+            tokens = self._paged_window(tokens, config.get("max_tokens", 100))
+            parent, prompt_logits = self.paged.prefill(tokens, len(tokens))
+            try:
+                states = [self._decode_state(list(tokens), config, None if seed is None else seed + i)
+                          for i in range(num_samples)]
+                samples = self._decode_paged(states, parent, prompt_logits)
+            finally:
+                self.paged.free(parent)
+            logger.info(f"🧪 {num_samples} samples from one {len(tokens)}-token prefill")
+            return samples
+
+        prompt_logits = self.session.next_token_logits([tokens])[0]
+        samples = []
+        for start in range(0, num_samples, BATCH_SIZE):
+            states = [
+                self._decode_state(list(tokens), config, None if seed is None else seed + i)
+                for i in range(start, min(start + BATCH_SIZE, num_samples))
+            ]
+            samples.extend(self._decode(states, first_logits=prompt_logits))
+        logger.info(f"🧪 {num_samples} samples from one {len(tokens)}-token prefill")
+        return samples
+
+    def generate_for_job(self, prompt: str, config: Dict[str, Any],
+                         on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Generate content for a job based on its data type.
+
+        `on_text` receives partial output of free-text and grammar-constrained
+        jobs as it is decoded.
+        """
+        max_tokens = config.get("max_tokens", 100)
+        temperature = config.get("temperature", 0.7)
+        seed = config.get("seed")
+        data_type = config.get("data_type", "text")
+
+        # Schema-driven tabular/CSV/JSON jobs are sampled with NumPy; the
+        # model only writes the distinct values of text columns
+        if is_tabular_config(config):
+            return generate_tabular(config, self._generate_column_values, on_text)
+
+        # Many samples of one prompt share a single prefill and one upload
+        num_samples = _num_samples(config)
+        if num_samples > 1:
+            return _assemble_samples(self.generate_samples(prompt, config, num_samples), config)
 
-            # Generate content based on data type
-            if data_type == "text":
-                generated_content = self.generate_text(prompt, max_tokens)
+        # A JSON schema / CSV column spec constrains the model's own output
+        if is_constrained_config(config):
+            return self.generate_batch([prompt], [config], on_text=[on_text])[0]
+
+        # Without a column schema every data type is free text
+        return self.generate_text(prompt, max_tokens, temperature, seed, data_type, on_text)
+
+    def generate_streamed(self, job_id: int, prompt: str, config: Dict[str, Any]) -> str:
+        """generate_for_job, pushing partial output to the canister as it is decoded"""
+        if self.stream_interval <= 0:
+            return self.generate_for_job(prompt, config)
+        if self._child_output is not None:
+            # Inference child: the parent relays the text to the canister
+            try:
+                return self.generate_for_job(prompt, config,
+                                             on_text=lambda text: self._child_output.put((job_id, text)))
+            finally:
+                self._child_output.put((job_id, None))
+        stream = self._output_stream(job_id)
+        try:
+            return self.generate_for_job(prompt, config, on_text=stream.write)
+        finally:
+            stream.close()
+
+    def _output_stream(self, job_id: int) -> JobOutputStream:
+        return JobOutputStream(lambda seq, text: self.append_job_output(job_id, seq, text),
+                               self.stream_interval)
+
+    def _relay_child_output(self, streams: Dict[int, JobOutputStream], ended: set, job_id: int):
+        """Forward partial output queued by the inference children to each
+        job's stream, until `job_id`'s child has queued its last chunk"""
+        while job_id not in ended:
+            relayed_id, text = self._output_queue.get()
+            if text is None:
+                ended.add(relayed_id)
             else:
-                # For now, default to text generation
-                generated_content = self.generate_text(prompt, max_tokens)
+                streams[relayed_id].write(text)
+
+    def _generate_column_values(self, prompt: str, max_tokens: int, count: int,
+                                seed: Optional[int]) -> List[str]:
+        """`count` samples of one prompt, for a tabular text column"""
+        values = []
+        for start in range(0, count, BATCH_SIZE):
+            n = min(BATCH_SIZE, count - start)
+            configs = [{"max_tokens": max_tokens, "temperature": 0.9,
+                        "seed": None if seed is None else seed + start + i} for i in range(n)]
+            values.extend(self.generate_batch([prompt] * n, configs))
+        return values
+
+    def _result_cache_key(self, prompt: str, config: Dict[str, Any]) -> Optional[str]:
+        """Cache key for a job, or None if its output is not reproducible"""
+        if self.result_cache is None or not is_deterministic(config):
+            return None
+        return cache_key(self.model_id, prompt, config)
+
+    def _complete_from_cache(self, job_id: int, prompt: str, key: Optional[str],
+                             table_format: Optional[str] = None) -> bool:
+        """Finish a job from a cached result without running inference"""
+        if key is None:
+            return False
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return False
+
+        content, dataset_id = cached
+        if dataset_id is None:
+            logger.info(f"♻️  Job {job_id}: reusing cached content")
+            self._finish_job(job_id, prompt, content, key, table_format)
+        else:
+            logger.info(f"♻️  Job {job_id}: reusing dataset {dataset_id}")
+            self.mark_job_complete(job_id, dataset_id)
+            self.journal.record(job_id, prompt, "completed", dataset_id=dataset_id)
+        return True
+
+    def _resume_job(self, job_id: int, prompt: str) -> bool:
+        """Continue a job from its last durable journal stage, if any"""
+        state = self.journal.state(job_id, prompt)
+        if state is None:
+            return False
+
+        if state["stage"] == "completed":
+            # markJobComplete is idempotent; the pending listing was stale
+            self.mark_job_complete(job_id, state["dataset_id"])
+            return True
+
+        logger.info(f"⏯️  Resuming job {job_id} from stage '{state['stage']}'")
+        self._finish_job(job_id, prompt, self.journal.content(state), table_format=state.get("table_format"))
+        return True
+
+    def recover_interrupted_jobs(self):
+        """Finish every job the journal shows as interrupted mid-way"""
+        for state in self.journal.incomplete():
+            try:
+                job = self.get_job(state["job"])
+                if job is None or job["prompt"] != state["prompt"] or "Completed" in job["status"]:
+                    # Reinstalled canister, or the job finished after the journal's last record
+                    logger.info(f"🗑️  Dropping journal entry of job {state['job']}: no longer pending as journaled")
+                    self.journal.record(state["job"], state["prompt"], "completed", discarded=True)
+                    continue
+                self._resume_job(state["job"], state["prompt"])
+            except Exception as e:
+                logger.error(f"❌ Could not resume job {state['job']}: {e}")
+
+    def _finish_job(self, job_id: int, prompt: str, generated_content: str,
+                    cache_key: Optional[str] = None, table_format: Optional[str] = None):
+        """Upload generated content and mark the job complete"""
+        state = self.journal.state(job_id, prompt)
+        if state is None:
+            self.journal.record(job_id, prompt, "generated", content=generated_content,
+                                content_hash=content_hash(generated_content),
+                                table_format=table_format)
+            state = self.journal.state(job_id, prompt)
 
+        dataset_id = state.get("dataset_id")
+        if dataset_id is None:
             # Create dataset title and description
             title = f"Synthetic Dataset #{job_id}"
             description = f"Generated from: {prompt[:100]}..."
 
             # Upload dataset
-            dataset_id = self.upload_dataset(title, description, generated_content)
+            dataset_id = self.upload_dataset(title, description, generated_content, job_id=job_id,
+                                             table_format=state.get("table_format"))
+            self.journal.record(job_id, prompt, "uploaded", dataset_id=dataset_id)
+        if cache_key is not None:
+            self.result_cache.set_dataset_id(cache_key, dataset_id)
 
-            # Mark job as complete
-            self.mark_job_complete(job_id, dataset_id)
+        # Mark job as complete
+        self.mark_job_complete(job_id, dataset_id)
+        self.journal.record(job_id, prompt, "completed", dataset_id=dataset_id)
+
+        logger.info(f"✅ Job {job_id} completed successfully")
+
+    def process_job(self, job: Dict[str, Any]) -> bool:
+        """Process a single job"""
+        try:
+            job_id = job.get("id")
+            prompt = job.get("prompt", "")
+            config_str = job.get("config", "{}")
+
+            logger.info(f"🔄 Processing job {job_id}: {prompt[:50]}...")
+
+            if self._resume_job(job_id, prompt):
+                return True
+
+            # Parse config
+            config = json.loads(config_str)
+
+            key = self._result_cache_key(prompt, config)
+            if self._complete_from_cache(job_id, prompt, key, output_format(config)):
+                return True
 
-            logger.info(f"✅ Job {job_id} completed successfully")
+            started = time.perf_counter()
+            generated_content = self.generate_streamed(job_id, prompt, config)
+            self.scheduler.cost_model.observe(prompt, config, time.perf_counter() - started)
+            if key is not None:
+                self.result_cache.put(key, generated_content)
+            self._finish_job(job_id, prompt, generated_content, key, output_format(config))
             return True
 
         except Exception as e:
             logger.error(f"❌ Job {job.get('id')} failed: {e}")
             return False
 
+    def process_jobs(self, jobs: List[Dict[str, Any]]):
+        """Process a poll's worth of jobs in scheduler order, fanning out to children if pooled"""
+        # Warm the token cache for the whole poll in one tokenizer call
+        if jobs:
+            self.tokenization.encode_batch([job.get("prompt", "") for job in jobs])
+        self.scheduler.submit(jobs)
+
+        if self._pool is None:
+            job = self.scheduler.next_job()
+            while job is not None:
+                success = self.process_job(job)
+                self.scheduler.complete(job, success)
+                if not success:
+                    logger.warning(f"Job {job.get('id')} processing failed, continuing...")
+                job = self.scheduler.next_job()
+            self.scheduler.log_report()
+            return
+
+        # Dispatch every generation up front, then upload as results arrive
+        dispatched = []
+        streams: Dict[int, JobOutputStream] = {}
+        for job in self.scheduler.drain(self.workers):
+            try:
+                config = json.loads(job.get("config", "{}"))
+            except json.JSONDecodeError as e:
+                logger.error(f"❌ Job {job.get('id')} has invalid config: {e}")
+                self.scheduler.complete(job, False)
+                continue
+
+            key = self._result_cache_key(job.get("prompt", ""), config)
+            try:
+                if self._resume_job(job.get("id"), job.get("prompt", "")) or self._complete_from_cache(
+                        job.get("id"), job.get("prompt", ""), key, output_format(config)):
+                    self.scheduler.complete(job)
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Job {job.get('id')} failed: {e}")
+                self.scheduler.complete(job, False)
+                continue
+
+            logger.info(f"🔄 Dispatching job {job.get('id')}: {job.get('prompt', '')[:50]}...")
+            if self._output_queue is not None:
+                streams[job.get("id")] = self._output_stream(job.get("id"))
+            result = self._pool.apply_async(_child_generate, (job.get("id"), job.get("prompt", ""), config))
+            dispatched.append((job, config, key, output_format(config), result))
+
+        ended = set()
+        for job, config, key, table_format, result in dispatched:
+            try:
+                if self._output_queue is not None:
+                    try:
+                        self._relay_child_output(streams, ended, job.get("id"))
+                    finally:
+                        streams.pop(job.get("id")).close()
+                generated_content, seconds = result.get()
+                self.scheduler.cost_model.observe(job.get("prompt", ""), config, seconds)
+                if key is not None:
+                    self.result_cache.put(key, generated_content)
+                self._finish_job(job.get("id"), job.get("prompt", ""), generated_content, key,
+                                 table_format)
+                self.scheduler.complete(job)
+            except Exception as e:
+                logger.error(f"❌ Job {job.get('id')} failed: {e}")
+                self.scheduler.complete(job, False)
+        self.scheduler.log_report()
+
+    def run_batch(self, input_path: str, output_path: str, batch_size: int = BATCH_SIZE,
+                  flush_every: int = BATCH_FLUSH_EVERY, checkpoint_path: Optional[str] = None):
+        """Generate every item of a JSONL file locally, without canister round trips.
+
+        Items are read as a stream and decoded in micro-batches of
+        `batch_size`, spread over the inference pool when there is one.
+        Results are flushed every `flush_every` items; rerunning the same
+        command after an interruption skips everything already flushed.
+        """
+        output, checkpoint = open_batch_output(output_path, checkpoint_path)
+        logger.info(f"📦 Batch generation: {input_path} -> {output_path}")
+        if checkpoint.done:
+            logger.info(f"⏯️  Resuming: {len(checkpoint.done)} items already written")
+
+        pending_records = []
+        written = 0
+        started = time.time()
+
+        def flush():
+            nonlocal pending_records, written
+            if not pending_records:
+                return
+            output.write(pending_records)
+            written += len(pending_records)
+            pending_records = []
+            elapsed = max(time.time() - started, 1e-9)
+            logger.info(f"💾 {written} items written ({written / elapsed:.2f} items/s)")
+
+        def emit(item: Dict[str, Any], content: str):
+            pending_records.append({
+                "id": item["id"],
+                "prompt": item["prompt"],
+                "config": item["config"],
+                "content": content,
+                "content_hash": content_hash(content),
+            })
+            if len(pending_records) >= flush_every:
+                flush()
+
+        def finish(batch, result):
+            try:
+                contents = result.get() if self._pool is not None else result
+            except Exception as e:
+                # Not checkpointed, so a rerun retries these items
+                logger.error(f"❌ Batch of {len(batch)} items failed: {e}")
+                return
+            for (item, key), content in zip(batch, contents):
+                if key is not None:
+                    self.result_cache.put(key, content)
+                emit(item, content)
+
+        def micro_batches():
+            batch = []
+            for item in read_batch_items(input_path):
+                if item["id"] in checkpoint.done:
+                    continue
+                key = self._result_cache_key(item["prompt"], item["config"])
+                cached = self.result_cache.get(key) if key is not None else None
+                if cached is not None:
+                    emit(item, cached[0])
+                    continue
+                batch.append((item, key))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        # Keep every process busy with one batch queued behind it, without
+        # reading the whole input ahead
+        in_flight = deque()
+        max_in_flight = 2 * self.workers if self._pool is not None else 1
+        try:
+            for batch in micro_batches():
+                prompts = [item["prompt"] for item, _ in batch]
+                configs = [item["config"] for item, _ in batch]
+                if self._pool is None:
+                    try:
+                        finish(batch, self.generate_batch(prompts, configs))
+                    except Exception as e:
+                        logger.error(f"❌ Batch of {len(batch)} items failed: {e}")
+                    continue
+                in_flight.append((batch, self._pool.apply_async(_child_generate_batch, (prompts, configs))))
+                while len(in_flight) >= max_in_flight:
+                    finish(*in_flight.popleft())
+            while in_flight:
+                finish(*in_flight.popleft())
+            flush()
+        finally:
+            output.close()
+            checkpoint.close()
+            if self._pool is not None:
+                self._pool.close()
+
+        logger.info(f"✅ Batch generation finished: {written} new items, {len(checkpoint.done)} total")
+
     def run(self, poll_interval: int = 5):
         """Main worker loop"""
         logger.info("🚀 Starting Hyv Generation Worker...")
         logger.info(f"📡 Canister ID: {self.canister_id}")
         logger.info(f"⏱️  Poll interval: {poll_interval}s")
 
+        # Finish anything a previous run left between stages
+        self.recover_interrupted_jobs()
+
         while True:
             try:
                 # Get pending jobs
                 jobs = self.list_pending_jobs()
-                logger.info(f"📋 Found {len(jobs)} pending jobs via Candid parsing")
-
-                # For testing, let's check manually since Candid parsing is complex
-                if len(jobs) == 0:
-                    logger.info("Checking for pending jobs manually...")
-
-                    # Check if there are pending jobs by calling dfx directly
-                    try:
-                        output = self._run_dfx_command("listPendingJobs")
-                        if "vec {" in output and "record {" in output:
-                            logger.info("Found pending jobs! Processing job ID 2...")
-
-                            # Process the job we just submitted
-                            mock_job = {
-                                "id": 2,
-                                "prompt": "Generate a short story about AI",
-                                "config": '{"data_type":"text","max_tokens":50}'
-                            }
-                            success = self.process_job(mock_job)
-                            if success:
-                                logger.info("✅ Job processed successfully!")
-                                return  # Exit after processing for testing
-                            else:
-                                logger.error("❌ Job processing failed")
-                        else:
-                            logger.info("No pending jobs found")
-                    except Exception as e:
-                        logger.error(f"Error checking jobs: {e}")
+                logger.info(f"📋 Found {len(jobs)} pending jobs")
 
                 # Process each job
-                for job in jobs:
-                    success = self.process_job(job)
-                    if not success:
-                        logger.warning(f"Job {job.get('id')} processing failed, continuing...")
+                self.process_jobs(jobs)
 
                 # Wait before next poll
                 time.sleep(poll_interval)
 
             except KeyboardInterrupt:
                 logger.info("🛑 Worker stopped by user")
+                if self._pool is not None:
+                    self._pool.terminate()
                 break
             except Exception as e:
                 logger.error(f"Worker loop error: {e}")
                 time.sleep(poll_interval)
 
 
+def inspect_model(model_path: str):
+    """Print model inputs and outputs"""
+    print("Inspecting model inputs...")
+    session = ort.InferenceSession(model_path)
+    print("Model inputs:")
+    for input in session.get_inputs():
+        print(f"  {input.name}: {input.shape} {input.type}")
+    print("Model outputs:")
+    for output in session.get_outputs():
+        print(f"  {output.name}: {output.shape} {output.type}")
+
+
 def main():
-    # Create and run worker
-    worker = HyvGenerationWorker(MODEL_PATH, TOKENIZER_PATH, CANISTER_ID)
-    worker.run(POLL_INTERVAL)
+    parser = argparse.ArgumentParser(description="Hyv off-chain AI generation worker")
+    parser.add_argument("--inspect", action="store_true",
+                        help="print model inputs/outputs and exit")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="inference processes sharing one mapped copy of the weights "
+                             "(default: 1, or every core with --batch)")
+    parser.add_argument("--cache-path", default=RESULT_CACHE_PATH,
+                        help="SQLite file for the deterministic result cache")
+    parser.add_argument("--cache-max-mb", type=int, default=RESULT_CACHE_MAX_MB,
+                        help="size bound of the result cache")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="disable the result cache")
+    parser.add_argument("--journal-path", default=JOURNAL_PATH,
+                        help="write-ahead journal of job stage transitions")
+    parser.add_argument("--batch", metavar="INPUT_JSONL",
+                        help="generate every prompt of a JSONL file offline instead of polling the canister")
+    parser.add_argument("--output", default="batch_output.jsonl",
+                        help="--batch results: a .jsonl file, or a .parquet directory of part files")
+    parser.add_argument("--checkpoint",
+                        help="--batch checkpoint file (default: <output>.ckpt); delete it to start over")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="sequences decoded together per forward pass in --batch mode")
+    parser.add_argument("--flush-every", type=int, default=BATCH_FLUSH_EVERY,
+                        help="results per durable output flush in --batch mode")
+    parser.add_argument("--speculative", action="store_true",
+                        help="generate with the larger GPT-2 export, drafted by DistilGPT-2")
+    parser.add_argument("--stream-interval", type=float, default=STREAM_INTERVAL,
+                        help="seconds between partial output pushes per job (0 disables streaming)")
+    parser.add_argument("--paged-kv", action="store_true",
+                        help="decode batches with the with-past export on a paged KV cache")
+    parser.add_argument("--kv-cache-mb", type=int, default=KV_CACHE_MB,
+                        help=f"paged KV cache size, shared by all inference processes; each also "
+                             f"uses up to {STEP_MB} MB of contiguous KV per decode step")
+    parser.add_argument("--kv-dtype", choices=sorted(KV_DTYPES), default="fp32",
+                        help="paged KV storage precision")
+    parser.add_argument("--owner-policy", metavar="JSON",
+                        help='per-owner scheduling, e.g. {"<principal>": {"weight": 2, "max_priority": "interactive"}}')
+    args = parser.parse_args()
 
+    owner_policy = None
+    if args.owner_policy:
+        with open(args.owner_policy, "r") as f:
+            owner_policy = json.load(f)
+        for owner, policy in owner_policy.items():
+            if policy.get("max_priority", "batch") not in PRIORITY_CLASSES:
+                parser.error(f"Unknown max_priority for {owner}: {policy['max_priority']}")
 
-if __name__ == "__main__":
-    # For testing model inputs
-    import sys
-    if len(sys.argv) > 1 and sys.argv[1] == "--inspect":
-        print("Inspecting model inputs...")
-        session = ort.InferenceSession(MODEL_PATH)
-        print("Model inputs:")
-        for input in session.get_inputs():
-            print(f"  {input.name}: {input.shape} {input.type}")
-        print("Model outputs:")
-        for output in session.get_outputs():
-            print(f"  {output.name}: {output.shape} {output.type}")
+    if args.inspect:
+        inspect_model(MODEL_PATH)
         sys.exit(0)
 
-    # Normal worker execution
-    worker = HyvGenerationWorker(MODEL_PATH, TOKENIZER_PATH, CANISTER_ID)
-    worker.run()
+    workers = args.workers
+    if workers is None:
+        workers = (os.cpu_count() or 1) if args.batch else 1
+
+    # Create and run worker
+    worker = HyvGenerationWorker(
+        TARGET_MODEL_PATH if args.speculative else MODEL_PATH, TOKENIZER_PATH, CANISTER_ID,
+        workers=workers,
+        cache_path=None if args.no_cache else args.cache_path,
+        cache_max_mb=args.cache_max_mb,
+        journal_path=args.journal_path,
+        draft_model_path=MODEL_PATH if args.speculative else None,
+        stream_interval=args.stream_interval,
+        paged_model_path=PAST_MODEL_PATH if args.paged_kv else None,
+        kv_cache_mb=args.kv_cache_mb,
+        kv_dtype=args.kv_dtype,
+        owner_policy=owner_policy
+    )
+    if args.batch:
+        worker.run_batch(args.batch, args.output, batch_size=args.batch_size,
+                         flush_every=args.flush_every, checkpoint_path=args.checkpoint)
+    else:
+        worker.run(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
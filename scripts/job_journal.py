@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Crash-safe local job journal for the Hyv generation worker.
+
+Every stage transition of a job is appended to a JSON-lines write-ahead
+journal and fsync'd before the worker moves on:
+
+    generated  -> content, content hash and prompt are durable
+    uploaded   -> the dataset id returned by the canister is durable
+    completed  -> markJobComplete succeeded
+
+After a restart the worker resumes each interrupted job from its last
+durable stage instead of regenerating and re-uploading it.
+
+Content (up to tens of MB for a tabular job) is not written into the
+journal itself but to a side file in `<journal>.content/`, named by its
+content hash; journal records carry only the file name. Journal lines
+stay small, and replaying the journal never reads the content. A side
+file is deleted once no unfinished job refers to it.
+
+Entries are keyed by (canister id, job id, prompt hash), not the job id
+alone: a reinstalled canister hands out the same ids again, and a stale
+entry must never be replayed into an unrelated job. Completed entries are
+dropped whenever the journal is compacted, at startup and every
+COMPACT_EVERY completions.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("generated", "uploaded", "completed")
+COMPACT_EVERY = 256  # completed jobs between compactions
+
+JobKey = Tuple[str, int, str]
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(prompt: str) -> str:
+    return content_hash(prompt)[:16]
+
+
+class JobJournal:
+    """Append-only, fsync'd record of job stage transitions of one canister's jobs"""
+
+    def __init__(self, path: str, canister_id: str):
+        self.path = path
+        self.canister_id = canister_id
+        # (canister, job, prompt hash) -> merged state of all records for that job
+        self._jobs: Dict[JobKey, Dict[str, Any]] = {}
+        self._completed_since_compact = 0
+        self._file = None
+        self.content_dir = path + ".content"
+        os.makedirs(self.content_dir, exist_ok=True)
+        self._replay()
+        self.compact()
+
+    def _key(self, job_id: int, prompt: str) -> JobKey:
+        return (self.canister_id, job_id, prompt_hash(prompt))
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final write from a crash; everything before it is intact
+                    logger.warning("Skipping truncated journal record")
+                    continue
+                if "prompt_hash" not in record:
+                    # Written before entries were keyed; not safe to replay
+                    continue
+                key = (record["canister"], record["job"], record["prompt_hash"])
+                self._jobs.setdefault(key, {}).update(record)
+
+    def _append(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _write_content(self, content: str) -> str:
+        """Durably store content in a side file; returns its file name"""
+        name = content_hash(content) + ".txt"
+        path = os.path.join(self.content_dir, name)
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            # Make the rename durable before the journal points at it
+            fd = os.open(self.content_dir, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return name
+
+    def content(self, state: Dict[str, Any]) -> str:
+        """Generated content of a journaled job"""
+        if "content" in state:
+            return state["content"]
+        with open(os.path.join(self.content_dir, state["content_file"]), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _remove_unreferenced_content(self, names: Optional[List[str]] = None):
+        """Delete side files (all of them, or just `names`) no unfinished job refers to"""
+        referenced = {state.get("content_file") for state in self._jobs.values() if state["stage"] != "completed"}
+        for name in names if names is not None else os.listdir(self.content_dir):
+            if name not in referenced:
+                try:
+                    os.remove(os.path.join(self.content_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def record(self, job_id: int, prompt: str, stage: str, **fields):
+        """Durably record that a job (`job_id` with `prompt`) reached a stage.
+
+        A `content` field is stored in a side file, not in the journal.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown journal stage: {stage}")
+        if "content" in fields:
+            fields["content_file"] = self._write_content(fields.pop("content"))
+        key = self._key(job_id, prompt)
+        record = {"canister": key[0], "job": job_id, "prompt_hash": key[2], "stage": stage, **fields}
+        if stage == "generated":
+            # Recovery after a restart has only the journal to go on
+            record["prompt"] = prompt
+        self._append(record)
+        self._jobs.setdefault(key, {}).update(record)
+        if stage == "completed":
+            # Nothing reads a completed job's content again
+            self._jobs[key] = {k: v for k, v in self._jobs[key].items() if k != "content"}
+            if "content_file" in self._jobs[key]:
+                self._remove_unreferenced_content([self._jobs[key]["content_file"]])
+            self._completed_since_compact += 1
+            if self._completed_since_compact >= COMPACT_EVERY:
+                self.compact()
+
+    def state(self, job_id: int, prompt: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(self._key(job_id, prompt))
+
+    def incomplete(self) -> List[Dict[str, Any]]:
+        """This canister's jobs with durable progress that never reached `completed`"""
+        return [s for key, s in self._jobs.items()
+                if key[0] == self.canister_id and s["stage"] != "completed"]
+
+    def compact(self):
+        """Rewrite the journal with only the jobs that have not completed"""
+        self._jobs = {key: state for key, state in self._jobs.items() if state["stage"] != "completed"}
+        if self._file is not None:
+            self._file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for state in self._jobs.values():
+                f.write(json.dumps(state) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._completed_since_compact = 0
+        # Files left by a crash between a completion and its cleanup
+        self._remove_unreferenced_content()
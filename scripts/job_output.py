@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Streaming of partial job output to the canister.
+
+Generation pushes decoded text into a JobOutputStream as tokens arrive. A
+background thread sends it with appendJobOutput so the decode loop never
+waits on a canister call. The first chunk goes out as soon as there is
+any text, which keeps time to first visible output short. After that,
+calls are at least `interval` seconds apart, and everything written in
+between is coalesced, then sent in chunks of at most MAX_CHUNK_BYTES so
+each call fits in one ingress message (2 MiB). Once the canister reports
+that it stores no more of the job's output (its size cap), the stream
+stops sending and drops further text.
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STREAM_INTERVAL = 2.0  # seconds between appendJobOutput calls per job
+MAX_CHUNK_BYTES = 256_000  # UTF-8 bytes per appendJobOutput call
+
+
+def split_utf8(text: str, max_bytes: int = MAX_CHUNK_BYTES) -> List[str]:
+    """`text` in pieces of at most `max_bytes` UTF-8 bytes, split between characters"""
+    data = text.encode("utf-8")
+    pieces = []
+    start = 0
+    while start < len(data):
+        end = min(start + max_bytes, len(data))
+        # Back up to the first byte of a character (continuation bytes are 10xxxxxx)
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        pieces.append(data[start:end].decode("utf-8"))
+        start = end
+    return pieces
+
+
+class JobOutputStream:
+    """Batched, ordered pushes of one job's partial output"""
+
+    def __init__(self, send: Callable[[int, str], Tuple[int, bool]], interval: float = STREAM_INTERVAL,
+                 max_chunk_bytes: int = MAX_CHUNK_BYTES):
+        """`send(seq, text)` stores chunk `seq` and returns the next seq expected
+        and whether the canister has stopped storing this job's output"""
+        self.send = send
+        self.interval = interval
+        self.max_chunk_bytes = max_chunk_bytes
+        self.seq = 0
+        self._pending: List[str] = []
+        self._closed = False
+        self._stopped = False
+        self._last_sent: Optional[float] = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, text: str):
+        if not text:
+            return
+        with self._cond:
+            if self._stopped:
+                return
+            self._pending.append(text)
+            self._cond.notify()
+
+    def close(self):
+        """Send whatever is still pending and stop the sender thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                if self._last_sent is not None:
+                    # Let more text accumulate, unless the job is done
+                    delay = self._last_sent + self.interval - time.monotonic()
+                    while delay > 0 and not self._closed:
+                        self._cond.wait(delay)
+                        delay = self._last_sent + self.interval - time.monotonic()
+                text = "".join(self._pending)
+                self._pending = []
+
+            self._last_sent = time.monotonic()
+            pieces = split_utf8(text, self.max_chunk_bytes)
+            for i, piece in enumerate(pieces):
+                try:
+                    self.seq, stopped = self.send(self.seq, piece)
+                except Exception as e:
+                    logger.warning(f"⚠️  Could not push partial output chunk {self.seq}: {e}")
+                    if self._closed:
+                        return
+                    # Retry with the same seq; newer text follows in later chunks
+                    with self._cond:
+                        self._pending[:0] = pieces[i:]
+                    break
+                if stopped:
+                    logger.info(f"✂️  Canister stopped storing partial output at chunk {self.seq}")
+                    with self._cond:
+                        self._stopped = True
+                        self._pending = []
+                    return
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Job ordering for the Hyv generation worker.
+
+Pending jobs are not run in listing order. Each job gets a cost estimate
+in seconds (from max_tokens, num_samples, prompt length and the model's
+measured speed) and is ordered by:
+
+1. Priority class (`priority` in the job config: interactive, standard or
+   batch). The config is written by the job's owner, so the class is
+   capped at the owner's allowance (`owner_classes`, DEFAULT_MAX_CLASS for
+   everyone else). A job waiting longer than AGING_SECONDS moves up one
+   class per period, so batch work is never starved.
+2. Within a class, weighted fair queuing per owner: start-time fair
+   queuing with the estimated cost as the job's length. The job with the
+   smallest virtual finish tag runs first. Short jobs finish early, which
+   minimizes mean completion time. An owner with many queued jobs only
+   advances through their own virtual clock, so one heavy user cannot
+   starve everyone else.
+3. Deadlines (`deadline_seconds` after submission, or the class SLO). If
+   running the chosen job would make another job miss a deadline it can
+   still meet, the earliest such deadline runs first. A requested deadline
+   is never tighter than the SLO of the owner's allowed class.
+
+Completion latency (submission to upload) is tracked per class and
+reported as percentiles.
+"""
+
+import json
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+from tabular_engine import is_tabular_config
+
+logger = logging.getLogger(__name__)
+
+# Class name -> rank (lower runs first) and default latency SLO in seconds
+PRIORITY_CLASSES = {"interactive": 0, "standard": 1, "batch": 2}
+CLASS_SLO_SECONDS = {"interactive": 30.0, "standard": 300.0, "batch": None}
+DEFAULT_CLASS = "standard"
+DEFAULT_MAX_CLASS = "standard"  # most urgent class owners without an allowance may use
+AGING_SECONDS = 600.0  # waiting this long promotes a job one class
+
+DEFAULT_SECONDS_PER_TOKEN = 0.02
+PREFILL_WEIGHT = 0.1  # prompt tokens cost a fraction of a decode step
+SECONDS_PER_TABLE_ROW = 2e-6
+EMA_WEIGHT = 0.2
+LATENCY_WINDOW = 1000  # completed jobs kept per class for percentiles
+
+
+def _job_config(job: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        config = json.loads(job.get("config") or "{}")
+    except (TypeError, json.JSONDecodeError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def _submitted_at(job: Dict[str, Any], default: float) -> float:
+    """Job creation time in seconds; the canister reports nanoseconds"""
+    created = job.get("createdAt")
+    if not created:
+        return default
+    created = float(created)
+    return created / 1e9 if created > 1e12 else created
+
+
+class CostModel:
+    """Seconds a job is expected to take, learned per model"""
+
+    def __init__(self, model_id: str, count_tokens: Callable[[str], int]):
+        self.model_id = model_id
+        self.count_tokens = count_tokens
+        self.seconds_per_token: Dict[str, float] = {}
+
+    def work(self, prompt: str, config: Dict[str, Any]) -> float:
+        """Decode-step equivalents of a model job"""
+        samples = max(int(config.get("num_samples", 1)), 1)
+        decode = config.get("max_tokens", 100) * samples
+        return decode + PREFILL_WEIGHT * self.count_tokens(prompt)
+
+    def estimate(self, prompt: str, config: Dict[str, Any]) -> float:
+        if is_tabular_config(config):
+            # NumPy sampling; the model only writes a few distinct text values
+            return config.get("rows", 1000) * SECONDS_PER_TABLE_ROW
+        per_token = self.seconds_per_token.get(self.model_id, DEFAULT_SECONDS_PER_TOKEN)
+        return self.work(prompt, config) * per_token
+
+    def observe(self, prompt: str, config: Dict[str, Any], seconds: float):
+        """Update the model's speed from a job's measured inference time"""
+        if is_tabular_config(config):
+            return
+        per_token = seconds / max(self.work(prompt, config), 1.0)
+        current = self.seconds_per_token.get(self.model_id)
+        self.seconds_per_token[self.model_id] = (
+            per_token if current is None else current + EMA_WEIGHT * (per_token - current))
+
+
+@dataclass
+class ScheduledJob:
+    job: Dict[str, Any]
+    config: Dict[str, Any]
+    priority: str
+    owner: str
+    cost: float
+    submitted: float
+    deadline: Optional[float]
+    start_tag: float = 0.0
+    finish_tag: float = 0.0
+
+
+@dataclass
+class ClassStats:
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    completed: int = 0
+    failed: int = 0
+    deadline_misses: int = 0
+
+
+class JobScheduler:
+    """Priority classes, per-owner fair queuing and deadlines over pending jobs"""
+
+    def __init__(self, cost_model: CostModel, owner_weights: Optional[Dict[str, float]] = None,
+                 owner_classes: Optional[Dict[str, str]] = None, clock: Callable[[], float] = time.time):
+        self.cost_model = cost_model
+        self.owner_weights = owner_weights or {}
+        self.owner_classes = owner_classes or {}
+        self.clock = clock
+        self.queued: Dict[Any, ScheduledJob] = {}
+        # Class each queued or running job was admitted with, for complete()
+        self.assigned: Dict[Any, str] = {}
+        # Per class: virtual time, and the last finish tag of each owner
+        self.virtual_time = {name: 0.0 for name in PRIORITY_CLASSES}
+        self.owner_finish: Dict[str, Dict[str, float]] = {name: {} for name in PRIORITY_CLASSES}
+        self.stats = {name: ClassStats() for name in PRIORITY_CLASSES}
+
+    def submit(self, jobs: List[Dict[str, Any]]):
+        """Queue newly listed jobs; jobs already queued are ignored"""
+        now = self.clock()
+        for job in jobs:
+            job_id = job.get("id")
+            if job_id in self.queued:
+                continue
+            config = _job_config(job)
+            owner = str(job.get("owner", "anonymous"))
+            priority, slo = self._job_class(config, owner)
+            submitted = _submitted_at(job, now)
+            entry = ScheduledJob(
+                job=job, config=config, priority=priority, owner=owner,
+                cost=self.cost_model.estimate(job.get("prompt", ""), config),
+                submitted=submitted,
+                deadline=submitted + float(slo) if slo is not None else None,
+            )
+            weight = self.owner_weights.get(owner, 1.0)
+            entry.start_tag = max(self.virtual_time[priority], self.owner_finish[priority].get(owner, 0.0))
+            entry.finish_tag = entry.start_tag + entry.cost / weight
+            self.owner_finish[priority][owner] = entry.finish_tag
+            self.queued[job_id] = entry
+            self.assigned[job_id] = priority
+
+    def _job_class(self, config: Dict[str, Any], owner: str):
+        """Priority class and deadline (seconds) for a job, capped by its owner's allowance"""
+        allowed = self.owner_classes.get(owner, DEFAULT_MAX_CLASS)
+        requested = config.get("priority", DEFAULT_CLASS)
+        if requested not in PRIORITY_CLASSES:
+            requested = DEFAULT_CLASS
+        priority = requested if PRIORITY_CLASSES[requested] >= PRIORITY_CLASSES[allowed] else allowed
+
+        slo = CLASS_SLO_SECONDS[priority]
+        if config.get("deadline_seconds") is not None:
+            slo = float(config["deadline_seconds"])
+            floor = CLASS_SLO_SECONDS[allowed]
+            if floor is not None:
+                slo = max(slo, floor)
+        return priority, slo
+
+    def __len__(self) -> int:
+        return len(self.queued)
+
+    def _effective_rank(self, entry: ScheduledJob, now: float) -> int:
+        promoted = int((now - entry.submitted) // AGING_SECONDS)
+        return max(PRIORITY_CLASSES[entry.priority] - promoted, 0)
+
+    def next_job(self, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Remove and return the job to run next, or None when idle"""
+        if not self.queued:
+            return None
+        if now is None:
+            now = self.clock()
+        entries = list(self.queued.values())
+        choice = min(entries, key=lambda e: (self._effective_rank(e, now), e.finish_tag))
+
+        # Run a deadline job first if waiting behind `choice` would make it
+        # miss; jobs that can no longer make it keep their normal place
+        at_risk = [
+            e for e in entries
+            if e is not choice and e.deadline is not None
+            and 0 <= e.deadline - now - e.cost < choice.cost
+        ]
+        if at_risk:
+            choice = min(at_risk, key=lambda e: e.deadline)
+
+        del self.queued[choice.job.get("id")]
+        self.virtual_time[choice.priority] = max(self.virtual_time[choice.priority], choice.start_tag)
+        return choice.job
+
+    def drain(self, workers: int = 1) -> List[Dict[str, Any]]:
+        """Every queued job in run order, for dispatching all at once.
+
+        Deadlines are checked against when each job would start, assuming
+        the estimated costs and `workers` jobs running side by side.
+        """
+        order = []
+        now = self.clock()
+        while self.queued:
+            job = self.next_job(now)
+            order.append(job)
+            now += self.cost_model.estimate(job.get("prompt", ""), _job_config(job)) / workers
+        return order
+
+    def complete(self, job: Dict[str, Any], success: bool = True):
+        """Record a finished job's completion latency"""
+        config = _job_config(job)
+        owner = str(job.get("owner", "anonymous"))
+        priority, slo = self._job_class(config, owner)
+        priority = self.assigned.pop(job.get("id"), priority)
+        stats = self.stats[priority]
+        if not success:
+            stats.failed += 1
+            return
+
+        now = self.clock()
+        submitted = _submitted_at(job, now)
+        stats.completed += 1
+        stats.latencies.append(now - submitted)
+        if slo is not None and now - submitted > float(slo):
+            stats.deadline_misses += 1
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Latency percentiles (seconds) and counts per priority class"""
+        report = {}
+        for name, stats in self.stats.items():
+            if not stats.completed and not stats.failed:
+                continue
+            latencies = np.array(stats.latencies) if stats.latencies else np.zeros(1)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            report[name] = {
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "deadline_misses": stats.deadline_misses,
+                "mean": round(float(latencies.mean()), 2),
+                "p50": round(float(p50), 2),
+                "p95": round(float(p95), 2),
+                "p99": round(float(p99), 2),
+            }
+        return report
+
+    def log_report(self):
+        for name, r in self.report().items():
+            logger.info(f"📈 {name}: {r['completed']} done, {r['failed']} failed, "
+                        f"latency mean {r['mean']}s p50 {r['p50']}s p95 {r['p95']}s p99 {r['p99']}s, "
+                        f"{r['deadline_misses']} deadline misses")
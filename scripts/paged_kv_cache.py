@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Paged KV cache for concurrent decoding in the Hyv generation worker.
+
+Keys and values live in fixed-size pages of one preallocated NumPy pool
+instead of per-sequence [layers, 2, heads, max_len, head_dim] arrays, so a
+short job only holds the pages it has filled. Each sequence has a page
+table; forked sequences (e.g. num_samples streams of one prompt) share
+their parent's pages and copy a page only when they write into a shared
+one. Pages can be stored as fp32, fp16 or int8 (per-token, per-head
+absmax scales), trading precision for 2x/4x more concurrent tokens.
+
+A sequence reserves the pages for prompt + max_tokens when it is admitted,
+so a running sequence can never run out of pages mid-generation; callers
+admit new sequences only while `can_admit` says the pool has room.
+
+PagedSession runs a with-past ONNX export (`convert_models_fixed.py
+--with-past`) on top of the cache: prompts are prefilled once and each
+decode step feeds one token per sequence plus its gathered past.
+
+ONNX Runtime has no paged attention kernel, so a step still needs its
+batch's past as one contiguous fp32 tensor, and the export returns presents
+of the same size. The page pool bounds stored KV; this working set is
+bounded separately. A step is split into sub-batches of similar length
+whose gathered past plus presents fit in `step_mb` (STEP_MB). Peak KV
+memory per process is therefore about memory_mb + step_mb, whatever the
+pool's dtype.
+"""
+
+import re
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 16  # tokens per page
+KV_DTYPES = {"fp32": np.float32, "fp16": np.float16, "int8": np.int8}
+MAX_CONTEXT = 1024  # GPT-2 position embedding limit
+STEP_MB = 128  # contiguous fp32 past + presents per forward pass
+
+_PAST_INPUT = re.compile(r"past_key_values\.(\d+)\.(key|value)")
+
+
+class PagedKVCache:
+    """Page pool, per-sequence page tables and copy-on-write prefix sharing"""
+
+    def __init__(self, num_layers: int, num_heads: int, head_dim: int, num_pages: int,
+                 page_size: int = PAGE_SIZE, dtype: str = "fp32"):
+        if dtype not in KV_DTYPES:
+            raise ValueError(f"KV dtype must be one of {sorted(KV_DTYPES)}, got {dtype!r}")
+        self.num_layers = num_layers
+        self.num_heads = num_heads
+        self.head_dim = head_dim
+        self.num_pages = num_pages
+        self.page_size = page_size
+        self.dtype = dtype
+
+        # [page, layer, key/value, head, slot, head_dim]
+        self.pages = np.zeros((num_pages, num_layers, 2, num_heads, page_size, head_dim),
+                              dtype=KV_DTYPES[dtype])
+        self.scales = (np.zeros((num_pages, num_layers, 2, num_heads, page_size), dtype=np.float32)
+                       if dtype == "int8" else None)
+        self.refcounts = np.zeros(num_pages, dtype=np.int32)
+        self._free: List[int] = list(range(num_pages - 1, -1, -1))
+
+        self.tables: Dict[int, List[int]] = {}
+        self.lengths: Dict[int, int] = {}
+        # Pages promised to a sequence at admission but not allocated yet
+        self.reserved: Dict[int, int] = {}
+        self._next_id = 0
+
+    @staticmethod
+    def page_bytes(num_layers: int, num_heads: int, head_dim: int,
+                   page_size: int = PAGE_SIZE, dtype: str = "fp32") -> int:
+        values = num_layers * 2 * num_heads * page_size
+        size = values * head_dim * np.dtype(KV_DTYPES[dtype]).itemsize
+        if dtype == "int8":
+            size += values * np.dtype(np.float32).itemsize
+        return size
+
+    @classmethod
+    def for_memory(cls, memory_bytes: int, num_layers: int, num_heads: int, head_dim: int,
+                   page_size: int = PAGE_SIZE, dtype: str = "fp32") -> "PagedKVCache":
+        """A cache with as many pages as fit in `memory_bytes`"""
+        num_pages = memory_bytes // cls.page_bytes(num_layers, num_heads, head_dim, page_size, dtype)
+        if num_pages < 1:
+            raise ValueError(f"{memory_bytes} bytes do not fit a single KV page")
+        return cls(num_layers, num_heads, head_dim, int(num_pages), page_size, dtype)
+
+    def pages_for(self, tokens: int) -> int:
+        return -(-tokens // self.page_size)
+
+    @property
+    def free_pages(self) -> int:
+        """Pages neither allocated nor reserved by an admitted sequence"""
+        return len(self._free) - sum(self.reserved.values())
+
+    def can_admit(self, max_tokens: int, parent: Optional[int] = None) -> bool:
+        """Whether a sequence of up to `max_tokens` fits (forked from `parent`, if given)"""
+        return self._pages_needed(max_tokens, parent) <= self.free_pages
+
+    def _pages_needed(self, max_tokens: int, parent: Optional[int]) -> int:
+        shared = 0
+        if parent is not None:
+            # Full shared pages are never written again; a partial one is copied
+            shared = self.lengths[parent] // self.page_size
+        return max(self.pages_for(max_tokens) - shared, 0)
+
+    def _register(self, table: List[int], length: int, reserve: int) -> int:
+        if reserve > self.free_pages:
+            raise MemoryError(f"KV cache full: need {reserve} pages, {self.free_pages} free")
+        seq_id = self._next_id
+        self._next_id += 1
+        self.tables[seq_id] = table
+        self.lengths[seq_id] = length
+        self.reserved[seq_id] = reserve
+        return seq_id
+
+    def allocate(self, max_tokens: int) -> int:
+        """Admit an empty sequence that will hold up to `max_tokens` tokens"""
+        return self._register([], 0, self.pages_for(max_tokens))
+
+    def fork(self, parent: int, max_tokens: int) -> int:
+        """A sequence starting with `parent`'s tokens, sharing its pages"""
+        table = list(self.tables[parent])
+        self.refcounts[table] += 1
+        return self._register(table, self.lengths[parent], self._pages_needed(max_tokens, parent))
+
+    def _take_page(self, seq_id: int) -> int:
+        if not self._free:
+            raise MemoryError("KV cache has no free pages")
+        page = self._free.pop()
+        self.refcounts[page] = 1
+        if self.reserved.get(seq_id, 0) > 0:
+            self.reserved[seq_id] -= 1
+        return page
+
+    def _release(self, page: int):
+        self.refcounts[page] -= 1
+        if self.refcounts[page] == 0:
+            self._free.append(page)
+
+    def append(self, seq_id: int, kv: np.ndarray):
+        """Store keys/values of new tokens, kv shaped [layers, 2, heads, n, head_dim]"""
+        table = self.tables[seq_id]
+        position = self.lengths[seq_id]
+        end = position + kv.shape[3]
+        offset = 0
+        while position < end:
+            index, slot = divmod(position, self.page_size)
+            if index == len(table):
+                table.append(self._take_page(seq_id))
+            elif self.refcounts[table[index]] > 1:
+                # Copy-on-write: this page is shared with another sequence
+                page = self._take_page(seq_id)
+                self.pages[page] = self.pages[table[index]]
+                if self.scales is not None:
+                    self.scales[page] = self.scales[table[index]]
+                self._release(table[index])
+                table[index] = page
+            count = min(self.page_size - slot, end - position)
+            self._store(table[index], slot, kv[:, :, :, offset:offset + count])
+            position += count
+            offset += count
+        self.lengths[seq_id] = end
+
+    def _store(self, page: int, slot: int, kv: np.ndarray):
+        count = kv.shape[3]
+        if self.scales is None:
+            self.pages[page, :, :, :, slot:slot + count] = kv
+            return
+        scale = np.abs(kv).max(axis=-1) / 127.0
+        scale[scale == 0] = 1.0
+        self.pages[page, :, :, :, slot:slot + count] = np.round(kv / scale[..., None]).astype(np.int8)
+        self.scales[page, :, :, :, slot:slot + count] = scale
+
+    def gather(self, seq_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Contiguous float32 past for a batch, [layers, 2, batch, heads, max_len, head_dim],
+        right-padded with zeros, and each sequence's length"""
+        lengths = np.array([self.lengths[s] for s in seq_ids], dtype=np.int64)
+        max_len = int(lengths.max()) if len(lengths) else 0
+        past = np.zeros((self.num_layers, 2, len(seq_ids), self.num_heads, max_len, self.head_dim),
+                        dtype=np.float32)
+        for row, seq_id in enumerate(seq_ids):
+            length = lengths[row]
+            if length == 0:
+                continue
+            table = self.tables[seq_id][:self.pages_for(length)]
+            # [pages, layers, 2, heads, slots, dim] -> [layers, 2, heads, pages * slots, dim]
+            kv = np.moveaxis(self.pages[table], 0, 3).reshape(
+                self.num_layers, 2, self.num_heads, -1, self.head_dim)[:, :, :, :length]
+            if self.scales is not None:
+                scales = np.moveaxis(self.scales[table], 0, 3).reshape(
+                    self.num_layers, 2, self.num_heads, -1)[:, :, :, :length]
+                kv = kv * scales[..., None]
+            past[:, :, row, :, :length] = kv
+        return past, lengths
+
+    def free(self, seq_id: int):
+        for page in self.tables.pop(seq_id):
+            self._release(page)
+        del self.lengths[seq_id]
+        del self.reserved[seq_id]
+
+    def stats(self) -> Dict[str, float]:
+        used = self.num_pages - len(self._free)
+        filled = sum(self.lengths.values())
+        return {
+            "sequences": len(self.tables),
+            "pages_used": used,
+            "pages_reserved": sum(self.reserved.values()),
+            "pages_free": self.free_pages,
+            # Tokens per allocated slot; above 1 when prefixes are shared
+            "fill": round(filled / max(used * self.page_size, 1), 3),
+        }
+
+
+class PagedSession:
+    """Incremental decoding with a with-past ONNX export and a paged KV cache"""
+
+    def __init__(self, model_path: str, memory_mb: int = 512, page_size: int = PAGE_SIZE,
+                 kv_dtype: str = "fp32", session_options: Optional[ort.SessionOptions] = None,
+                 step_mb: int = STEP_MB):
+        self.session = ort.InferenceSession(model_path, session_options or ort.SessionOptions())
+        inputs = {i.name: i for i in self.session.get_inputs()}
+        past = {(int(m.group(1)), m.group(2)): name
+                for name in inputs for m in [_PAST_INPUT.fullmatch(name)] if m}
+        if not past:
+            raise ValueError(f"{model_path} has no past_key_values inputs; export it with --with-past")
+        num_layers = max(layer for layer, _ in past) + 1
+        self.past_names = [(past[(layer, "key")], past[(layer, "value")]) for layer in range(num_layers)]
+        _, num_heads, _, head_dim = inputs[self.past_names[0][0]].shape
+        self.has_position_ids = "position_ids" in inputs
+        self.vocab_size = self.session.get_outputs()[0].shape[-1]
+        self.max_context = MAX_CONTEXT
+
+        self.cache = PagedKVCache.for_memory(memory_mb * 1024 * 1024, num_layers, num_heads, head_dim,
+                                             page_size, kv_dtype)
+        # fp32 bytes one token occupies in the gathered past, and again in the presents
+        self.token_bytes = 2 * num_layers * 2 * num_heads * head_dim * np.dtype(np.float32).itemsize
+        self.step_bytes = step_mb * 1024 * 1024
+        logger.info(f"🧮 Paged KV cache: {self.cache.num_pages} pages of {page_size} tokens "
+                    f"({kv_dtype}, {memory_mb} MB, {self.cache.num_pages * page_size:,} tokens)")
+
+    def _run(self, seq_ids: Sequence[int], input_ids: np.ndarray) -> np.ndarray:
+        """Feed `input_ids` [batch, n] after each sequence's cached past and
+        store the new keys/values; returns logits [batch, n, vocab]"""
+        past, lengths = self.cache.gather(seq_ids)
+        batch, n = input_ids.shape
+        max_len = past.shape[4]
+
+        # Right-padded past: padding slots are masked out, new tokens follow
+        attention_mask = np.ones((batch, max_len + n), dtype=np.int64)
+        attention_mask[:, :max_len] = np.arange(max_len)[None, :] < lengths[:, None]
+        feeds = {"input_ids": input_ids.astype(np.int64), "attention_mask": attention_mask}
+        if self.has_position_ids:
+            feeds["position_ids"] = lengths[:, None] + np.arange(n, dtype=np.int64)[None, :]
+        for layer, (key_name, value_name) in enumerate(self.past_names):
+            feeds[key_name] = past[layer, 0]
+            feeds[value_name] = past[layer, 1]
+
+        logits, *presents = self.session.run(None, feeds)
+        del past, feeds
+        # present.{i}.key/value: [batch, heads, max_len + n, head_dim]; only
+        # the last n positions are new, so copy just those out of the outputs
+        new = np.stack([np.stack([present[:, :, max_len:] for present in presents[2 * layer:2 * layer + 2]])
+                        for layer in range(len(self.past_names))])
+        del presents
+        for row, seq_id in enumerate(seq_ids):
+            self.cache.append(seq_id, new[:, :, row])
+        return logits
+
+    def _step_batches(self, seq_ids: Sequence[int]) -> List[List[int]]:
+        """Split a step into sub-batches (positions into `seq_ids`) of similar
+        length whose contiguous working set fits in `step_bytes`; a sequence
+        too long for the budget on its own still gets a batch of one"""
+        order = sorted(range(len(seq_ids)), key=lambda i: self.cache.lengths[seq_ids[i]])
+        batches: List[List[int]] = []
+        for i in order:
+            # Sorted ascending, so the newest member sets the padded length
+            rows = len(batches[-1]) + 1 if batches else 1
+            needed = rows * (self.cache.lengths[seq_ids[i]] + 1) * self.token_bytes
+            if batches and needed <= self.step_bytes:
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+        return batches
+
+    def can_admit(self, max_tokens: int, parent: Optional[int] = None) -> bool:
+        return self.cache.can_admit(max_tokens, parent)
+
+    def prefill(self, tokens: Sequence[int], max_tokens: int) -> Tuple[int, np.ndarray]:
+        """Admit a sequence, run its prompt once; returns (seq_id, next-token logits)"""
+        seq_id = self.cache.allocate(max_tokens)
+        logits = self._run([seq_id], np.array([tokens], dtype=np.int64))
+        return seq_id, logits[0, -1].copy()
+
+    def fork(self, parent: int, max_tokens: int) -> int:
+        return self.cache.fork(parent, max_tokens)
+
+    def step(self, seq_ids: Sequence[int], tokens: Sequence[int]) -> np.ndarray:
+        """Append one token to each sequence; returns next-token logits [batch, vocab]"""
+        tokens = np.array(tokens, dtype=np.int64)[:, None]
+        out = None
+        for batch in self._step_batches(seq_ids):
+            logits = self._run([seq_ids[i] for i in batch], tokens[batch])
+            if out is None:
+                out = np.empty((len(seq_ids), logits.shape[-1]), dtype=logits.dtype)
+            out[batch] = logits[:, -1]
+        return out
+
+    def free(self, seq_id: int):
+        self.cache.free(seq_id)
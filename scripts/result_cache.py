@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Persistent generation result cache for the Hyv generation worker.
+
+Results are content-addressed by (model, prompt, config, seed) and stored
+in a local SQLite file with size-bounded LRU eviction. Only deterministic
+configs are cacheable: greedy decoding (temperature 0) or an explicit seed.
+When a cached result already has a dataset id, the job can be completed
+without running inference or uploading a duplicate dataset.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def is_deterministic(config: Dict[str, Any]) -> bool:
+    """Whether a job config always produces the same output"""
+    return config.get("seed") is not None or config.get("temperature", 0.7) == 0
+
+
+def cache_key(model_id: str, prompt: str, config: Dict[str, Any]) -> str:
+    """Stable key over everything that affects the generated output"""
+    payload = json.dumps(
+        {"model": model_id, "prompt": prompt, "config": config},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed LRU of generated content and uploaded dataset ids"""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                dataset_id INTEGER,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)")
+        self._db.commit()
+
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        self.total_bytes = row[0]
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[int]]]:
+        """Return (content, dataset_id) for a key and mark it recently used"""
+        row = self._db.execute(
+            "SELECT content, dataset_id FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        return row[0], row[1]
+
+    def put(self, key: str, content: str, dataset_id: Optional[int] = None):
+        """Store generated content, evicting least recently used entries"""
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.warning(f"Result of {size} bytes exceeds cache capacity, not caching")
+            return
+
+        old = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self.total_bytes -= old[0]
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, content, dataset_id, size, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, content, dataset_id, size, time.time())
+        )
+        self.total_bytes += size
+        self._evict()
+        self._db.commit()
+
+    def set_dataset_id(self, key: str, dataset_id: int):
+        """Record the dataset a cached result was uploaded as"""
+        self._db.execute("UPDATE results SET dataset_id = ? WHERE key = ?", (dataset_id, key))
+        self._db.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            row = self._db.execute(
+                "SELECT key, size FROM results ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (row[0],))
+            self.total_bytes -= row[1]
+
+    def stats(self) -> Dict[str, int]:
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"entries": count, "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
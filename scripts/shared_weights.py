@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Shared, copy-on-write model weights for multi-process inference.
+
+The ONNX model is split once into a graph file plus a single aligned
+weights file (ONNX external-data layout). The parent process memory-maps
+the weights and forked inference children bind slices of that mapping as
+ORT initializers, so every child reads the same physical pages instead of
+holding its own copy of the model.
+"""
+
+import os
+import json
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import numpy_helper, external_data_helper
+from onnx.onnx_pb import TensorProto
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT = 64  # bytes; keeps every tensor cache-line/SIMD aligned
+MIN_SHARED_BYTES = 1024  # tiny constants stay inline in the graph
+
+
+def shared_weight_paths(model_path: str) -> Tuple[str, str, str]:
+    """Graph, weights and index paths derived from the source model path"""
+    stem = os.path.splitext(model_path)[0]
+    return f"{stem}.graph.onnx", f"{stem}.weights", f"{stem}.weights.json"
+
+
+def externalize_weights(model_path: str) -> Tuple[str, str, str]:
+    """Split a model into graph + aligned weights file, reusing fresh output"""
+    graph_path, weights_path, index_path = shared_weight_paths(model_path)
+    if (os.path.exists(index_path)
+            and os.path.getmtime(index_path) >= os.path.getmtime(model_path)):
+        return graph_path, weights_path, index_path
+
+    logger.info(f"Externalizing weights of {model_path}...")
+    model = onnx.load(model_path)
+    index = {}
+    offset = 0
+
+    with open(weights_path, "wb") as f:
+        for tensor in model.graph.initializer:
+            array = numpy_helper.to_array(tensor)
+            if array.nbytes < MIN_SHARED_BYTES:
+                continue
+
+            padding = (-offset) % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            f.write(np.ascontiguousarray(array).tobytes())
+
+            index[tensor.name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            external_data_helper.set_external_data(
+                tensor, location=os.path.basename(weights_path),
+                offset=offset, length=array.nbytes)
+            tensor.ClearField("raw_data")
+            tensor.data_location = TensorProto.EXTERNAL
+            offset += array.nbytes
+
+    onnx.save(model, graph_path)
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+
+    logger.info(f"✅ Wrote {len(index)} shared tensors ({offset / (1024 * 1024):.1f} MB)")
+    return graph_path, weights_path, index_path
+
+
+class SharedWeights:
+    """Memory-mapped weights that forked children bind as ORT initializers"""
+
+    def __init__(self, model_path: str):
+        self.graph_path, weights_path, index_path = externalize_weights(model_path)
+        with open(index_path, "r") as f:
+            self.index = json.load(f)
+
+        # MAP_PRIVATE mapping: pages are shared across forks until written
+        self._mmap = np.memmap(weights_path, dtype=np.uint8, mode="c")
+        self._ortvalues: Dict[str, ort.OrtValue] = {}
+
+    def prefault(self):
+        """Touch every page once in the parent so children start warm"""
+        page = os.sysconf("SC_PAGE_SIZE")
+        int(self._mmap[::page].sum())
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            name: np.ndarray(tuple(meta["shape"]), dtype=np.dtype(meta["dtype"]),
+                             buffer=self._mmap, offset=meta["offset"])
+            for name, meta in self.index.items()
+        }
+
+    def session_options(self, intra_op_threads: int = 1) -> ort.SessionOptions:
+        """Session options that bind the mapped weights instead of loading them"""
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        # Prepacking would give every process a private repacked copy
+        options.add_session_config_entry("session.disable_prepacking", "1")
+
+        if not self._ortvalues:
+            self._ortvalues = {name: ort.OrtValue.ortvalue_from_numpy(array)
+                               for name, array in self._arrays().items()}
+        for name, value in self._ortvalues.items():
+            options.add_initializer(name, value)
+        return options
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Speculative decoding for the Hyv generation worker.
+
+A small draft model (DistilGPT-2) proposes k tokens one at a time; the large
+target model (the GPT-2 export from convert_alternative_code_model) scores
+the context plus all k proposals in one forward pass. Proposals are accepted
+left to right with probability min(1, p/q) and the first rejection is
+resampled from the residual max(0, p - q), so the output follows the target
+model's distribution exactly (Leviathan et al., 2023). With temperature 0 a
+proposal is accepted when it is the target's argmax.
+
+k adapts per profile (the job's data type): an acceptance-rate estimate
+and the measured draft/target step cost pick the k with the most expected
+tokens per unit of time.
+
+Run as a script to benchmark plain target decoding against speculative
+decoding with prompts for each data type.
+"""
+
+import time
+import logging
+import argparse
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bucketed_session import BucketedSession
+
+logger = logging.getLogger(__name__)
+
+K_MIN = 1
+K_MAX = 8
+INITIAL_ACCEPTANCE = 0.7
+INITIAL_COST_RATIO = 0.3  # draft step time / target step time
+EMA_WEIGHT = 0.1
+
+
+@dataclass
+class SpeculativeStats:
+    """Counters for one profile (data type)"""
+    rounds: int = 0
+    proposed: int = 0
+    accepted: int = 0
+    generated: int = 0
+    acceptance: float = INITIAL_ACCEPTANCE
+    cost_ratio: float = INITIAL_COST_RATIO
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    @property
+    def tokens_per_round(self) -> float:
+        return self.generated / self.rounds if self.rounds else 0.0
+
+
+def _probabilities(logits: np.ndarray, temperature: float) -> np.ndarray:
+    scaled = logits.astype(np.float64) / temperature
+    scaled -= scaled.max(axis=-1, keepdims=True)
+    probs = np.exp(scaled)
+    return probs / probs.sum(axis=-1, keepdims=True)
+
+
+class SpeculativeDecoder:
+    """Draft-then-verify generation over two sessions sharing a vocabulary"""
+
+    def __init__(self, target: BucketedSession, draft: BucketedSession, eos_token_id: int,
+                 k_min: int = K_MIN, k_max: int = K_MAX):
+        if target.vocab_size != draft.vocab_size:
+            raise ValueError(f"Draft vocabulary ({draft.vocab_size}) does not match "
+                             f"the target's ({target.vocab_size})")
+        self.target = target
+        self.draft = draft
+        self.eos_token_id = eos_token_id
+        self.k_min = k_min
+        self.k_max = k_max
+        self.max_length = min(target.max_sequence_length, draft.max_sequence_length)
+        self.stats: Dict[str, SpeculativeStats] = {}
+
+    def _choose_k(self, stats: SpeculativeStats) -> int:
+        """k maximizing expected tokens per round over the round's cost"""
+        alpha = min(stats.acceptance, 0.99)
+        best_k, best_rate = self.k_min, 0.0
+        for k in range(self.k_min, self.k_max + 1):
+            expected_tokens = (1 - alpha ** (k + 1)) / (1 - alpha)
+            rate = expected_tokens / (k * stats.cost_ratio + 1)
+            if rate > best_rate:
+                best_k, best_rate = k, rate
+        return best_k
+
+    def _propose(self, context: List[int], k: int, temperature: float,
+                 rng: np.random.Generator) -> Tuple[List[int], List[Optional[np.ndarray]]]:
+        """Up to k draft tokens and the draft distribution each was drawn from"""
+        drafted: List[int] = []
+        distributions: List[Optional[np.ndarray]] = []
+        for _ in range(k):
+            logits = self.draft.next_token_logits([context + drafted])[0]
+            if temperature <= 0:
+                token = int(np.argmax(logits))
+                distributions.append(None)
+            else:
+                q = _probabilities(logits, temperature)
+                token = int(rng.choice(len(q), p=q))
+                distributions.append(q)
+            drafted.append(token)
+            if token == self.eos_token_id:
+                break
+        return drafted, distributions
+
+    def generate(self, tokens: List[int], max_tokens: int, temperature: float,
+                 rng: np.random.Generator, profile: str = "text",
+                 on_token: Optional[Callable[[int], None]] = None) -> List[int]:
+        """Generate up to max_tokens after `tokens`; returns the new token ids"""
+        stats = self.stats.setdefault(profile, SpeculativeStats())
+        tokens = list(tokens)
+        generated: List[int] = []
+
+        while len(generated) < max_tokens:
+            k = min(self._choose_k(stats), max_tokens - len(generated))
+            context = tokens[-(self.max_length - k):]
+
+            started = time.perf_counter()
+            drafted, distributions = self._propose(context, k, temperature, rng)
+            draft_time = (time.perf_counter() - started) / len(drafted)
+
+            started = time.perf_counter()
+            logits = self.target.forward([context + drafted])[0]
+            target_time = time.perf_counter() - started
+            # Position i predicts the token after context + drafted[:i]
+            first = len(context) - 1
+            verify = logits[first:first + len(drafted) + 1]
+
+            accepted: List[int] = []
+            correction: Optional[int] = None
+            for i, token in enumerate(drafted):
+                if temperature <= 0:
+                    best = int(np.argmax(verify[i]))
+                    if best == token:
+                        accepted.append(token)
+                        continue
+                    correction = best
+                    break
+                p = _probabilities(verify[i], temperature)
+                q = distributions[i]
+                if rng.random() < min(1.0, p[token] / q[token]):
+                    accepted.append(token)
+                    continue
+                residual = np.maximum(p - q, 0.0)
+                total = residual.sum()
+                correction = int(rng.choice(len(p), p=residual / total if total > 0 else p))
+                break
+            if correction is None and (not accepted or accepted[-1] != self.eos_token_id):
+                # Every proposal accepted: the target's next token comes for free
+                bonus = verify[len(drafted)]
+                if temperature <= 0:
+                    correction = int(np.argmax(bonus))
+                else:
+                    probs = _probabilities(bonus, temperature)
+                    correction = int(rng.choice(len(probs), p=probs))
+
+            stats.rounds += 1
+            stats.proposed += len(drafted)
+            stats.accepted += len(accepted)
+            trials = len(accepted) + (1 if len(accepted) < len(drafted) else 0)
+            stats.acceptance += EMA_WEIGHT * (len(accepted) / max(trials, 1) - stats.acceptance)
+            stats.cost_ratio += EMA_WEIGHT * (draft_time / max(target_time, 1e-9) - stats.cost_ratio)
+
+            new_tokens = accepted + ([correction] if correction is not None else [])
+            for token in new_tokens:
+                if token == self.eos_token_id or len(generated) >= max_tokens:
+                    stats.generated += len(generated)
+                    return generated
+                generated.append(token)
+                tokens.append(token)
+                if on_token is not None:
+                    on_token(token)
+
+        stats.generated += len(generated)
+        return generated
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            profile: {
+                "acceptance_rate": round(s.acceptance_rate, 3),
+                "tokens_per_round": round(s.tokens_per_round, 2),
+                "current_k": self._choose_k(s),
+            }
+            for profile, s in self.stats.items()
+        }
+
+
+# Representative prompts per job data type for the benchmark
+BENCHMARK_PROMPTS = {
+    "text": "Write a short product review for a pair of running shoes:",
+    "code": "def parse_config(path):\n    \"\"\"Load a JSON config file\"\"\"\n",
+    "json": 'Generate a customer record as JSON: {"name": "',
+    "csv": "name,age,city,signup_date\nAlice,34,Berlin,2023-04-01\n",
+}
+
+
+def _plain_generate(session: BucketedSession, tokens: List[int], max_tokens: int,
+                    temperature: float, rng: np.random.Generator, eos_token_id: int) -> List[int]:
+    tokens = list(tokens)
+    generated: List[int] = []
+    for _ in range(max_tokens):
+        logits = session.next_token_logits([tokens[-session.max_sequence_length:]])[0]
+        if temperature <= 0:
+            token = int(np.argmax(logits))
+        else:
+            probs = _probabilities(logits, temperature)
+            token = int(rng.choice(len(probs), p=probs))
+        if token == eos_token_id:
+            break
+        generated.append(token)
+        tokens.append(token)
+    return generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative decoding per data type")
+    parser.add_argument("target", help="target ONNX model (the GPT-2 export)")
+    parser.add_argument("draft", help="draft ONNX model (DistilGPT-2)")
+    parser.add_argument("tokenizer", help="tokenizer directory shared by both models")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--runs", type=int, default=5, help="generations per data type and mode")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    target = BucketedSession(args.target, pad_token_id=pad_token_id)
+    draft = BucketedSession(args.draft, pad_token_id=pad_token_id)
+    decoder = SpeculativeDecoder(target, draft, tokenizer.eos_token_id)
+
+    for data_type, prompt in BENCHMARK_PROMPTS.items():
+        tokens = tokenizer.encode(prompt)
+        timings = {}
+        for mode in ("plain", "speculative"):
+            rng = np.random.default_rng(args.seed)
+            count = 0
+            started = time.perf_counter()
+            for _ in range(args.runs):
+                if mode == "plain":
+                    out = _plain_generate(target, tokens, args.max_tokens, args.temperature,
+                                          rng, tokenizer.eos_token_id)
+                else:
+                    out = decoder.generate(tokens, args.max_tokens, args.temperature, rng,
+                                           profile=data_type)
+                count += len(out)
+            timings[mode] = count / max(time.perf_counter() - started, 1e-9)
+
+        stats = decoder.summary().get(data_type, {})
+        logger.info(f"📊 {data_type:5s}: plain {timings['plain']:.1f} tok/s, "
+                    f"speculative {timings['speculative']:.1f} tok/s "
+                    f"({timings['speculative'] / max(timings['plain'], 1e-9):.2f}x), "
+                    f"acceptance {stats.get('acceptance_rate', 0):.0%}, "
+                    f"{stats.get('tokens_per_round', 0):.2f} tokens/round, k={stats.get('current_k')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tokenization service for the Hyv generation worker.
+
+Wraps the Rust-backed fast tokenizer with:
+- batched encoding (one tokenizer call for many prompts)
+- a bounded LRU of encodings keyed by prompt hash, since job prompts
+  repeat heavily across templates
+- incremental detokenization from a precomputed id -> bytes table, so
+  streamed output never re-decodes the whole sequence
+"""
+
+import codecs
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+def _bytes_to_unicode() -> Dict[int, str]:
+    """GPT-2 byte-level BPE mapping from raw bytes to printable characters"""
+    bs = (list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1))
+          + list(range(ord("®"), ord("ÿ") + 1)))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, (chr(c) for c in cs)))
+
+
+def _prompt_key(prompt: str) -> bytes:
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+
+
+class IncrementalDetokenizer:
+    """Turns a stream of token ids into text one token at a time"""
+
+    def __init__(self, token_bytes: List[bytes]):
+        self._token_bytes = token_bytes
+        # Buffers partial multi-byte UTF-8 sequences split across tokens
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.text = ""
+
+    def push(self, token_id: int) -> str:
+        """Add one token and return the newly completed text"""
+        piece = self._decoder.decode(self._token_bytes[token_id])
+        self.text += piece
+        return piece
+
+    def flush(self) -> str:
+        """Emit any buffered partial character"""
+        piece = self._decoder.decode(b"", final=True)
+        self.text += piece
+        return piece
+
+
+class _FallbackDetokenizer:
+    """Prefix-diff detokenizer for tokenizers without a byte table"""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+        self._ids: List[int] = []
+        self.text = ""
+
+    def push(self, token_id: int) -> str:
+        self._ids.append(token_id)
+        text = self._tokenizer.decode(self._ids, skip_special_tokens=True)
+        piece = text[len(self.text):]
+        self.text = text
+        return piece
+
+    def flush(self) -> str:
+        return ""
+
+
+class TokenizationService:
+    """Batched, cached encoding and table-driven decoding"""
+
+    def __init__(self, tokenizer, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.token_bytes = self._build_token_bytes()
+        if self.token_bytes is None:
+            logger.warning("Tokenizer is not byte-level BPE; falling back to tokenizer.decode")
+
+    def _build_token_bytes(self) -> Optional[List[bytes]]:
+        """Precompute raw bytes for every token id, skipping special tokens"""
+        byte_decoder = {c: b for b, c in _bytes_to_unicode().items()}
+        special_ids = set(self.tokenizer.all_special_ids)
+        vocab_size = len(self.tokenizer)
+        tokens = self.tokenizer.convert_ids_to_tokens(list(range(vocab_size)))
+
+        table = []
+        for token_id, token in enumerate(tokens):
+            if token_id in special_ids or token is None:
+                table.append(b"")
+                continue
+            try:
+                table.append(bytes(byte_decoder[c] for c in token))
+            except KeyError:
+                return None
+        return table
+
+    def _remember(self, key: bytes, ids: tuple):
+        self._cache[key] = ids
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def encode_batch(self, prompts: Sequence[str]) -> List[List[int]]:
+        """Encode many prompts, tokenizing all cache misses in one call"""
+        keys = [_prompt_key(p) for p in prompts]
+        results: List[Optional[tuple]] = []
+        missing: Dict[bytes, str] = {}
+
+        for key, prompt in zip(keys, prompts):
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            elif key not in missing:
+                missing[key] = prompt
+                self.misses += 1
+            results.append(cached)
+
+        fresh: Dict[bytes, tuple] = {}
+        if missing:
+            encoded = self.tokenizer(list(missing.values()))["input_ids"]
+            for key, ids in zip(missing.keys(), encoded):
+                fresh[key] = tuple(ids)
+                self._remember(key, fresh[key])
+
+        # Fresh lists so callers can append generated tokens safely
+        return [list(r if r is not None else fresh[k]) for r, k in zip(results, keys)]
+
+    def encode(self, prompt: str) -> List[int]:
+        return self.encode_batch([prompt])[0]
+
+    def detokenizer(self):
+        if self.token_bytes is None:
+            return _FallbackDetokenizer(self.tokenizer)
+        return IncrementalDetokenizer(self.token_bytes)
+
+    def decode(self, token_ids: Sequence[int]) -> str:
+        if self.token_bytes is None:
+            return self.tokenizer.decode(list(token_ids), skip_special_tokens=True)
+        return b"".join(self.token_bytes[i] for i in token_ids).decode("utf-8", errors="replace")
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,193 @@
+// GPT-2 byte-level BPE tokenizer, loaded from a Hugging Face tokenizer.json.
+//
+// Mirrors the ByteLevel pre-tokenizer (GPT-2 split pattern, no prefix space)
+// and BPE model used by distilgpt2, without the regex engine or the full
+// tokenizers crate, so it builds for the canister target.
+
+use serde_json::Value;
+use std::collections::HashMap;
+
+pub struct Bpe {
+    encoder: HashMap<String, u32>,
+    decoder: HashMap<u32, String>,
+    ranks: HashMap<(String, String), u32>,
+    byte_encoder: [char; 256],
+    byte_decoder: HashMap<char, u8>,
+    pub eos_token_id: Option<u32>,
+}
+
+// GPT-2's reversible byte -> printable char table
+fn bytes_to_unicode() -> [char; 256] {
+    let mut table = ['\0'; 256];
+    let mut extra = 0u32;
+    for b in 0..=255u8 {
+        let printable = (b'!'..=b'~').contains(&b) || (0xA1..=0xAC).contains(&b) || (0xAE..=0xFF).contains(&b);
+        table[b as usize] = if printable {
+            b as char
+        } else {
+            extra += 1;
+            char::from_u32(255 + extra).unwrap()
+        };
+    }
+    table
+}
+
+fn is_letter(c: char) -> bool {
+    c.is_alphabetic()
+}
+
+fn is_number(c: char) -> bool {
+    c.is_numeric()
+}
+
+fn is_other(c: char) -> bool {
+    !c.is_whitespace() && !is_letter(c) && !is_number(c)
+}
+
+// Equivalent of the GPT-2 pattern
+// 's|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+
+fn pre_tokenize(text: &str) -> Vec<&str> {
+    let chars: Vec<(usize, char)> = text.char_indices().collect();
+    let byte_at = |i: usize| chars.get(i).map(|&(b, _)| b).unwrap_or(text.len());
+    let run = |mut i: usize, class: fn(char) -> bool| {
+        while i < chars.len() && class(chars[i].1) {
+            i += 1;
+        }
+        i
+    };
+
+    let mut pieces = Vec::new();
+    let mut i = 0;
+    while i < chars.len() {
+        let c = chars[i].1;
+        let start = i;
+
+        if c == '\'' {
+            let rest = &text[chars[i].0 + 1..];
+            let suffix = ["re", "ve", "ll", "s", "t", "m", "d"].iter().find(|s| rest.starts_with(**s));
+            if let Some(s) = suffix {
+                i += 1 + s.len();
+                pieces.push(&text[byte_at(start)..byte_at(i)]);
+                continue;
+            }
+        }
+
+        // Optional single leading space before a letter/number/other run
+        let body = if c == ' ' && i + 1 < chars.len() && !chars[i + 1].1.is_whitespace() { i + 1 } else { i };
+        let b = chars[body].1;
+        if !b.is_whitespace() {
+            let class: fn(char) -> bool = if is_letter(b) {
+                is_letter
+            } else if is_number(b) {
+                is_number
+            } else {
+                is_other
+            };
+            i = run(body, class);
+        } else {
+            let end = run(i, char::is_whitespace);
+            // Leave the last whitespace char to prefix the following word
+            i = if end < chars.len() && end - i > 1 { end - 1 } else { end };
+        }
+        pieces.push(&text[byte_at(start)..byte_at(i)]);
+    }
+    pieces
+}
+
+impl Bpe {
+    pub fn from_tokenizer_json(bytes: &[u8]) -> Result<Self, String> {
+        let json: Value = serde_json::from_slice(bytes).map_err(|e| format!("Invalid tokenizer.json: {}", e))?;
+        let model = &json["model"];
+        if model["type"] != "BPE" {
+            return Err("Only BPE tokenizers are supported".to_string());
+        }
+
+        let mut encoder = HashMap::new();
+        for (token, id) in model["vocab"].as_object().ok_or("Missing vocab")? {
+            encoder.insert(token.clone(), id.as_u64().ok_or("Bad vocab id")? as u32);
+        }
+        // Added tokens such as <|endoftext|> live outside the BPE vocab
+        if let Some(added) = json["added_tokens"].as_array() {
+            for token in added {
+                if let (Some(content), Some(id)) = (token["content"].as_str(), token["id"].as_u64()) {
+                    encoder.insert(content.to_string(), id as u32);
+                }
+            }
+        }
+        let decoder = encoder.iter().map(|(t, &id)| (id, t.clone())).collect();
+
+        let mut ranks = HashMap::new();
+        for (rank, merge) in model["merges"].as_array().ok_or("Missing merges")?.iter().enumerate() {
+            // Older files store "a b", newer ones ["a", "b"]
+            let pair = match merge {
+                Value::String(s) => s.split_once(' ').map(|(a, b)| (a.to_string(), b.to_string())),
+                Value::Array(p) if p.len() == 2 => {
+                    Some((p[0].as_str().unwrap_or_default().to_string(), p[1].as_str().unwrap_or_default().to_string()))
+                }
+                _ => None,
+            };
+            if let Some(pair) = pair {
+                ranks.insert(pair, rank as u32);
+            }
+        }
+
+        let byte_encoder = bytes_to_unicode();
+        let byte_decoder = byte_encoder.iter().enumerate().map(|(b, &c)| (c, b as u8)).collect();
+        let eos_token_id = encoder.get("<|endoftext|>").copied();
+
+        Ok(Self { encoder, decoder, ranks, byte_encoder, byte_decoder, eos_token_id })
+    }
+
+    fn bpe(&self, word: &str) -> Vec<String> {
+        let mut symbols: Vec<String> = word.chars().map(|c| c.to_string()).collect();
+        while symbols.len() > 1 {
+            let best = symbols
+                .windows(2)
+                .enumerate()
+                .filter_map(|(i, w)| self.ranks.get(&(w[0].clone(), w[1].clone())).map(|&r| (r, i)))
+                .min();
+            let Some((_, first)) = best else { break };
+            let (a, b) = (symbols[first].clone(), symbols[first + 1].clone());
+
+            let mut merged = Vec::with_capacity(symbols.len());
+            let mut i = 0;
+            while i < symbols.len() {
+                if i + 1 < symbols.len() && symbols[i] == a && symbols[i + 1] == b {
+                    merged.push(format!("{}{}", a, b));
+                    i += 2;
+                } else {
+                    merged.push(std::mem::take(&mut symbols[i]));
+                    i += 1;
+                }
+            }
+            symbols = merged;
+        }
+        symbols
+    }
+
+    pub fn encode(&self, text: &str) -> Vec<u32> {
+        let mut ids = Vec::new();
+        for piece in pre_tokenize(text) {
+            let mapped: String = piece.bytes().map(|b| self.byte_encoder[b as usize]).collect();
+            for symbol in self.bpe(&mapped) {
+                if let Some(&id) = self.encoder.get(&symbol) {
+                    ids.push(id);
+                }
+            }
+        }
+        ids
+    }
+
+    /// Raw bytes of one token; tokens may split UTF-8 sequences
+    pub fn token_bytes(&self, id: u32) -> Vec<u8> {
+        match self.decoder.get(&id) {
+            Some(token) => token.chars().filter_map(|c| self.byte_decoder.get(&c).copied()).collect(),
+            None => Vec::new(),
+        }
+    }
+
+    pub fn decode(&self, ids: &[u32]) -> String {
+        let bytes: Vec<u8> = ids.iter().flat_map(|&id| self.token_bytes(id)).collect();
+        String::from_utf8_lossy(&bytes).into_owned()
+    }
+}
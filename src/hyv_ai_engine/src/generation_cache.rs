@@ -0,0 +1,200 @@
+// Bounded generation result cache.
+//
+// Entries are keyed by a SHA-256 of everything that affects the output
+// (prompt, data type, max tokens, temperature) and evicted least recently
+// used first once either the byte budget or the entry limit is exceeded.
+// The cache can be written to a stable memory region before an upgrade and
+// restored afterwards; because its size is bounded, so is the upgrade cost.
+
+use ic_stable_structures::Memory;
+use sha2::{Digest, Sha256};
+use std::collections::{BTreeMap, HashMap};
+
+pub type CacheKey = [u8; 32];
+
+// Per-entry bookkeeping charged on top of the content bytes
+// (key, tick, map and order-index slots)
+const ENTRY_OVERHEAD: usize = 96;
+const WASM_PAGE_SIZE: u64 = 65536;
+
+#[derive(Clone, Copy, Default)]
+pub struct CacheStats {
+    pub hits: u64,
+    pub misses: u64,
+    pub insertions: u64,
+    pub evictions: u64,
+}
+
+struct Entry {
+    content: String,
+    last_used: u64,
+}
+
+pub struct GenerationCache {
+    entries: HashMap<CacheKey, Entry>,
+    // last_used tick -> key; the first entry is the least recently used
+    order: BTreeMap<u64, CacheKey>,
+    tick: u64,
+    bytes: usize,
+    max_bytes: usize,
+    max_entries: usize,
+    stats: CacheStats,
+}
+
+pub fn cache_key(prompt: &str, data_type: &str, max_tokens: u32, temperature: f32) -> CacheKey {
+    let mut hasher = Sha256::new();
+    // Length-prefix variable fields so ("ab", "c") and ("a", "bc") differ
+    for field in [prompt.as_bytes(), data_type.as_bytes()] {
+        hasher.update((field.len() as u64).to_le_bytes());
+        hasher.update(field);
+    }
+    hasher.update(max_tokens.to_le_bytes());
+    hasher.update(temperature.to_bits().to_le_bytes());
+    hasher.finalize().into()
+}
+
+fn entry_size(content: &str) -> usize {
+    content.len() + ENTRY_OVERHEAD
+}
+
+impl GenerationCache {
+    pub fn new(max_bytes: usize, max_entries: usize) -> Self {
+        Self {
+            entries: HashMap::new(),
+            order: BTreeMap::new(),
+            tick: 0,
+            bytes: 0,
+            max_bytes,
+            max_entries,
+            stats: CacheStats::default(),
+        }
+    }
+
+    fn next_tick(&mut self) -> u64 {
+        self.tick += 1;
+        self.tick
+    }
+
+    pub fn get(&mut self, key: &CacheKey) -> Option<String> {
+        let tick = self.next_tick();
+        match self.entries.get_mut(key) {
+            Some(entry) => {
+                self.order.remove(&entry.last_used);
+                self.order.insert(tick, *key);
+                entry.last_used = tick;
+                self.stats.hits += 1;
+                Some(entry.content.clone())
+            }
+            None => {
+                self.stats.misses += 1;
+                None
+            }
+        }
+    }
+
+    pub fn insert(&mut self, key: CacheKey, content: String) {
+        let size = entry_size(&content);
+        if size > self.max_bytes || self.max_entries == 0 {
+            return;
+        }
+        self.remove(&key);
+
+        let tick = self.next_tick();
+        self.order.insert(tick, key);
+        self.entries.insert(key, Entry { content, last_used: tick });
+        self.bytes += size;
+        self.stats.insertions += 1;
+
+        while self.bytes > self.max_bytes || self.entries.len() > self.max_entries {
+            let Some((_, oldest)) = self.order.pop_first() else { break };
+            if let Some(entry) = self.entries.remove(&oldest) {
+                self.bytes -= entry_size(&entry.content);
+                self.stats.evictions += 1;
+            }
+        }
+    }
+
+    fn remove(&mut self, key: &CacheKey) {
+        if let Some(entry) = self.entries.remove(key) {
+            self.order.remove(&entry.last_used);
+            self.bytes -= entry_size(&entry.content);
+        }
+    }
+
+    pub fn len(&self) -> usize {
+        self.entries.len()
+    }
+
+    pub fn bytes(&self) -> usize {
+        self.bytes
+    }
+
+    pub fn max_bytes(&self) -> usize {
+        self.max_bytes
+    }
+
+    pub fn stats(&self) -> CacheStats {
+        self.stats
+    }
+
+    /// Write all entries, least recently used first, to `memory`.
+    /// Layout: entry count (u64), then per entry key (32 bytes),
+    /// content length (u64) and content bytes.
+    pub fn save<M: Memory>(&self, memory: &M) {
+        let mut buf = Vec::with_capacity(8 + self.bytes);
+        buf.extend_from_slice(&(self.entries.len() as u64).to_le_bytes());
+        for key in self.order.values() {
+            let content = &self.entries[key].content;
+            buf.extend_from_slice(key);
+            buf.extend_from_slice(&(content.len() as u64).to_le_bytes());
+            buf.extend_from_slice(content.as_bytes());
+        }
+
+        let needed_pages = (buf.len() as u64).div_ceil(WASM_PAGE_SIZE);
+        if memory.size() < needed_pages && memory.grow(needed_pages - memory.size()) < 0 {
+            // Persistence is best effort; an empty region restores as an empty cache
+            return;
+        }
+        memory.write(0, &buf);
+    }
+
+    /// Rebuild a cache from `save` output, keeping recency order. Entries that
+    /// no longer fit the (possibly smaller) limits are evicted as usual.
+    pub fn restore<M: Memory>(memory: &M, max_bytes: usize, max_entries: usize) -> Self {
+        let mut cache = Self::new(max_bytes, max_entries);
+        if memory.size() == 0 {
+            return cache;
+        }
+
+        let limit = memory.size() * WASM_PAGE_SIZE;
+        let mut word = [0u8; 8];
+        memory.read(0, &mut word);
+        let count = u64::from_le_bytes(word);
+        let mut offset = 8u64;
+        for _ in 0..count {
+            if offset + 40 > limit {
+                break;
+            }
+            let mut key = [0u8; 32];
+            memory.read(offset, &mut key);
+            memory.read(offset + 32, &mut word);
+            let len = u64::from_le_bytes(word);
+            if offset + 40 + len > limit {
+                break;
+            }
+            let mut content = vec![0u8; len as usize];
+            memory.read(offset + 40, &mut content);
+            offset += 40 + len;
+
+            if let Ok(content) = String::from_utf8(content) {
+                cache.insert(key, content);
+            }
+        }
+        // Consume the snapshot so a later upgrade without persistence can't
+        // resurrect stale entries
+        memory.write(0, &0u64.to_le_bytes());
+        // Restoring is not traffic
+        cache.stats = CacheStats::default();
+        cache
+    }
+}
@@ -0,0 +1,212 @@
+// On-canister causal LM inference with tract.
+//
+// A generation advances one token per `step`. All state needed to resume
+// lives in `Generation` (token history, RNG, and the present key/value
+// tensors when the graph exports them), so the caller can spread a long
+// generation over many messages and stop whenever the instruction budget
+// of the current one runs low.
+//
+// Two graph layouts are supported:
+//   - logits only (input_ids [+ attention_mask, position_ids]): each step
+//     re-runs the trailing context window
+//   - with past (past_key_values.*.key/value inputs, present.* outputs): the
+//     prompt is prefilled once, then each step feeds a single token
+
+use anyhow::{anyhow, bail};
+use std::io::Cursor;
+use tract_onnx::prelude::*;
+
+pub const DEFAULT_MAX_CONTEXT: usize = 1024;
+
+enum Input {
+    InputIds,
+    AttentionMask,
+    PositionIds,
+    // Index into Generation::past, plus (heads, head_dim) for the empty prefill cache
+    Past { slot: usize, heads: usize, head_dim: usize },
+}
+
+pub struct TextModel {
+    plan: TypedRunnableModel<TypedModel>,
+    inputs: Vec<Input>,
+    // Output index producing each past slot
+    present_outputs: Vec<usize>,
+    max_context: usize,
+}
+
+pub struct Generation {
+    tokens: Vec<u32>,
+    prompt_len: usize,
+    max_new_tokens: usize,
+    temperature: f32,
+    rng: u64,
+    past: Option<TVec<TValue>>,
+    past_len: usize,
+    eos_token_id: Option<u32>,
+    pub done: bool,
+}
+
+impl Generation {
+    pub fn new(prompt_tokens: Vec<u32>, max_new_tokens: usize, temperature: f32, seed: u64, eos_token_id: Option<u32>) -> Self {
+        let done = prompt_tokens.is_empty() || max_new_tokens == 0;
+        Self {
+            prompt_len: prompt_tokens.len(),
+            tokens: prompt_tokens,
+            max_new_tokens,
+            temperature,
+            // xorshift state must be non-zero
+            rng: seed | 1,
+            past: None,
+            past_len: 0,
+            eos_token_id,
+            done,
+        }
+    }
+
+    pub fn generated(&self) -> &[u32] {
+        &self.tokens[self.prompt_len..]
+    }
+
+    fn next_random(&mut self) -> f32 {
+        self.rng ^= self.rng << 13;
+        self.rng ^= self.rng >> 7;
+        self.rng ^= self.rng << 17;
+        (self.rng >> 40) as f32 / (1u64 << 24) as f32
+    }
+}
+
+fn past_slot_for_present(name: &str) -> Option<String> {
+    name.strip_prefix("present").map(|rest| format!("past_key_values{}", rest))
+}
+
+impl TextModel {
+    pub fn load(onnx_bytes: &[u8], max_context: usize) -> TractResult<Self> {
+        let model = tract_onnx::onnx()
+            .model_for_read(&mut Cursor::new(onnx_bytes))?
+            .into_optimized()?;
+
+        let mut inputs = Vec::new();
+        let mut past_names = Vec::new();
+        for (i, outlet) in model.input_outlets()?.iter().enumerate() {
+            let name = model.node(outlet.node).name.as_str();
+            let input = match name {
+                "input_ids" => Input::InputIds,
+                "attention_mask" => Input::AttentionMask,
+                "position_ids" => Input::PositionIds,
+                n if n.starts_with("past_key_values") => {
+                    let shape = &model.input_fact(i)?.shape;
+                    let heads = shape[1].to_usize()?;
+                    let head_dim = shape[3].to_usize()?;
+                    past_names.push(n.to_string());
+                    Input::Past { slot: past_names.len() - 1, heads, head_dim }
+                }
+                other => bail!("Unsupported model input: {}", other),
+            };
+            inputs.push(input);
+        }
+
+        let mut present_outputs = vec![usize::MAX; past_names.len()];
+        for (i, outlet) in model.output_outlets()?.iter().enumerate() {
+            let label = model.outlet_label(*outlet).unwrap_or(model.node(outlet.node).name.as_str());
+            if let Some(past) = past_slot_for_present(label) {
+                if let Some(slot) = past_names.iter().position(|n| *n == past) {
+                    present_outputs[slot] = i;
+                }
+            }
+        }
+        if present_outputs.contains(&usize::MAX) {
+            bail!("Model has past_key_values inputs without matching present outputs");
+        }
+
+        Ok(Self { plan: model.into_runnable()?, inputs, present_outputs, max_context })
+    }
+
+    pub fn has_past(&self) -> bool {
+        !self.present_outputs.is_empty()
+    }
+
+    /// Run the model once and append the sampled token to `g`
+    pub fn step(&self, g: &mut Generation) -> TractResult<u32> {
+        if g.done {
+            bail!("Generation already finished");
+        }
+
+        // Tokens to feed this step and the position of the first one
+        let (feed, start) = match g.past {
+            Some(_) => (&g.tokens[g.tokens.len() - 1..], g.past_len),
+            None => {
+                let from = g.tokens.len().saturating_sub(self.max_context);
+                (&g.tokens[from..], 0)
+            }
+        };
+        let n = feed.len();
+        let ids: Vec<i64> = feed.iter().map(|&t| t as i64).collect();
+
+        let mut values: TVec<TValue> = tvec!();
+        for input in &self.inputs {
+            let value = match input {
+                Input::InputIds => Tensor::from_shape(&[1, n], &ids)?,
+                Input::AttentionMask => Tensor::from_shape(&[1, start + n], &vec![1i64; start + n])?,
+                Input::PositionIds => {
+                    let positions: Vec<i64> = (start..start + n).map(|p| p as i64).collect();
+                    Tensor::from_shape(&[1, n], &positions)?
+                }
+                Input::Past { slot, heads, head_dim } => match &g.past {
+                    Some(past) => {
+                        values.push(past[*slot].clone());
+                        continue;
+                    }
+                    None => Tensor::zero::<f32>(&[1, *heads, 0, *head_dim])?,
+                },
+            };
+            values.push(value.into_tvalue());
+        }
+
+        let mut outputs = self.plan.run(values)?;
+        let logits = outputs[0].to_array_view::<f32>()?;
+        let vocab = logits.shape()[2];
+        let last = logits.as_slice().ok_or_else(|| anyhow!("Non-contiguous logits"))?;
+        let row = &last[(n - 1) * vocab..n * vocab];
+        let token = sample(row, g.temperature, g);
+
+        if self.has_past() {
+            let present: TVec<TValue> = self.present_outputs.iter().map(|&i| outputs[i].clone()).collect();
+            outputs.clear();
+            g.past = Some(present);
+            g.past_len = start + n;
+        }
+
+        g.tokens.push(token);
+        let generated = g.tokens.len() - g.prompt_len;
+        let context_full = self.has_past() && g.past_len + 1 >= self.max_context;
+        if generated >= g.max_new_tokens || Some(token) == g.eos_token_id || context_full {
+            g.done = true;
+            // Drop the cache as soon as it can no longer be used
+            g.past = None;
+        }
+        Ok(token)
+    }
+}
+
+fn sample(logits: &[f32], temperature: f32, g: &mut Generation) -> u32 {
+    let argmax = logits
+        .iter()
+        .enumerate()
+        .fold((0, f32::NEG_INFINITY), |best, (i, &v)| if v > best.1 { (i, v) } else { best })
+        .0;
+    if temperature <= 0.0 {
+        return argmax as u32;
+    }
+
+    let max = logits[argmax];
+    let weights: Vec<f32> = logits.iter().map(|&v| ((v - max) / temperature).exp()).collect();
+    let total: f32 = weights.iter().sum();
+    let mut target = g.next_random() * total;
+    for (i, w) in weights.iter().enumerate() {
+        target -= w;
+        if target <= 0.0 {
+            return i as u32;
+        }
+    }
+    argmax as u32
+}
@@ -1,7 +1,34 @@
 use ic_cdk::api::time;
 use candid::{CandidType, Deserialize};
 use ic_cdk_macros::*;
-use std::collections::HashMap;
+
+mod bpe;
+mod generation_cache;
+mod inference;
+mod memory;
+mod model_store;
+
+use bpe::Bpe;
+use generation_cache::{cache_key, GenerationCache};
+use inference::{Generation, TextModel};
+use model_store::{ModelStore, UploadState};
+use std::cell::RefCell;
+use std::collections::BTreeMap;
+use std::time::Duration;
+
+// Generation cache limits
+const CACHE_MAX_BYTES: usize = 32 * 1024 * 1024;
+const CACHE_MAX_ENTRIES: usize = 10_000;
+// Keep cached results across upgrades (bounded by CACHE_MAX_BYTES)
+const PERSIST_GENERATION_CACHE: bool = true;
+
+// On-canister inference. A timer tick stops stepping generations once the
+// next step could push it past this many instructions (message limit is 40B).
+const TICK_INSTRUCTION_BUDGET: u64 = 20_000_000_000;
+// generate_synthetic_data runs the model inline only for short text requests
+const INLINE_MAX_TOKENS: u32 = 32;
+// Finished generations kept for get_generation before the oldest are dropped
+const MAX_FINISHED_GENERATIONS: usize = 1_000;
 
 // Type definitions - Fixed derives
 #[derive(CandidType, Deserialize, Clone)]
@@ -28,10 +55,129 @@ pub struct PromptAnalysis {
     pub confidence_score: f32,   // 0.0 to 1.0
 }
 
+#[derive(CandidType, Deserialize, Clone, Copy)]
+pub enum ModelKind {
+    Text,
+    Code,
+    TextTokenizer,
+}
+
+#[derive(CandidType, Deserialize, Clone)]
+pub enum ModelUploadState {
+    Empty,
+    Uploading,
+    Complete,
+}
+
+#[derive(CandidType, Deserialize, Clone)]
+pub struct ModelUploadProgress {
+    pub state: ModelUploadState,
+    pub size: u64,
+    pub chunk_count: u64,
+    pub last_chunk_hash: Option<Vec<u8>>,
+    pub digest: Option<Vec<u8>>, // SHA-256 over all chunk hashes, once complete
+}
+
+#[derive(CandidType, Deserialize, Clone)]
+pub struct GenerationStatus {
+    pub done: bool,
+    pub text: String,
+    pub tokens_generated: u32,
+    pub error: Option<String>,
+}
+
+#[derive(CandidType, Deserialize, Clone)]
+pub struct InferenceBenchmark {
+    pub prompt_tokens: u32,
+    pub generated_tokens: u32,
+    pub kv_cache: bool,
+    pub load_instructions: u64,
+    pub prefill_instructions: u64,
+    pub instructions_per_token: u64,
+}
+
+struct TextEngine {
+    model: TextModel,
+    tokenizer: Bpe,
+}
+
+struct GenerationJob {
+    generation: Generation,
+    error: Option<String>,
+    // Instructions spent on this job's last step; the estimate for its next one
+    last_step_cost: u64,
+}
+
 // Storage for caching results
 thread_local! {
-    static GENERATION_CACHE: std::cell::RefCell<HashMap<String, String>> = std::cell::RefCell::new(HashMap::new());
+    static GENERATION_CACHE: std::cell::RefCell<GenerationCache> =
+        std::cell::RefCell::new(GenerationCache::new(CACHE_MAX_BYTES, CACHE_MAX_ENTRIES));
     static GENERATION_COUNT: std::cell::RefCell<u64> = std::cell::RefCell::new(0);
+
+    static TEXT_MODEL: ModelStore<memory::Memory> = ModelStore::init(
+        memory::get(memory::TEXT_MODEL_DATA),
+        memory::get(memory::TEXT_MODEL_MANIFEST),
+    );
+    static CODE_MODEL: ModelStore<memory::Memory> = ModelStore::init(
+        memory::get(memory::CODE_MODEL_DATA),
+        memory::get(memory::CODE_MODEL_MANIFEST),
+    );
+    static TEXT_TOKENIZER: ModelStore<memory::Memory> = ModelStore::init(
+        memory::get(memory::TEXT_TOKENIZER_DATA),
+        memory::get(memory::TEXT_TOKENIZER_MANIFEST),
+    );
+
+    // Heap-only: rebuilt from the uploaded files by setup_models / post_upgrade
+    static TEXT_ENGINE: RefCell<Option<TextEngine>> = RefCell::new(None);
+    static GENERATIONS: RefCell<BTreeMap<u64, GenerationJob>> = RefCell::new(BTreeMap::new());
+    static NEXT_GENERATION_ID: RefCell<u64> = RefCell::new(0);
+    static TICK_SCHEDULED: RefCell<bool> = RefCell::new(false);
+    // Cost of the most recent prompt prefill, used to budget the next one
+    static PREFILL_COST: RefCell<u64> = RefCell::new(0);
+}
+
+fn with_model_store<R>(kind: ModelKind, f: impl FnOnce(&ModelStore<memory::Memory>) -> R) -> R {
+    match kind {
+        ModelKind::Text => TEXT_MODEL.with(f),
+        ModelKind::Code => CODE_MODEL.with(f),
+        ModelKind::TextTokenizer => TEXT_TOKENIZER.with(f),
+    }
+}
+
+fn caller_is_controller() -> Result<(), String> {
+    if ic_cdk::api::is_controller(&ic_cdk::caller()) {
+        Ok(())
+    } else {
+        Err("Only controllers can manage models".to_string())
+    }
+}
+
+#[pre_upgrade]
+fn pre_upgrade() {
+    if PERSIST_GENERATION_CACHE {
+        GENERATION_CACHE.with(|c| c.borrow().save(&memory::get(memory::GENERATION_CACHE)));
+    }
+}
+
+#[post_upgrade]
+fn post_upgrade() {
+    if PERSIST_GENERATION_CACHE {
+        let restored = GenerationCache::restore(
+            &memory::get(memory::GENERATION_CACHE),
+            CACHE_MAX_BYTES,
+            CACHE_MAX_ENTRIES,
+        );
+        GENERATION_CACHE.with(|c| *c.borrow_mut() = restored);
+    }
+    // Reload the text model outside the upgrade message, which has its own
+    // instruction limit
+    ic_cdk_timers::set_timer(Duration::ZERO, || {
+        if text_model_uploaded() {
+            if let Err(e) = load_text_engine() {
+                ic_cdk::println!("Reloading text model failed: {}", e);
+            }
+        }
+    });
 }
 
 // Health and status functions
@@ -42,48 +188,342 @@ fn health() -> String {
 
 #[query]
 fn status() -> String {
-    let cache_size = GENERATION_CACHE.with(|c| c.borrow().len());
+    let (entries, bytes, max_bytes, stats) = GENERATION_CACHE.with(|c| {
+        let c = c.borrow();
+        (c.len(), c.bytes(), c.max_bytes(), c.stats())
+    });
     let total_generations = GENERATION_COUNT.with(|c| *c.borrow());
     format!(
-        "Cache: {} entries, Total generations: {}, Status: Ready",
-        cache_size, total_generations
+        "Cache: {} entries, {}/{} bytes, {} hits, {} misses, {} evictions, Total generations: {}, Status: Ready",
+        entries, bytes, max_bytes, stats.hits, stats.misses, stats.evictions, total_generations
     )
 }
 
 #[query]
 fn get_loaded_models() -> Vec<String> {
+    let text = TEXT_ENGINE.with(|e| match e.borrow().as_ref() {
+        Some(engine) if engine.model.has_past() => "DistilGPT-2 (Text Generation, KV cache)".to_string(),
+        Some(_) => "DistilGPT-2 (Text Generation)".to_string(),
+        None => "Mock DistilGPT-2 (Text Generation)".to_string(),
+    });
     vec![
-        "Mock DistilGPT-2 (Text Generation)".to_string(),
+        text,
         "Mock CodeT5 (Code Generation)".to_string(),
         "Mock Tabular Generator".to_string(),
     ]
 }
 
-// Mock model management (compatibility with existing scripts)
-#[update]
-fn clear_text_model_bytes() {}
+// Model upload. Chunks are written straight to stable memory.
+#[update(guard = "caller_is_controller")]
+fn clear_text_model_bytes() {
+    TEXT_MODEL.with(|m| m.clear());
+}
 
-#[update]
-fn clear_code_model_bytes() {}
+#[update(guard = "caller_is_controller")]
+fn clear_code_model_bytes() {
+    CODE_MODEL.with(|m| m.clear());
+}
 
-#[update]
-fn append_text_model_bytes(_data: Vec<u8>) {}
+#[update(guard = "caller_is_controller")]
+fn append_text_model_bytes(data: Vec<u8>) {
+    TEXT_MODEL.with(|m| m.append(&data)).unwrap_or_else(|e| ic_cdk::trap(&e));
+}
 
-#[update]
-fn append_code_model_bytes(_data: Vec<u8>) {}
+#[update(guard = "caller_is_controller")]
+fn append_code_model_bytes(data: Vec<u8>) {
+    CODE_MODEL.with(|m| m.append(&data)).unwrap_or_else(|e| ic_cdk::trap(&e));
+}
 
-#[update]
+#[update(guard = "caller_is_controller")]
+fn clear_model_upload(kind: ModelKind) {
+    with_model_store(kind, |m| m.clear());
+}
+
+// Resumable upload: re-sending an already stored chunk is a no-op
+#[update(guard = "caller_is_controller")]
+fn put_model_chunk(kind: ModelKind, index: u64, data: Vec<u8>) -> Result<(), String> {
+    with_model_store(kind, |m| m.put_chunk(index, &data))
+}
+
+#[update(guard = "caller_is_controller")]
+fn complete_model_upload(kind: ModelKind, total_size: u64) -> Result<Vec<u8>, String> {
+    with_model_store(kind, |m| m.complete(total_size)).map(|d| d.to_vec())
+}
+
+#[query]
+fn get_model_upload_progress(kind: ModelKind) -> ModelUploadProgress {
+    with_model_store(kind, |m| {
+        let manifest = m.manifest();
+        ModelUploadProgress {
+            state: match manifest.state {
+                UploadState::Empty => ModelUploadState::Empty,
+                UploadState::Uploading => ModelUploadState::Uploading,
+                UploadState::Complete => ModelUploadState::Complete,
+            },
+            size: manifest.size,
+            chunk_count: manifest.chunk_count,
+            last_chunk_hash: manifest
+                .chunk_count
+                .checked_sub(1)
+                .and_then(|i| m.chunk_hash(i))
+                .map(|h| h.to_vec()),
+            digest: manifest.digest.map(|d| d.to_vec()),
+        }
+    })
+}
+
+#[query]
+fn get_model_chunk_hashes(kind: ModelKind, start: u64, count: u64) -> Vec<Vec<u8>> {
+    // Bounded so the reply stays well under the message size limit
+    let count = count.min(10_000);
+    with_model_store(kind, |m| m.chunk_hashes(start, count).into_iter().map(|h| h.to_vec()).collect())
+}
+
+fn text_model_uploaded() -> bool {
+    [ModelKind::Text, ModelKind::TextTokenizer]
+        .into_iter()
+        .all(|kind| with_model_store(kind, |m| m.manifest().state == UploadState::Complete))
+}
+
+fn load_text_engine() -> Result<(), String> {
+    let tokenizer = Bpe::from_tokenizer_json(&with_model_store(ModelKind::TextTokenizer, |m| m.read_all())?)?;
+    let onnx = with_model_store(ModelKind::Text, |m| m.read_all())?;
+    let model = TextModel::load(&onnx, inference::DEFAULT_MAX_CONTEXT).map_err(|e| format!("Loading model failed: {}", e))?;
+    TEXT_ENGINE.with(|e| *e.borrow_mut() = Some(TextEngine { model, tokenizer }));
+    Ok(())
+}
+
+#[update(guard = "caller_is_controller")]
 fn setup_models() -> Result<String, String> {
-    Ok("🎭 Mock AI generation system initialized! Ready for high-quality synthetic data generation.".to_string())
+    if !text_model_uploaded() {
+        return Ok("🎭 Mock AI generation system initialized! Upload DistilGPT-2 and its tokenizer to enable on-canister inference.".to_string());
+    }
+    load_text_engine()?;
+    let kv = TEXT_ENGINE.with(|e| e.borrow().as_ref().map_or(false, |e| e.model.has_past()));
+    Ok(format!(
+        "🧠 DistilGPT-2 loaded for on-canister inference ({})",
+        if kv { "KV cache" } else { "windowed recompute" }
+    ))
+}
+
+fn generation_seed() -> u64 {
+    time() ^ NEXT_GENERATION_ID.with(|n| *n.borrow()).rotate_left(32)
+}
+
+fn generation_status(job: &GenerationJob, tokenizer: &Bpe) -> GenerationStatus {
+    let generated = job.generation.generated();
+    GenerationStatus {
+        done: job.generation.done,
+        text: tokenizer.decode(generated),
+        tokens_generated: generated.len() as u32,
+        error: job.error.clone(),
+    }
+}
+
+/// Run one step, recording its cost and turning model errors into a
+/// finished job
+fn step_job(engine: &TextEngine, job: &mut GenerationJob) {
+    let prefill = job.generation.generated().is_empty();
+    let before = ic_cdk::api::instruction_counter();
+    if let Err(e) = engine.model.step(&mut job.generation) {
+        job.error = Some(e.to_string());
+        job.generation.done = true;
+    }
+    job.last_step_cost = ic_cdk::api::instruction_counter() - before;
+    if prefill {
+        PREFILL_COST.with(|c| *c.borrow_mut() = job.last_step_cost);
+    }
+}
+
+fn estimated_step_cost(job: &GenerationJob) -> u64 {
+    if job.generation.generated().is_empty() {
+        PREFILL_COST.with(|c| *c.borrow())
+    } else {
+        job.last_step_cost
+    }
+}
+
+fn within_budget(cost: u64) -> bool {
+    ic_cdk::api::instruction_counter() + cost <= TICK_INSTRUCTION_BUDGET
+}
+
+fn schedule_generation_tick() {
+    let scheduled = TICK_SCHEDULED.with(|t| std::mem::replace(&mut *t.borrow_mut(), true));
+    if !scheduled {
+        ic_cdk_timers::set_timer(Duration::ZERO, generation_tick);
+    }
+}
+
+// Advance all unfinished generations round-robin, one token each per pass,
+// until the tick's instruction budget is spent. KV state stays in the jobs,
+// so the next tick picks up exactly where this one stopped. The first step
+// of a tick always runs, so a step costing more than the budget (a long
+// prefill) still makes progress instead of rescheduling forever.
+fn generation_tick() {
+    TICK_SCHEDULED.with(|t| *t.borrow_mut() = false);
+    let more = TEXT_ENGINE.with(|e| {
+        let engine = e.borrow();
+        GENERATIONS.with(|g| {
+            let mut jobs = g.borrow_mut();
+            let Some(engine) = engine.as_ref() else {
+                for job in jobs.values_mut().filter(|j| !j.generation.done) {
+                    job.error = Some("Text model is not loaded".to_string());
+                    job.generation.done = true;
+                }
+                return false;
+            };
+            let mut stepped = false;
+            loop {
+                let pending: Vec<u64> = jobs.iter().filter(|(_, j)| !j.generation.done).map(|(id, _)| *id).collect();
+                if pending.is_empty() {
+                    return false;
+                }
+                for id in pending {
+                    let job = jobs.get_mut(&id).expect("pending job");
+                    if stepped && !within_budget(estimated_step_cost(job)) {
+                        return true;
+                    }
+                    step_job(engine, job);
+                    stepped = true;
+                }
+            }
+        })
+    });
+    if more {
+        schedule_generation_tick();
+    }
+}
+
+fn prune_finished_generations(jobs: &mut BTreeMap<u64, GenerationJob>) {
+    let finished: Vec<u64> = jobs.iter().filter(|(_, j)| j.generation.done).map(|(id, _)| *id).collect();
+    for id in finished.iter().take(finished.len().saturating_sub(MAX_FINISHED_GENERATIONS)) {
+        jobs.remove(id);
+    }
+}
+
+/// Queue a real model generation; poll it with get_generation
+#[update]
+fn start_generation(prompt: String, config: GenerationConfig) -> Result<u64, String> {
+    let generation = TEXT_ENGINE.with(|e| {
+        let engine = e.borrow();
+        let engine = engine.as_ref().ok_or("Text model is not loaded; call setup_models")?;
+        let tokens = engine.tokenizer.encode(&prompt);
+        if tokens.is_empty() {
+            return Err("Prompt is empty".to_string());
+        }
+        Ok(Generation::new(
+            tokens,
+            config.max_tokens as usize,
+            config.temperature,
+            generation_seed(),
+            engine.tokenizer.eos_token_id,
+        ))
+    })?;
+
+    let id = NEXT_GENERATION_ID.with(|n| {
+        let mut n = n.borrow_mut();
+        *n += 1;
+        *n
+    });
+    GENERATIONS.with(|g| {
+        let mut jobs = g.borrow_mut();
+        jobs.insert(id, GenerationJob { generation, error: None, last_step_cost: 0 });
+        prune_finished_generations(&mut jobs);
+    });
+    GENERATION_COUNT.with(|c| *c.borrow_mut() += 1);
+    schedule_generation_tick();
+    Ok(id)
+}
+
+#[query]
+fn get_generation(id: u64) -> Option<GenerationStatus> {
+    TEXT_ENGINE.with(|e| {
+        let engine = e.borrow();
+        let tokenizer = &engine.as_ref()?.tokenizer;
+        GENERATIONS.with(|g| g.borrow().get(&id).map(|job| generation_status(job, tokenizer)))
+    })
+}
+
+/// Generate up to INLINE_MAX_TOKENS within the current message. Stops early
+/// (returning the text so far) rather than running out of instructions, and
+/// returns None if not even the prefill fits. The flag is true when the
+/// generation finished (EOS or max_tokens) rather than hitting the budget.
+fn generate_inline(prompt: &str, config: &GenerationConfig) -> Option<(String, bool)> {
+    TEXT_ENGINE.with(|e| {
+        let engine = e.borrow();
+        let engine = engine.as_ref()?;
+        let tokens = engine.tokenizer.encode(prompt);
+        if tokens.is_empty() {
+            return None;
+        }
+        let max_tokens = config.max_tokens.min(INLINE_MAX_TOKENS) as usize;
+        let generation = Generation::new(tokens, max_tokens, config.temperature, generation_seed(), engine.tokenizer.eos_token_id);
+        let mut job = GenerationJob { generation, error: None, last_step_cost: 0 };
+        let mut steps = 0;
+        while !job.generation.done && within_budget(estimated_step_cost(&job)) {
+            step_job(engine, &mut job);
+            steps += 1;
+        }
+        if steps == 0 || job.error.is_some() {
+            return None;
+        }
+        Some((engine.tokenizer.decode(job.generation.generated()), job.generation.done))
+    })
+}
+
+/// Local benchmark: load cost, prompt prefill cost and average instructions
+/// per generated token, all measured in this one message
+#[update(guard = "caller_is_controller")]
+fn benchmark_text_generation(prompt: String, tokens: u32) -> Result<InferenceBenchmark, String> {
+    let start = ic_cdk::api::instruction_counter();
+    let loaded = TEXT_ENGINE.with(|e| e.borrow().is_some());
+    if !loaded {
+        load_text_engine()?;
+    }
+    let load_instructions = if loaded { 0 } else { ic_cdk::api::instruction_counter() - start };
+
+    TEXT_ENGINE.with(|e| {
+        let engine = e.borrow();
+        let engine = engine.as_ref().ok_or("Text model is not loaded")?;
+        let prompt_tokens = engine.tokenizer.encode(&prompt);
+        let prompt_len = prompt_tokens.len() as u32;
+        // Greedy, and no EOS, so every run generates exactly `tokens`
+        let generation = Generation::new(prompt_tokens, tokens.max(1) as usize, 0.0, 0, None);
+        let mut job = GenerationJob { generation, error: None, last_step_cost: 0 };
+
+        step_job(engine, &mut job);
+        let prefill_instructions = job.last_step_cost;
+        let mut decode_instructions = 0;
+        while !job.generation.done {
+            if !within_budget(job.last_step_cost) {
+                break;
+            }
+            step_job(engine, &mut job);
+            decode_instructions += job.last_step_cost;
+        }
+        if let Some(e) = job.error {
+            return Err(e);
+        }
+
+        let generated_tokens = job.generation.generated().len() as u32;
+        Ok(InferenceBenchmark {
+            prompt_tokens: prompt_len,
+            generated_tokens,
+            kv_cache: engine.model.has_past(),
+            load_instructions,
+            prefill_instructions,
+            instructions_per_token: decode_instructions / (generated_tokens.max(2) - 1) as u64,
+        })
+    })
 }
 
 // Main generation function
 #[update]
 async fn generate_synthetic_data(prompt: String, config: GenerationConfig) -> GenerationResult {
-    let cache_key = format!("{}:{}:{}", prompt, config.data_type, config.max_tokens);
+    let cache_key = cache_key(&prompt, &config.data_type, config.max_tokens, config.temperature);
     
     // Check cache first
-    if let Some(cached_result) = GENERATION_CACHE.with(|c| c.borrow().get(&cache_key).cloned()) {
+    if let Some(cached_result) = GENERATION_CACHE.with(|c| c.borrow_mut().get(&cache_key)) {
         return GenerationResult {
             success: true,
             content: cached_result,
@@ -96,19 +536,30 @@ async fn generate_synthetic_data(prompt: String, config: GenerationConfig) -> Ge
         *c.borrow_mut() += 1;
     });
 
-    let content = match config.data_type.as_str() {
-        "text" => generate_intelligent_text(&prompt, config.max_tokens, config.temperature),
-        "code" => generate_intelligent_code(&prompt, config.max_tokens),
-        "tabular" => generate_intelligent_tabular(&prompt, config.max_tokens),
-        "json" => generate_intelligent_json(&prompt, config.max_tokens),
-        "csv" => generate_intelligent_csv(&prompt, config.max_tokens),
-        _ => generate_intelligent_text(&prompt, config.max_tokens, config.temperature),
+    // Short text requests run on the loaded model; everything else, or any
+    // request while no model is loaded, uses the template generators
+    let inline = match config.data_type.as_str() {
+        "text" if config.max_tokens <= INLINE_MAX_TOKENS => generate_inline(&prompt, &config),
+        _ => None,
     };
 
-    // Cache the result
-    GENERATION_CACHE.with(|c| {
-        c.borrow_mut().insert(cache_key, content.clone());
-    });
+    let (content, complete) = match (inline, config.data_type.as_str()) {
+        (Some((text, done)), _) => (text, done),
+        (None, "text") => (generate_intelligent_text(&prompt, config.max_tokens, config.temperature), true),
+        (None, "code") => (generate_intelligent_code(&prompt, config.max_tokens), true),
+        (None, "tabular") => (generate_intelligent_tabular(&prompt, config.max_tokens), true),
+        (None, "json") => (generate_intelligent_json(&prompt, config.max_tokens), true),
+        (None, "csv") => (generate_intelligent_csv(&prompt, config.max_tokens), true),
+        (None, _) => (generate_intelligent_text(&prompt, config.max_tokens, config.temperature), true),
+    };
+
+    // Cache the result, unless the instruction budget cut it short: the
+    // partial text would be served to every identical request from then on
+    if complete {
+        GENERATION_CACHE.with(|c| {
+            c.borrow_mut().insert(cache_key, content.clone());
+        });
+    }
 
     GenerationResult {
         success: true,
@@ -0,0 +1,29 @@
+// Stable memory layout. Each consumer gets its own virtual memory from a
+// single MemoryManager, so regions can grow independently across upgrades.
+// Never renumber an existing MemoryId; only append new ones.
+
+use ic_stable_structures::memory_manager::{MemoryId, MemoryManager, VirtualMemory};
+use ic_stable_structures::DefaultMemoryImpl;
+use std::cell::RefCell;
+
+pub type Memory = VirtualMemory<DefaultMemoryImpl>;
+
+/// Snapshot of the generation cache written in pre_upgrade
+pub const GENERATION_CACHE: MemoryId = MemoryId::new(0);
+/// Uploaded model bytes and their manifests (see model_store.rs)
+pub const TEXT_MODEL_DATA: MemoryId = MemoryId::new(1);
+pub const TEXT_MODEL_MANIFEST: MemoryId = MemoryId::new(2);
+pub const CODE_MODEL_DATA: MemoryId = MemoryId::new(3);
+pub const CODE_MODEL_MANIFEST: MemoryId = MemoryId::new(4);
+/// tokenizer.json for the text model, uploaded like a model file
+pub const TEXT_TOKENIZER_DATA: MemoryId = MemoryId::new(5);
+pub const TEXT_TOKENIZER_MANIFEST: MemoryId = MemoryId::new(6);
+
+thread_local! {
+    static MEMORY_MANAGER: RefCell<MemoryManager<DefaultMemoryImpl>> =
+        RefCell::new(MemoryManager::init(DefaultMemoryImpl::default()));
+}
+
+pub fn get(id: MemoryId) -> Memory {
+    MEMORY_MANAGER.with(|m| m.borrow().get(id))
+}
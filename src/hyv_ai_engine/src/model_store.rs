@@ -0,0 +1,243 @@
+// Stable-memory store for uploaded model files.
+//
+// Each model owns two stable regions:
+//
+//   data      the model bytes, contiguous from offset 0. Incoming chunks are
+//             written straight here and never accumulate on the heap.
+//   manifest  a fixed header (state, size, chunk count, final digest)
+//             followed by one entry per chunk: SHA-256 (32 bytes) and the
+//             chunk's end offset in `data` (u64).
+//
+// The digest of a completed upload is SHA-256 over the concatenated chunk
+// hashes, which uploaders can recompute locally without rehashing the file.
+
+use ic_stable_structures::Memory;
+use sha2::{Digest, Sha256};
+
+const WASM_PAGE_SIZE: u64 = 65536;
+const MAGIC: u32 = 0x4859_564d; // "HYVM"
+const HEADER_SIZE: u64 = 64;
+const ENTRY_SIZE: u64 = 40;
+
+// Header field offsets
+const STATE_OFFSET: u64 = 4;
+const SIZE_OFFSET: u64 = 8;
+const CHUNKS_OFFSET: u64 = 16;
+const DIGEST_OFFSET: u64 = 24;
+
+#[derive(Clone, Copy, PartialEq, Eq, Debug)]
+pub enum UploadState {
+    Empty,
+    Uploading,
+    Complete,
+}
+
+impl UploadState {
+    fn from_byte(b: u8) -> Self {
+        match b {
+            1 => UploadState::Uploading,
+            2 => UploadState::Complete,
+            _ => UploadState::Empty,
+        }
+    }
+
+    fn to_byte(self) -> u8 {
+        match self {
+            UploadState::Empty => 0,
+            UploadState::Uploading => 1,
+            UploadState::Complete => 2,
+        }
+    }
+}
+
+#[derive(Clone, Debug)]
+pub struct Manifest {
+    pub state: UploadState,
+    pub size: u64,
+    pub chunk_count: u64,
+    pub digest: Option<[u8; 32]>,
+}
+
+pub struct ModelStore<M: Memory> {
+    data: M,
+    manifest: M,
+}
+
+fn ensure_capacity<M: Memory>(memory: &M, bytes: u64) -> Result<(), String> {
+    let pages = bytes.div_ceil(WASM_PAGE_SIZE);
+    let have = memory.size();
+    if pages > have && memory.grow(pages - have) < 0 {
+        return Err("Out of stable memory".to_string());
+    }
+    Ok(())
+}
+
+fn read_u64<M: Memory>(memory: &M, offset: u64) -> u64 {
+    let mut word = [0u8; 8];
+    memory.read(offset, &mut word);
+    u64::from_le_bytes(word)
+}
+
+fn write_u64<M: Memory>(memory: &M, offset: u64, value: u64) {
+    memory.write(offset, &value.to_le_bytes());
+}
+
+impl<M: Memory> ModelStore<M> {
+    pub fn init(data: M, manifest: M) -> Self {
+        let store = Self { data, manifest };
+        let mut magic = [0u8; 4];
+        if store.manifest.size() > 0 {
+            store.manifest.read(0, &mut magic);
+        }
+        if u32::from_le_bytes(magic) != MAGIC {
+            ensure_capacity(&store.manifest, HEADER_SIZE).expect("manifest header");
+            store.manifest.write(0, &MAGIC.to_le_bytes());
+            store.reset();
+        }
+        store
+    }
+
+    fn state(&self) -> UploadState {
+        let mut b = [0u8; 1];
+        self.manifest.read(STATE_OFFSET, &mut b);
+        UploadState::from_byte(b[0])
+    }
+
+    fn set_state(&self, state: UploadState) {
+        self.manifest.write(STATE_OFFSET, &[state.to_byte()]);
+    }
+
+    pub fn size(&self) -> u64 {
+        read_u64(&self.manifest, SIZE_OFFSET)
+    }
+
+    pub fn chunk_count(&self) -> u64 {
+        read_u64(&self.manifest, CHUNKS_OFFSET)
+    }
+
+    fn reset(&self) {
+        self.set_state(UploadState::Empty);
+        write_u64(&self.manifest, SIZE_OFFSET, 0);
+        write_u64(&self.manifest, CHUNKS_OFFSET, 0);
+        self.manifest.write(DIGEST_OFFSET, &[0u8; 32]);
+    }
+
+    /// Forget the current upload. Regions keep their pages and are overwritten
+    /// by the next upload.
+    pub fn clear(&self) {
+        self.reset();
+    }
+
+    pub fn manifest(&self) -> Manifest {
+        let state = self.state();
+        let digest = if state == UploadState::Complete {
+            let mut d = [0u8; 32];
+            self.manifest.read(DIGEST_OFFSET, &mut d);
+            Some(d)
+        } else {
+            None
+        };
+        Manifest {
+            state,
+            size: self.size(),
+            chunk_count: self.chunk_count(),
+            digest,
+        }
+    }
+
+    fn entry_offset(index: u64) -> u64 {
+        HEADER_SIZE + index * ENTRY_SIZE
+    }
+
+    pub fn chunk_hash(&self, index: u64) -> Option<[u8; 32]> {
+        if index >= self.chunk_count() {
+            return None;
+        }
+        let mut hash = [0u8; 32];
+        self.manifest.read(Self::entry_offset(index), &mut hash);
+        Some(hash)
+    }
+
+    pub fn chunk_hashes(&self, start: u64, count: u64) -> Vec<[u8; 32]> {
+        let end = self.chunk_count().min(start.saturating_add(count));
+        (start..end).filter_map(|i| self.chunk_hash(i)).collect()
+    }
+
+    /// Append the next chunk and return its index
+    pub fn append(&self, chunk: &[u8]) -> Result<u64, String> {
+        if self.state() == UploadState::Complete {
+            return Err("Model upload already complete; clear it first".to_string());
+        }
+        let index = self.chunk_count();
+        let offset = self.size();
+        let end = offset + chunk.len() as u64;
+
+        ensure_capacity(&self.data, end)?;
+        ensure_capacity(&self.manifest, Self::entry_offset(index + 1))?;
+        self.data.write(offset, chunk);
+
+        let hash: [u8; 32] = Sha256::digest(chunk).into();
+        let entry = Self::entry_offset(index);
+        self.manifest.write(entry, &hash);
+        write_u64(&self.manifest, entry + 32, end);
+
+        // Header last: a trap above leaves the previous manifest intact
+        write_u64(&self.manifest, SIZE_OFFSET, end);
+        write_u64(&self.manifest, CHUNKS_OFFSET, index + 1);
+        self.set_state(UploadState::Uploading);
+        Ok(index)
+    }
+
+    /// Idempotent append for resumable uploads: re-sending a chunk that is
+    /// already stored with the same hash is a no-op.
+    pub fn put_chunk(&self, index: u64, chunk: &[u8]) -> Result<(), String> {
+        let count = self.chunk_count();
+        if index < count {
+            let hash: [u8; 32] = Sha256::digest(chunk).into();
+            return if self.chunk_hash(index) == Some(hash) {
+                Ok(())
+            } else {
+                Err(format!("Chunk {} already stored with different content", index))
+            };
+        }
+        if index > count {
+            return Err(format!("Expected chunk {}, got {}", count, index));
+        }
+        self.append(chunk).map(|_| ())
+    }
+
+    /// Seal the upload once the uploader has sent `expected_size` bytes
+    pub fn complete(&self, expected_size: u64) -> Result<[u8; 32], String> {
+        let size = self.size();
+        if size != expected_size {
+            return Err(format!("Size mismatch: stored {} bytes, expected {}", size, expected_size));
+        }
+        if size == 0 {
+            return Err("No model data uploaded".to_string());
+        }
+
+        let mut hasher = Sha256::new();
+        for hash in self.chunk_hashes(0, self.chunk_count()) {
+            hasher.update(hash);
+        }
+        let digest: [u8; 32] = hasher.finalize().into();
+        self.manifest.write(DIGEST_OFFSET, &digest);
+        self.set_state(UploadState::Complete);
+        Ok(digest)
+    }
+
+    /// Copy `buf.len()` model bytes starting at `offset`
+    pub fn read(&self, offset: u64, buf: &mut [u8]) {
+        self.data.read(offset, buf);
+    }
+
+    /// The whole file of a completed upload
+    pub fn read_all(&self) -> Result<Vec<u8>, String> {
+        if self.state() != UploadState::Complete {
+            return Err("Model upload is not complete".to_string());
+        }
+        let mut bytes = vec![0u8; self.size() as usize];
+        self.data.read(0, &mut bytes);
+        Ok(bytes)
+    }
+}
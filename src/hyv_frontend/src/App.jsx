@@ -8,8 +8,12 @@ import ModelSearch from './components/ModelSearch';
 import ModelGrid from './components/ModelGrid';
 import Marketplace from './components/Marketplace';
 import GenerationPage from './components/GenerationPage';
+import { syncCatalog } from './catalogCache';
 import './index.css';
 
+const DATASET_PAGE_SIZE = 50n;
+const DATASET_CONTENT_CHUNK = 1_000_000n;
+
 function App() {
   // Authentication state
   const [authClient, setAuthClient] = useState(null);
@@ -46,6 +50,9 @@ function App() {
   const [videoError, setVideoError] = useState(false);
   const videoRef = useRef(null);
 
+  // Catalog version of the last sync; polling refreshes only when it moves
+  const catalogVersionRef = useRef(null);
+
   // Initialize app readiness
   useEffect(() => {
     if (!isInitializing && (videoLoaded || videoError)) {
@@ -84,8 +91,11 @@ function App() {
 
       try {
         setConnectionStatus("connecting");
-        await backendActor.listDatasets();
+        const version = await backendActor.getCatalogVersion();
         setConnectionStatus("connected");
+        if (catalogVersionRef.current !== null && version !== catalogVersionRef.current) {
+          fetchDatasets();
+        }
       } catch (error) {
         console.error("Connection check failed:", error);
         setConnectionStatus("failed");
@@ -280,19 +290,94 @@ function App() {
     console.log("Preloading video");
   };
 
+  // Page through metadata only; content is fetched when a dataset is opened
+  const fetchAllDatasetSummaries = async () => {
+    const result = [];
+    let cursor = [];
+    do {
+      const page = await backendActor.listDatasetSummaries(cursor, DATASET_PAGE_SIZE, { Newest: null });
+      result.push(...page.items);
+      cursor = page.nextCursor;
+    } while (cursor.length > 0);
+    return result;
+  };
+
+  // Refresh from the local catalog cache; only changes since the cached
+  // version are fetched from the backend
   const fetchDatasets = async () => {
     if (!backendActor) return;
     setLoading(true);
     try {
-      const result = await backendActor.listDatasets();
+      const catalog = await syncCatalog(backendActor, backendCanisterId, async () => ({
+        datasets: await fetchAllDatasetSummaries(),
+        models: await backendActor.listModelSummaries(),
+      }));
+      catalogVersionRef.current = catalog.version;
+      // Newest first, as listDatasetSummaries returns them
+      const result = [...catalog.datasets].sort((a, b) => (a.id < b.id ? 1 : a.id > b.id ? -1 : 0));
       setDatasets(result);
-      console.log("Datasets fetched:", result.length);
+      console.log("Datasets fetched:", result.length, "catalog version:", catalog.version);
     } catch (error) {
       console.error("Failed to fetch datasets:", error);
     }
     setLoading(false);
   };
 
+  // Load a dataset's content in chunks so large datasets stay under message limits
+  const fetchDatasetContent = async (id) => {
+    const parts = [];
+    let offset = 0n;
+    let total = null;
+    while (total === null || offset < total) {
+      const chunk = await backendActor.getDatasetContent(id, offset, DATASET_CONTENT_CHUNK);
+      if (chunk.length === 0) return null;
+      const { data, totalSize } = chunk[0];
+      total = totalSize;
+      if (data.length === 0) break;
+      parts.push(new Uint8Array(data));
+      offset += BigInt(data.length);
+    }
+    const bytes = new Uint8Array(parts.reduce((n, p) => n + p.length, 0));
+    let pos = 0;
+    for (const p of parts) {
+      bytes.set(p, pos);
+      pos += p.length;
+    }
+    return new TextDecoder().decode(bytes);
+  };
+
+  // Dataset downloads are not certified, so they are served from the raw
+  // domain; the certifying gateway at <canister>.icp0.io rejects them
+  const datasetUrl = (id) =>
+    process.env.DFX_NETWORK === "ic"
+      ? `https://${backendCanisterId}.raw.icp0.io/datasets/${id}`
+      : `http://${backendCanisterId}.raw.localhost:4943/datasets/${id}`;
+
+  const viewDataset = async (dataset) => {
+    // Columnar (Parquet) datasets are binary: describe them instead of
+    // downloading and decoding the whole file as text
+    const contentType = dataset.contentType?.[0];
+    if (contentType && dataset.content === undefined) {
+      dataset = {
+        ...dataset,
+        content: `Columnar dataset (${contentType}), ${Number(dataset.contentSize).toLocaleString()} bytes. ` +
+          `Download it from ${datasetUrl(dataset.id)}; readers can fetch single ` +
+          `columns or row groups with HTTP Range requests.`,
+      };
+    }
+    if (dataset.content === undefined && backendActor) {
+      try {
+        const content = await fetchDatasetContent(dataset.id);
+        dataset = { ...dataset, content: content ?? "" };
+      } catch (error) {
+        console.error("Failed to fetch dataset content:", error);
+        return;
+      }
+    }
+    setCurrentDataset(dataset);
+    setShowDataModal(true);
+  };
+
   const fetchJobs = async () => {
     if (!backendActor) return;
     try {
@@ -499,7 +584,7 @@ function App() {
       }
 
       await Promise.all([
-        backendActor.listDatasets(),
+        backendActor.getCatalogVersion(),
         backendActor.listPendingJobs()
       ]);
 
@@ -681,10 +766,7 @@ function App() {
             loading={loading}
             onRefresh={fetchDatasets}
             onPurchaseDataset={handlePurchaseDataset}
-            onViewDataset={(dataset) => {
-              setCurrentDataset(dataset);
-              setShowDataModal(true);
-            }}
+            onViewDataset={viewDataset}
             isAuthenticated={isAuthenticated}
           />
         ) : (
@@ -698,10 +780,7 @@ function App() {
             onCancelJob={cancelCurrentJob}
             jobs={jobs}
             onRefreshJobs={fetchJobs}
-            onViewDataset={(dataset) => {
-              setCurrentDataset(dataset);
-              setShowDataModal(true);
-            }}
+            onViewDataset={viewDataset}
             backendActor={backendActor}
             isAuthenticated={isAuthenticated}
             onLogin={() => setShowLogin(true)}
@@ -0,0 +1,114 @@
+// Local IndexedDB copy of the marketplace catalog (dataset and model
+// summaries, never model files), kept current from the backend's change log.
+// A refresh asks only for what changed since the cached catalog version, so
+// its cost follows the rate of change instead of the catalog size.
+
+// Version 1 cached models with their file chunks; upgrading drops it all
+// and the next sync starts from a full load
+const DB_VERSION = 2;
+const STORES = ['datasets', 'models', 'meta'];
+
+const dbPromises = new Map();
+
+const requestResult = (request) =>
+  new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+
+const transactionDone = (tx) =>
+  new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = () => reject(tx.error);
+    tx.onabort = () => reject(tx.error);
+  });
+
+// One database per backend canister, so local and mainnet caches never mix
+const openCatalogDb = (canisterId) => {
+  if (!dbPromises.has(canisterId)) {
+    const request = indexedDB.open(`hyv-catalog-${canisterId}`, DB_VERSION);
+    request.onupgradeneeded = () => {
+      for (const name of Array.from(request.result.objectStoreNames)) {
+        request.result.deleteObjectStore(name);
+      }
+      for (const name of STORES) {
+        request.result.createObjectStore(name);
+      }
+    };
+    dbPromises.set(canisterId, requestResult(request));
+  }
+  return dbPromises.get(canisterId);
+};
+
+const readCatalog = async (db) => {
+  const tx = db.transaction(STORES, 'readonly');
+  const [datasets, models, version] = await Promise.all([
+    requestResult(tx.objectStore('datasets').getAll()),
+    requestResult(tx.objectStore('models').getAll()),
+    requestResult(tx.objectStore('meta').get('version')),
+  ]);
+  return { datasets, models, version: version ?? null };
+};
+
+// Upsert changed items and advance the version in one transaction, so the
+// cache never holds a version whose changes it has not applied.
+// Ids are nat (BigInt) and IndexedDB keys can't be BigInt, hence String(id).
+const writeChanges = async (db, { datasets, models, version, reset }) => {
+  const tx = db.transaction(STORES, 'readwrite');
+  const datasetStore = tx.objectStore('datasets');
+  const modelStore = tx.objectStore('models');
+  if (reset) {
+    datasetStore.clear();
+    modelStore.clear();
+  }
+  datasets.forEach((dataset) => datasetStore.put(dataset, String(dataset.id)));
+  models.forEach((model) => modelStore.put(model, String(model.id)));
+  tx.objectStore('meta').put(version, 'version');
+  await transactionDone(tx);
+};
+
+// Full load: take the version first, so anything that changes while
+// `loadAll` runs is replayed by the next delta (upserts are idempotent)
+const resync = async (db, actor, loadAll) => {
+  const version = await actor.getCatalogVersion();
+  const { datasets, models } = await loadAll();
+  await writeChanges(db, { datasets, models, version, reset: true });
+};
+
+/**
+ * Bring the local catalog up to date and return it as
+ * { datasets, models, version }.
+ *
+ * `loadAll` fetches the full catalog ({ datasets, models }, both as
+ * summaries) and is only used for the first sync, or when the cache is older
+ * than the backend's change log. Without IndexedDB it is used every time.
+ */
+export const syncCatalog = async (actor, canisterId, loadAll) => {
+  if (typeof indexedDB === 'undefined') {
+    const version = await actor.getCatalogVersion();
+    return { ...(await loadAll()), version };
+  }
+
+  const db = await openCatalogDb(canisterId);
+  let { version } = await readCatalog(db);
+
+  if (version === null) {
+    await resync(db, actor, loadAll);
+  } else {
+    let more = true;
+    while (more) {
+      const delta = await actor.listChangesSince(version);
+      if (delta.reset) {
+        await resync(db, actor, loadAll);
+        break;
+      }
+      if (delta.version !== version) {
+        await writeChanges(db, { ...delta, reset: false });
+        version = delta.version;
+      }
+      more = delta.more;
+    }
+  }
+
+  return readCatalog(db);
+};
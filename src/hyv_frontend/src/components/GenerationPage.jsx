@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 
 function GenerationPage({
   prompt,
@@ -17,6 +17,49 @@ function GenerationPage({
 }) {
   const [selectedTemplate, setSelectedTemplate] = useState('');
   const [advancedConfig, setAdvancedConfig] = useState(false);
+  const [liveOutput, setLiveOutput] = useState({ jobId: null, text: '', truncated: false });
+
+  // Poll the worker's partial output while the current job is processing
+  useEffect(() => {
+    const jobId = currentJob?.id;
+    if (jobId === undefined || jobId === null || jobStatus !== "polling" ||
+        typeof backendActor?.getJobOutput !== 'function') {
+      return;
+    }
+
+    let nextSeq = 0;
+    let cancelled = false;
+    let timer = null;
+    setLiveOutput({ jobId, text: '', truncated: false });
+
+    // The next poll is scheduled only after this one returns, so two
+    // requests never ask for the same chunks
+    const poll = async () => {
+      try {
+        const output = await backendActor.getJobOutput(BigInt(jobId), BigInt(nextSeq));
+        if (cancelled) return;
+        if (output.chunks.length > 0) {
+          nextSeq = Number(output.nextSeq);
+          setLiveOutput(prev => ({
+            jobId,
+            text: (prev.jobId === jobId ? prev.text : '') + output.chunks.join(''),
+            truncated: output.truncated
+          }));
+        }
+      } catch (error) {
+        console.error("Failed to fetch partial output:", error);
+      }
+      if (!cancelled) {
+        timer = setTimeout(poll, 1000);
+      }
+    };
+
+    poll();
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [currentJob?.id, jobStatus, backendActor]);
 
   // Generation templates
   const templates = [
@@ -331,6 +374,16 @@ function GenerationPage({
                   </p>
                 </div>
 
+                {liveOutput.jobId === currentJob.id && liveOutput.text && jobStatus !== "completed" && (
+                  <div className="job-live-output">
+                    <strong>Live Output:</strong>
+                    <pre className="live-output-text">
+                      {liveOutput.text}
+                      {liveOutput.truncated && "\n… (preview truncated; the full dataset will be available when the job completes)"}
+                    </pre>
+                  </div>
+                )}
+
                 {currentJob.error && (
                   <div className="job-error-display">
                     <strong>❌ Error:</strong>
@@ -184,7 +184,8 @@ function Marketplace({
                   <div className="meta-item">
                     <span className="meta-icon">📊</span>
                     <span className="meta-text">
-                      {dataset.content ? dataset.content.length : 0} characters
+                      {Number(dataset.contentSize ?? 0).toLocaleString()} bytes
+                      {dataset.contentType?.[0] === 'application/vnd.apache.parquet' ? ' · Parquet' : ''}
                     </span>
                   </div>
                   <div className="meta-item">
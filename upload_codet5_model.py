@@ -8,6 +8,7 @@ import os
 import subprocess
 import sys
 import json
+import re
 from pathlib import Path
 
 # State tracking - same file as DistilGPT-2 script
@@ -20,6 +21,7 @@ def get_model_config():
         "clear_func": "clear_code_model_bytes",
         "append_func": "append_code_model_bytes",
         "display_name": "CodeT5-small",
+        "kind": "Code",
         "model_type": "code_model"
     }
 
@@ -50,8 +52,32 @@ def get_upload_state():
         return state[TARGET_MODEL]["completed_chunks"], state[TARGET_MODEL]["total_chunks"]
     return 0, 0
 
-def upload_model_chunk(chunk_data, function_name):
-    """Upload a single chunk of binary data"""
+def get_canister_progress(kind):
+    """Read back how many chunks the canister has stored (None if unavailable)"""
+    result = subprocess.run(
+        ['dfx', 'canister', 'call', 'hyv_ai_engine', 'get_model_upload_progress', f'(variant {{ {kind} }})'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    match = re.search(r'chunk_count\s*=\s*([\d_]+)', result.stdout)
+    if not match:
+        return None
+    return int(match.group(1).replace('_', ''))
+
+def complete_upload(kind, file_size):
+    """Seal the upload; the canister checks the stored size"""
+    result = subprocess.run(
+        ['dfx', 'canister', 'call', 'hyv_ai_engine', 'complete_model_upload', f'(variant {{ {kind} }}, {file_size} : nat64)'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0 or 'Err' in result.stdout:
+        print(f"❌ Completing upload failed: {result.stderr or result.stdout}")
+        return False
+    return True
+
+def upload_model_chunk(chunk_data, kind, index):
+    """Upload a single chunk of binary data (idempotent per chunk index)"""
     # Convert to hex (like the working upload_models.py)
     hex_data = chunk_data.hex()
     
@@ -59,12 +85,16 @@ def upload_model_chunk(chunk_data, function_name):
     candid_blob = 'blob "' + ''.join(f'\\{hex_data[i:i+2]}' for i in range(0, len(hex_data), 2)) + '"'
     
     # Call dfx with the properly formatted data
-    cmd = ['dfx', 'canister', 'call', 'hyv_ai_engine', function_name, candid_blob]
+    args = f'(variant {{ {kind} }}, {index} : nat64, {candid_blob})'
+    cmd = ['dfx', 'canister', 'call', 'hyv_ai_engine', 'put_model_chunk', args]
     
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
         if result.returncode != 0:
             print(f"❌ dfx error: {result.stderr}")
+        elif 'Err' in result.stdout:
+            print(f"❌ Canister rejected chunk: {result.stdout.strip()}")
+            return False
         return result.returncode == 0
     except subprocess.TimeoutExpired:
         print("⏰ Timeout uploading chunk")
@@ -88,8 +118,11 @@ def upload_codet5(resume=True):
     print(f"🔄 Uploading {config['display_name']} ({TARGET_MODEL})")
     print("=" * 60)
     
-    # Check previous progress
+    # Check previous progress; the canister's manifest is authoritative
     completed_chunks, prev_total = get_upload_state()
+    stored_chunks = get_canister_progress(config['kind'])
+    if stored_chunks is not None:
+        completed_chunks = stored_chunks
     
     if completed_chunks > 0 and resume:
         print(f"🔄 Found previous upload: {completed_chunks} chunks completed")
@@ -121,7 +154,7 @@ def upload_codet5(resume=True):
             if not chunk_data:
                 break
             
-            if upload_model_chunk(chunk_data, config['append_func']):
+            if upload_model_chunk(chunk_data, config['kind'], chunk_num - 1):
                 print("✅")
                 save_upload_state(chunk_num, total_chunks)
             else:
@@ -129,6 +162,9 @@ def upload_codet5(resume=True):
                 print(f"❌ Failed at chunk {chunk_num}. Run script again to resume from here.")
                 return False
     
+    if not complete_upload(config['kind'], file_size):
+        return False
+
     # Clear state on successful completion
     if os.path.exists(STATE_FILE):
         with open(STATE_FILE, 'r') as f:
@@ -8,11 +8,13 @@ import os
 import subprocess
 import sys
 import json
+import re
 from pathlib import Path
 
 # State tracking
 STATE_FILE = "upload_state.json"
 TARGET_MODEL = "distilgpt2.onnx"
+TOKENIZER_PATH = os.path.join("models", "distilgpt2_tokenizer", "tokenizer.json")
 
 def get_model_config():
     """Get upload configuration for DistilGPT-2"""
@@ -20,6 +22,7 @@ def get_model_config():
         "clear_func": "clear_text_model_bytes",
         "append_func": "append_text_model_bytes",
         "display_name": "DistilGPT-2",
+        "kind": "Text",
         "model_type": "text_model"
     }
 
@@ -50,8 +53,32 @@ def get_upload_state():
         return state[TARGET_MODEL]["completed_chunks"], state[TARGET_MODEL]["total_chunks"]
     return 0, 0
 
-def upload_model_chunk(chunk_data, function_name):
-    """Upload a single chunk of binary data"""
+def get_canister_progress(kind):
+    """Read back how many chunks the canister has stored (None if unavailable)"""
+    result = subprocess.run(
+        ['dfx', 'canister', 'call', 'hyv_ai_engine', 'get_model_upload_progress', f'(variant {{ {kind} }})'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    match = re.search(r'chunk_count\s*=\s*([\d_]+)', result.stdout)
+    if not match:
+        return None
+    return int(match.group(1).replace('_', ''))
+
+def complete_upload(kind, file_size):
+    """Seal the upload; the canister checks the stored size"""
+    result = subprocess.run(
+        ['dfx', 'canister', 'call', 'hyv_ai_engine', 'complete_model_upload', f'(variant {{ {kind} }}, {file_size} : nat64)'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0 or 'Err' in result.stdout:
+        print(f"❌ Completing upload failed: {result.stderr or result.stdout}")
+        return False
+    return True
+
+def upload_model_chunk(chunk_data, kind, index):
+    """Upload a single chunk of binary data (idempotent per chunk index)"""
     # Convert to hex
     hex_data = chunk_data.hex()
     
@@ -59,12 +86,16 @@ def upload_model_chunk(chunk_data, function_name):
     candid_blob = 'blob "' + ''.join(f'\\{hex_data[i:i+2]}' for i in range(0, len(hex_data), 2)) + '"'
     
     # Call dfx with the properly formatted data
-    cmd = ['dfx', 'canister', 'call', 'hyv_ai_engine', function_name, candid_blob]
+    args = f'(variant {{ {kind} }}, {index} : nat64, {candid_blob})'
+    cmd = ['dfx', 'canister', 'call', 'hyv_ai_engine', 'put_model_chunk', args]
     
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
         if result.returncode != 0:
             print(f"❌ dfx error: {result.stderr}")
+        elif 'Err' in result.stdout:
+            print(f"❌ Canister rejected chunk: {result.stdout.strip()}")
+            return False
         return result.returncode == 0
     except subprocess.TimeoutExpired:
         print("⏰ Timeout uploading chunk")
@@ -87,8 +118,11 @@ def upload_distilgpt2(resume=True):
     print(f"🔄 Uploading {config['display_name']} ({TARGET_MODEL})")
     print("=" * 60)
     
-    # Check previous progress
+    # Check previous progress; the canister's manifest is authoritative
     completed_chunks, prev_total = get_upload_state()
+    stored_chunks = get_canister_progress(config['kind'])
+    if stored_chunks is not None:
+        completed_chunks = stored_chunks
     
     if completed_chunks > 0 and resume:
         print(f"🔄 Found previous upload: {completed_chunks} chunks completed")
@@ -120,7 +154,7 @@ def upload_distilgpt2(resume=True):
             if not chunk_data:
                 break
             
-            if upload_model_chunk(chunk_data, config['append_func']):
+            if upload_model_chunk(chunk_data, config['kind'], chunk_num - 1):
                 print("✅")
                 save_upload_state(chunk_num, total_chunks)
             else:
@@ -128,6 +162,9 @@ def upload_distilgpt2(resume=True):
                 print(f"❌ Failed at chunk {chunk_num}. Run script again to resume from here.")
                 return False
     
+    if not complete_upload(config['kind'], file_size):
+        return False
+
     # Clear state on successful completion
     if os.path.exists(STATE_FILE):
         with open(STATE_FILE, 'r') as f:
@@ -140,6 +177,35 @@ def upload_distilgpt2(resume=True):
     print(f"✅ Successfully uploaded {config['display_name']}!")
     return True
 
+def upload_tokenizer():
+    """Upload tokenizer.json so the canister can tokenize prompts itself"""
+    if not os.path.exists(TOKENIZER_PATH):
+        print(f"❌ {TOKENIZER_PATH} not found")
+        print("💡 Run the model conversion script first to save the tokenizer")
+        return False
+
+    print("🔤 Uploading DistilGPT-2 tokenizer...")
+    subprocess.run(['dfx', 'canister', 'call', 'hyv_ai_engine', 'clear_model_upload', '(variant { TextTokenizer })'],
+                   capture_output=True, text=True)
+
+    file_size = os.path.getsize(TOKENIZER_PATH)
+    chunk_size = 16384
+    with open(TOKENIZER_PATH, 'rb') as f:
+        index = 0
+        while True:
+            chunk_data = f.read(chunk_size)
+            if not chunk_data:
+                break
+            if not upload_model_chunk(chunk_data, "TextTokenizer", index):
+                print(f"❌ Failed at tokenizer chunk {index + 1}")
+                return False
+            index += 1
+
+    if not complete_upload("TextTokenizer", file_size):
+        return False
+    print(f"✅ Tokenizer uploaded ({file_size:,} bytes)")
+    return True
+
 def setup_distilgpt2():
     """Setup DistilGPT-2 model after upload"""
     config = get_model_config()
@@ -182,12 +248,12 @@ def main():
     
     # Upload the model
     print(f"\n🚀 Starting DistilGPT-2 upload...")
-    if upload_distilgpt2():
+    if upload_distilgpt2() and upload_tokenizer():
         # Setup the model
         if setup_distilgpt2():
             print("\n🎉 Upload and setup completed successfully!")
             print("📝 You can now test text generation with:")
-            print("   dfx canister call hyv_ai_engine generate_text '(\"Hello world\")'")
+            print("   dfx canister call hyv_ai_engine start_generation '(\"Hello world\", record { max_tokens = 50 : nat32; temperature = 0.7 : float32; data_type = \"text\" })'")
         else:
             print("\n⚠️  Upload succeeded but setup failed")
     else: